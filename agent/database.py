@@ -1,7 +1,7 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 
 # Configuración de base de datos
@@ -25,6 +25,45 @@ class ArchitectureAnalysis(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     processed_successfully = Column(Boolean, default=True)
 
+class RequestMetrics(Base):
+    __tablename__ = "request_metrics"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    analysis_id = Column(Integer, ForeignKey("architecture_analyses.id"), index=True)  # análisis guardado o reutilizado
+    endpoint = Column(String(200), nullable=False, index=True)
+    status = Column(String(50), default='success')
+    analysis_path = Column(String(50))  # local, cache, model, fallback, similar
+    model_name = Column(String(100))
+    llm_calls = Column(Integer, default=0)
+    estimated_calls = Column(Integer, default=0)  # llamadas con consumo estimado (stream cancelado)
+    hedges = Column(Integer, default=0)  # duplicados del router (coste incluido, tiempo no)
+    prompt_tokens = Column(Integer, default=0)
+    output_tokens = Column(Integer, default=0)
+    cost_usd = Column(Float, default=0.0)
+    # Tiempo de reloj por etapa (ms); NULL si la etapa no se ejecutó
+    total_ms = Column(Float)
+    llm_ms = Column(Float)
+    parse_ms = Column(Float)
+    validate_ms = Column(Float)
+    generate_ms = Column(Float)
+    db_ms = Column(Float)
+    minio_ms = Column(Float)
+    git_ms = Column(Float)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class AnalysisCacheEntry(Base):
+    __tablename__ = "analysis_cache"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), unique=True, index=True, nullable=False)  # sha256 de contenido + prompt + modelo
+    input_type = Column(String(50), nullable=False)  # 'text' or 'image'
+    model_name = Column(String(100))
+    prompt_version = Column(String(50))
+    result_json = Column(Text, nullable=False)
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime)
+
 class GitHubConfig(Base):
     __tablename__ = "github_configs"
     
@@ -73,6 +112,101 @@ def get_recent_analyses(db, limit: int = 10):
         ArchitectureAnalysis.created_at.desc()
     ).limit(limit).all()
 
+def get_analyses_after(db, after_id: int = 0, input_type: str = None, limit: int = 1000):
+    """Obtener análisis correctos con id mayor que after_id, en orden de id"""
+    query = db.query(ArchitectureAnalysis).filter(
+        ArchitectureAnalysis.id > after_id,
+        ArchitectureAnalysis.processed_successfully == True
+    )
+    if input_type:
+        query = query.filter(ArchitectureAnalysis.input_type == input_type)
+    return query.order_by(ArchitectureAnalysis.id.asc()).limit(limit).all()
+
+def get_analysis(db, analysis_id: int):
+    """Obtener un análisis por id"""
+    return db.query(ArchitectureAnalysis).filter(ArchitectureAnalysis.id == analysis_id).first()
+
+def get_cached_analysis(db, cache_key: str):
+    """Obtener análisis cacheado vigente por clave"""
+    entry = db.query(AnalysisCacheEntry).filter(AnalysisCacheEntry.cache_key == cache_key).first()
+    if not entry:
+        return None
+    
+    if entry.expires_at and entry.expires_at < datetime.utcnow():
+        db.delete(entry)
+        db.commit()
+        return None
+    
+    entry.hit_count = (entry.hit_count or 0) + 1
+    db.commit()
+    return entry
+
+def save_cached_analysis(db, cache_key: str, input_type: str, result_json: str,
+                         model_name: str = None, prompt_version: str = None,
+                         ttl_seconds: int = None):
+    """Guardar (o reemplazar) análisis en la caché persistente"""
+    expires_at = datetime.utcnow() + timedelta(seconds=ttl_seconds) if ttl_seconds else None
+    
+    entry = db.query(AnalysisCacheEntry).filter(AnalysisCacheEntry.cache_key == cache_key).first()
+    if entry:
+        entry.result_json = result_json
+        entry.model_name = model_name
+        entry.prompt_version = prompt_version
+        entry.created_at = datetime.utcnow()
+        entry.expires_at = expires_at
+    else:
+        entry = AnalysisCacheEntry(
+            cache_key=cache_key,
+            input_type=input_type,
+            result_json=result_json,
+            model_name=model_name,
+            prompt_version=prompt_version,
+            expires_at=expires_at
+        )
+        db.add(entry)
+    db.commit()
+    return entry
+
+def delete_cached_analyses(db, cache_key: str = None, input_type: str = None) -> int:
+    """Invalidar entradas de la caché persistente (todas si no hay filtros)"""
+    query = db.query(AnalysisCacheEntry)
+    if cache_key:
+        query = query.filter(AnalysisCacheEntry.cache_key == cache_key)
+    if input_type:
+        query = query.filter(AnalysisCacheEntry.input_type == input_type)
+    deleted = query.delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+def save_request_metrics(db, trace):
+    """Guardar los tiempos por etapa y el consumo de tokens de una petición (RequestTrace)"""
+    stages = {f"{name}_ms": round(elapsed_ms, 2) for name, elapsed_ms in trace.stages.items()}
+    metrics = RequestMetrics(
+        analysis_id=trace.analysis_id,
+        endpoint=trace.endpoint,
+        status=trace.status,
+        analysis_path=trace.analysis_path,
+        model_name=trace.model_name,
+        llm_calls=trace.llm_calls,
+        estimated_calls=trace.estimated_calls,
+        hedges=trace.hedges,
+        prompt_tokens=trace.prompt_tokens,
+        output_tokens=trace.output_tokens,
+        cost_usd=trace.cost_usd,
+        total_ms=round(trace.total_ms, 2),
+        **stages
+    )
+    db.add(metrics)
+    db.commit()
+    return metrics
+
+def get_request_metrics(db, since: datetime, endpoint: str = None):
+    """Obtener métricas de peticiones desde una fecha"""
+    query = db.query(RequestMetrics).filter(RequestMetrics.created_at >= since)
+    if endpoint:
+        query = query.filter(RequestMetrics.endpoint == endpoint)
+    return query.order_by(RequestMetrics.created_at.asc()).all()
+
 def save_github_config(db, repository_url: str, branch: str = 'main', token_hash: str = None):
     """Guardar configuración de GitHub"""
     # Desactivar configuraciones anteriores
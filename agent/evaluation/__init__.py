@@ -0,0 +1 @@
+# Evaluation module
@@ -0,0 +1,240 @@
+"""
+Evaluación offline sobre un corpus dorado de descripciones y diagramas
+
+Ejecuta TextProcessor y VisionProcessor sobre cada caso del corpus
+versionado (evaluation/corpus/) para cada combinación de modelo, variante
+de prompt y tamaño de imagen, y compara los servicios detectados con los
+esperados. Informa precisión y recall (micro), latencia p50/p95 y tokens
+por llamada en una tabla comparativa, para saber si un modelo más rápido o
+una imagen más pequeña pierden calidad antes de cambiarlos.
+
+Las llamadas pueden ser reales o servirse de un cassette grabado
+(--record / --replay), para comparar sin red ni coste.
+
+Uso (desde agent/):
+    python -m evaluation.runner [--models m1,m2] [--variants default,compact]
+                                [--image-max-edge 1536,768] [--runs N]
+                                [--replay DIR | --record DIR] [--local] [--json salida.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.dirname(AGENT_DIR)
+DEFAULT_CORPUS = os.path.join(AGENT_DIR, 'evaluation', 'corpus', 'v1.json')
+
+if AGENT_DIR not in sys.path:
+    sys.path.append(AGENT_DIR)
+
+from processors.cache import AnalysisCache
+from processors.local_analyzer import canonical_service
+from processors.model_router import ModelRouter, percentile
+from processors.text import TextProcessor
+from processors.vision import VisionProcessor
+
+def score_services(expected: Iterable[str], detected: Iterable[str]) -> Tuple[int, int, int]:
+    """
+    Compara servicios esperados y detectados
+
+    Returns:
+        Tupla (verdaderos positivos, falsos positivos, falsos negativos)
+    """
+    expected_set = {canonical_service(service).lower() for service in expected}
+    detected_set = {canonical_service(service).lower() for service in detected}
+    true_positives = len(expected_set & detected_set)
+    return true_positives, len(detected_set - expected_set), len(expected_set - detected_set)
+
+def load_corpus(path: str) -> Dict[str, Any]:
+    """Carga el corpus y resuelve las rutas de imagen respecto a la raíz del repositorio"""
+    with open(path, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+    for case in corpus.get("images", []):
+        if not os.path.isabs(case["path"]):
+            case["path"] = os.path.join(REPO_ROOT, case["path"])
+    return corpus
+
+def summarize(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Precisión y recall micro, latencias y tokens de un conjunto de ejecuciones"""
+    true_positives = sum(row["tp"] for row in rows)
+    false_positives = sum(row["fp"] for row in rows)
+    false_negatives = sum(row["fn"] for row in rows)
+    precision = true_positives / (true_positives + false_positives) if true_positives + false_positives else 1.0
+    recall = true_positives / (true_positives + false_negatives) if true_positives + false_negatives else 1.0
+    latencies = [row["latency_ms"] for row in rows]
+    tokens = [row["tokens"] for row in rows if row["tokens"]]
+    return {
+        "runs": len(rows),
+        "precision": round(precision, 3),
+        "recall": round(recall, 3),
+        "f1": round(2 * precision * recall / (precision + recall), 3) if precision + recall else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "avg_tokens": round(sum(tokens) / len(tokens), 1) if tokens else 0.0,
+        "fallbacks": sum(1 for row in rows if row["degraded"])
+    }
+
+class EvaluationRunner:
+    """Ejecuta el corpus con cada configuración y acumula los resultados"""
+
+    def __init__(self, corpus: Dict[str, Any], include_local: bool = False, runs: int = 1):
+        """
+        Inicializar evaluación
+
+        Args:
+            corpus: Corpus cargado con load_corpus()
+            include_local: Mantener las rutas locales (reglas de texto e iconos); por defecto
+                           se desactivan para medir el modelo
+            runs: Repeticiones de cada caso por configuración
+        """
+        self.corpus = corpus
+        self.runs = runs
+        self.text = TextProcessor()
+        self.vision = VisionProcessor()
+        # Caché solo en memoria: la evaluación nunca lee ni borra la tabla analysis_cache compartida
+        self.text.cache = AnalysisCache(input_type='text', persistent=False)
+        # Cada petición debe llegar al modelo y medirse por separado
+        self.text.batcher = None
+        if not include_local:
+            self.text.local_analyzer = None
+            self.vision.icon_matcher.enabled = False
+
+    def run_text(self, model: str, variant: str) -> Optional[List[Dict[str, Any]]]:
+        """Ejecuta los casos de texto con un modelo y una variante de prompt"""
+        if not self._configure(self.text, 'text', model, variant):
+            return None
+        rows = []
+        for case in self.corpus.get("text", []):
+            for _ in range(self.runs):
+                # Solo el nivel en memoria del runner (persistent=False)
+                self.text.cache.invalidate()
+                rows.append(self._measure(case, lambda: self.text.analyze_text_for_template(case["description"])))
+        return rows
+
+    def run_images(self, model: str, variant: str, max_edge: int) -> Optional[List[Dict[str, Any]]]:
+        """Ejecuta los casos de imagen con un modelo, una variante y un lado máximo de imagen"""
+        if not self._configure(self.vision, 'vision', model, variant):
+            return None
+        self.vision.normalizer.max_edge = max_edge
+        rows = []
+        for case in self.corpus.get("images", []):
+            if not os.path.isfile(case["path"]):
+                print(f"⚠️ Imagen del corpus no encontrada: {case['path']}")
+                continue
+            for _ in range(self.runs):
+                # DiagramCache vive solo en memoria de este proceso
+                self.vision.diagram_cache.invalidate()
+                rows.append(self._measure(case, lambda: self.vision.analyze_architecture_for_template(case["path"])))
+        return rows
+
+    def _configure(self, processor, name: str, model: str, variant: str) -> bool:
+        """Fija el modelo y la variante de prompt del procesador"""
+        if variant not in processor.prompts.variants:
+            print(f"⚠️ La variante '{variant}' no existe para {name}, se omite")
+            return False
+        processor.router = ModelRouter(name, [model])
+        processor.model_name = model
+        for candidate in processor.prompts.variants.values():
+            candidate.weight = 100.0 if candidate.name == variant else 0.0
+        return True
+
+    def _measure(self, case: Dict[str, Any], analyze) -> Dict[str, Any]:
+        tokens_before = self._pool_tokens()
+        start = time.perf_counter()
+        analysis = analyze()
+        latency_ms = (time.perf_counter() - start) * 1000
+        detected = analysis.get("services", [])
+        tp, fp, fn = score_services(case["expected_services"], detected)
+        return {
+            "id": case["id"],
+            "expected": case["expected_services"],
+            "detected": detected,
+            "tp": tp,
+            "fp": fp,
+            "fn": fn,
+            "latency_ms": round(latency_ms, 1),
+            "tokens": self._pool_tokens() - tokens_before,
+            "degraded": bool(analysis.get("degraded")) or analysis.get("analysis_path") == "fallback",
+            "path": analysis.get("analysis_path")
+        }
+
+    def _pool_tokens(self) -> int:
+        # Casos en serie: la diferencia de tokens del pool es la de la llamada
+        return sum(key.usage["tokens"] for key in self.text.router.key_pool.keys)
+
+def format_table(results: List[Dict[str, Any]]) -> str:
+    """Tabla comparativa de las configuraciones evaluadas"""
+    header = (f"{'tipo':<6} {'modelo':<28} {'variante':<10} {'imagen':>6} {'n':>3} "
+              f"{'precisión':>9} {'recall':>6} {'f1':>5} {'p50 ms':>9} {'p95 ms':>9} {'tokens':>7} {'fallback':>8}")
+    lines = [header, "-" * len(header)]
+    for result in results:
+        summary = result["summary"]
+        lines.append(
+            f"{result['kind']:<6} {result['model'][:28]:<28} {result['variant'][:10]:<10} "
+            f"{result.get('image_max_edge') or '-':>6} {summary['runs']:>3} "
+            f"{summary['precision']:>9.3f} {summary['recall']:>6.3f} {summary['f1']:>5.2f} "
+            f"{summary['p50_ms']:>9.1f} {summary['p95_ms']:>9.1f} {summary['avg_tokens']:>7.0f} {summary['fallbacks']:>8}"
+        )
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluación de detección de servicios frente a latencia")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help="Corpus JSON versionado")
+    parser.add_argument('--models', help="Modelos a comparar, separados por comas (default: GEMINI_MODELS)")
+    parser.add_argument('--variants', default='default', help="Variantes de prompt, separadas por comas")
+    parser.add_argument('--image-max-edge', default=None, help="Lados máximos de imagen, separados por comas (default: IMAGE_MAX_EDGE)")
+    parser.add_argument('--runs', type=int, default=1, help="Repeticiones por caso")
+    parser.add_argument('--only', choices=['text', 'images'], help="Evaluar solo texto o solo imágenes")
+    parser.add_argument('--local', action='store_true', help="Incluir las rutas locales (reglas e iconos)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--record', metavar='DIR', help="Llamadas reales grabadas en un cassette")
+    mode.add_argument('--replay', metavar='DIR', help="Respuestas servidas desde un cassette grabado")
+    parser.add_argument('--json', dest='json_path', help="Guardar resultados detallados en JSON")
+    args = parser.parse_args()
+
+    if args.record or args.replay:
+        os.environ['GEMINI_CASSETTE_MODE'] = 'record' if args.record else 'replay'
+        os.environ['GEMINI_CASSETTE_DIR'] = args.record or args.replay
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    corpus = load_corpus(args.corpus)
+    models = [m.strip() for m in (args.models or os.getenv('GEMINI_MODELS', 'gemini-2.5-flash')).split(',') if m.strip()]
+    variants = [v.strip() for v in args.variants.split(',') if v.strip()]
+    edges = [int(e) for e in (args.image_max_edge or os.getenv('IMAGE_MAX_EDGE', '1536')).split(',') if e.strip()]
+
+    print(f"🧪 Evaluación del corpus {corpus.get('version', '?')}: "
+          f"{len(corpus.get('text', []))} descripciones, {len(corpus.get('images', []))} diagramas")
+    runner = EvaluationRunner(corpus, include_local=args.local, runs=args.runs)
+
+    results = []
+    for model, variant in itertools.product(models, variants):
+        if args.only != 'images':
+            rows = runner.run_text(model, variant)
+            if rows:
+                results.append({"kind": "text", "model": model, "variant": variant, "rows": rows, "summary": summarize(rows)})
+        if args.only != 'text':
+            for edge in edges:
+                rows = runner.run_images(model, variant, edge)
+                if rows:
+                    results.append({"kind": "image", "model": model, "variant": variant, "image_max_edge": edge,
+                                    "rows": rows, "summary": summarize(rows)})
+
+    if not results:
+        print("❌ No se evaluó ninguna configuración")
+        return 1
+
+    print(format_table(results))
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({"corpus": corpus.get("version"), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"📄 Resultados detallados en {args.json_path}")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
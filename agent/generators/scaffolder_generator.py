@@ -3,7 +3,7 @@ Scaffolder Generator - Genera templates específicos para Backstage Scaffolder
 """
 import yaml
 import json
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Callable, Tuple
 from datetime import datetime
 
 class ScaffolderGenerator:
@@ -27,32 +27,47 @@ class ScaffolderGenerator:
     def generate_scaffolder_template(self, analysis: Dict[str, Any], template_id: str, project_name: str) -> Dict[str, Any]:
         """Genera un template completo para Backstage Scaffolder"""
         
-        services = analysis.get("services", [])
-        architecture_type = analysis.get("architecture_type", "web-app")
+        parts = {name: func(*args) for name, (func, args) in self.template_parts(analysis, template_id, project_name).items()}
+        return self.build_scaffolder_template(parts)
+    
+    def template_parts(self, analysis: Dict[str, Any], template_id: str, project_name: str) -> Dict[str, Tuple[Callable, tuple]]:
+        """
+        Partes del template del Scaffolder, cada una con la función que la genera y sus entradas
         
-        # Generar metadata del template
-        template_metadata = self._generate_template_metadata(template_id, project_name, services, architecture_type)
+        Cada parte depende solo de sus entradas, así que puede generarse por separado
+        (y reutilizarse si las entradas no cambian).
         
-        # Generar parámetros del template
-        parameters = self._generate_template_parameters(services, architecture_type)
+        Returns:
+            Dict parte -> (función, argumentos)
+        """
         
-        # Generar steps del scaffolder
-        steps = self._generate_scaffolder_steps(services, architecture_type)
+        services = analysis.get("services", [])
+        architecture_type = analysis.get("architecture_type", "web-app")
         
-        # Generar outputs
-        outputs = self._generate_template_outputs()
+        return {
+            # Metadata del template
+            "metadata": (self._generate_template_metadata, (template_id, project_name, services, architecture_type)),
+            # Parámetros del template
+            "parameters": (self._generate_template_parameters, (services, architecture_type)),
+            # Steps del scaffolder
+            "steps": (self._generate_scaffolder_steps, (services, architecture_type)),
+            # Outputs
+            "outputs": (self._generate_template_outputs, ())
+        }
+    
+    def build_scaffolder_template(self, parts: Dict[str, Any]) -> Dict[str, Any]:
+        """Construye el template completo a partir de sus partes generadas (ver template_parts)"""
         
-        # Construir template completo
         template = {
             "apiVersion": "scaffolder.backstage.io/v1beta3",
             "kind": "Template",
-            "metadata": template_metadata,
+            "metadata": parts["metadata"],
             "spec": {
                 "owner": "group:default/developers",
                 "type": "service",
-                "parameters": parameters,
-                "steps": steps,
-                "output": outputs
+                "parameters": parts["parameters"],
+                "steps": parts["steps"],
+                "output": parts["outputs"]
             }
         }
         
@@ -257,22 +272,32 @@ class ScaffolderGenerator:
     def generate_content_files(self, analysis: Dict[str, Any], template_id: str, project_name: str) -> Dict[str, str]:
         """Genera archivos de contenido para el template"""
         
+        return {filename: func(*args) for filename, (func, args) in self.content_file_parts(analysis, template_id, project_name).items()}
+    
+    def content_file_parts(self, analysis: Dict[str, Any], template_id: str, project_name: str) -> Dict[str, Tuple[Callable, tuple]]:
+        """
+        Archivos de contenido del template, cada uno con la función que lo genera y sus entradas
+        
+        Returns:
+            Dict nombre de archivo -> (función, argumentos)
+        """
+        
         services = analysis.get("services", [])
         architecture_type = analysis.get("architecture_type", "web-app")
         
         files = {}
         
         # Generar catalog-info.yaml
-        files["catalog-info.yaml"] = self._generate_catalog_info(project_name, services, architecture_type)
+        files["catalog-info.yaml"] = (self._generate_catalog_info, (project_name, services, architecture_type))
         
         # Generar README.md
-        files["README.md"] = self._generate_readme(project_name, services, architecture_type)
+        files["README.md"] = (self._generate_readme, (project_name, services, architecture_type))
         
         # Generar archivos específicos por tipo de arquitectura
         if architecture_type == "serverless":
-            files["serverless.yml"] = self._generate_serverless_config(services)
+            files["serverless.yml"] = (self._generate_serverless_config, (services,))
         elif "terraform" in analysis.get("tools", []):
-            files["main.tf"] = self._generate_terraform_config(services)
+            files["main.tf"] = (self._generate_terraform_config, (services,))
         
         return files
     
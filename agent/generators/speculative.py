@@ -0,0 +1,208 @@
+"""
+Generación especulativa del template mientras el LLM responde
+
+La detección local (palabras clave en texto, iconos en diagramas) suele
+acertar el conjunto de servicios antes de que Gemini conteste. Con esa
+predicción se generan en segundo plano las partes del template (metadata,
+parámetros, steps, outputs) y los archivos de contenido. Al llegar el
+análisis definitivo, cada parte cuyas entradas coinciden con las predichas
+se reutiliza y solo se regeneran las que difieren. Los servicios se comparan
+como conjunto de nombres canónicos ("Route 53" y "Amazon Route53" son el
+mismo, el orden no importa), y las partes especuladas que no se usan se
+cancelan para liberar el pool.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from generators.scaffolder_generator import ScaffolderGenerator
+from processors.local_analyzer import canonical_service
+
+HIT = 'hit'
+PARTIAL = 'partial'
+MISS = 'miss'
+
+def _freeze(value: Any) -> Any:
+    """Versión hashable de las entradas de una parte (listas -> tuplas)"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+class TemplateSpeculation:
+    """Partes del template generadas por adelantado para una petición"""
+
+    def __init__(self, owner: 'SpeculativeTemplates', template_id: str, project_name: str):
+        self.owner = owner
+        self.template_id = template_id
+        self.project_name = project_name
+        # (sección, parte, entradas) -> Future con la parte generada y su duración
+        self._parts: Dict[Tuple[str, str, Any], Future] = {}
+        self._lock = threading.Lock()
+        self.predictions = 0
+
+    def predict(self, services: List[str], architecture_type: str = None):
+        """
+        Lanza la generación de las partes para un conjunto de servicios predicho
+
+        Se puede llamar varias veces (p. ej. detección local y luego el array de
+        servicios del stream); solo se generan las partes con entradas nuevas.
+
+        Args:
+            services: Servicios predichos
+            architecture_type: Tipo de arquitectura predicho (default: el del análisis por defecto)
+        """
+        if not self.owner.enabled or not services:
+            return
+        analysis = {"services": list(services)}
+        if architecture_type:
+            analysis["architecture_type"] = architecture_type
+        with self._lock:
+            self.predictions += 1
+            for part_key, (func, args) in self._plan(analysis).items():
+                if part_key not in self._parts:
+                    self._parts[part_key] = self.owner.executor.submit(self._timed, func, args)
+
+    def commit(self, analysis: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str], Dict[str, Any]]:
+        """
+        Template y archivos de contenido para el análisis definitivo
+
+        Returns:
+            Tupla (template del Scaffolder, archivos de contenido, resumen de la especulación)
+        """
+        with self._lock:
+            speculated = dict(self._parts)
+
+        generator = self.owner.generator
+        template_parts: Dict[str, Any] = {}
+        content_files: Dict[str, str] = {}
+        reused, regenerated = [], []
+        saved_ms = 0.0
+        used = set()
+        for part_key, (func, args) in self._plan(analysis).items():
+            section, name, _ = part_key
+            future = speculated.get(part_key)
+            used.add(part_key)
+            value = None
+            if future is not None:
+                try:
+                    value, elapsed_ms = future.result()
+                    reused.append(name)
+                    saved_ms += elapsed_ms
+                except Exception as e:
+                    print(f"⚠️ Falló la generación especulativa de {name}, se regenera: {e}")
+                    future = None
+            if future is None:
+                value = func(*args)
+                regenerated.append(name)
+            (template_parts if section == 'template' else content_files)[name] = value
+
+        # Las partes de predicciones descartadas que aún no empezaron dejan el pool libre
+        for part_key, future in speculated.items():
+            if part_key not in used:
+                future.cancel()
+
+        if not self.predictions:
+            outcome = None
+        elif not regenerated:
+            outcome = HIT
+        elif reused:
+            outcome = PARTIAL
+        else:
+            outcome = MISS
+        summary = {
+            "outcome": outcome,
+            "reused": reused,
+            "regenerated": regenerated,
+            "saved_ms": round(saved_ms, 2)
+        }
+        self.owner.record(summary, len(speculated) - len(reused))
+        return generator.build_scaffolder_template(template_parts), content_files, summary
+
+    def _plan(self, analysis: Dict[str, Any]) -> Dict[Tuple[str, str, Any], Tuple[Callable, tuple]]:
+        """Partes necesarias para un análisis, identificadas por sus entradas (servicios normalizados)"""
+        generator = self.owner.generator
+        services = analysis.get("services", [])
+        normalized = tuple(sorted({canonical_service(service).lower() for service in services}))
+        plan = {}
+        sections = (
+            ('template', generator.template_parts(analysis, self.template_id, self.project_name)),
+            ('content', generator.content_file_parts(analysis, self.template_id, self.project_name))
+        )
+        for section, parts in sections:
+            for name, (func, args) in parts.items():
+                # La lista de servicios cuenta como conjunto canónico, no por orden ni por grafía
+                key_args = tuple(normalized if arg is services else arg for arg in args)
+                plan[(section, name, _freeze(key_args))] = (func, args)
+        return plan
+
+    @staticmethod
+    def _timed(func: Callable, args: tuple) -> Tuple[Any, float]:
+        start = time.perf_counter()
+        value = func(*args)
+        return value, (time.perf_counter() - start) * 1000
+
+class SpeculativeTemplates:
+    """Crea especulaciones por petición y acumula sus resultados"""
+
+    def __init__(self, generator: ScaffolderGenerator, enabled: bool = None, workers: int = None):
+        """
+        Inicializar generación especulativa
+
+        Args:
+            generator: Generador del Scaffolder cuyas partes se especulan
+            enabled: Activar la especulación (default: SPECULATIVE_TEMPLATES o true)
+            workers: Hilos para generar partes en segundo plano (default: SPECULATIVE_TEMPLATE_WORKERS o 2)
+        """
+        self.generator = generator
+        self.enabled = enabled if enabled is not None else os.getenv('SPECULATIVE_TEMPLATES', 'true').lower() == 'true'
+        workers = workers or int(os.getenv('SPECULATIVE_TEMPLATE_WORKERS', '2'))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="template-speculation")
+        self._lock = threading.Lock()
+        self._stats = {
+            HIT: 0,
+            PARTIAL: 0,
+            MISS: 0,
+            "unpredicted": 0,
+            "parts_reused": 0,
+            "parts_regenerated": 0,
+            "parts_discarded": 0,
+            "saved_ms": 0.0
+        }
+
+    def start(self, template_id: str, project_name: str, services: Optional[List[str]] = None) -> TemplateSpeculation:
+        """
+        Nueva especulación para una petición
+
+        Args:
+            template_id: ID del template que se generará
+            project_name: Nombre del proyecto
+            services: Predicción inicial de servicios (p. ej. detección local), si la hay
+        """
+        speculation = TemplateSpeculation(self, template_id, project_name)
+        if services:
+            speculation.predict(services)
+        return speculation
+
+    def record(self, summary: Dict[str, Any], discarded: int):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._stats[summary["outcome"] or "unpredicted"] += 1
+            self._stats["parts_reused"] += len(summary["reused"])
+            self._stats["parts_regenerated"] += len(summary["regenerated"])
+            self._stats["parts_discarded"] += discarded
+            self._stats["saved_ms"] += summary["saved_ms"]
+
+    def stats(self) -> Dict[str, Any]:
+        """Aciertos completos, parciales y fallos de la predicción y partes reutilizadas"""
+        with self._lock:
+            stats = dict(self._stats)
+        predicted = stats[HIT] + stats[PARTIAL] + stats[MISS]
+        stats["enabled"] = self.enabled
+        stats["hit_rate"] = round(stats[HIT] / predicted, 4) if predicted else 0.0
+        stats["saved_ms"] = round(stats["saved_ms"], 1)
+        return stats
@@ -7,12 +7,15 @@ import os
 from typing import Dict, List, Any
 from datetime import datetime
 from generators.scaffolder_generator import ScaffolderGenerator
+from generators.speculative import SpeculativeTemplates, TemplateSpeculation
 
 class TemplateGenerator:
     """Generador principal de templates para Backstage"""
     
     def __init__(self):
         self.scaffolder_generator = ScaffolderGenerator()
+        # Generación adelantada mientras el LLM responde (SPECULATIVE_TEMPLATES)
+        self.speculation = SpeculativeTemplates(self.scaffolder_generator)
     
     def generate_from_analysis(self, analysis: Dict[str, Any], template_id: str, project_name: str) -> Dict[str, Any]:
         """Genera template completo desde análisis de IA"""
@@ -27,6 +30,33 @@ class TemplateGenerator:
             analysis, template_id, project_name
         )
         
+        return self.assemble_template(analysis, template_id, project_name, scaffolder_template, content_files)
+    
+    def speculate(self, template_id: str, project_name: str, services: List[str] = None) -> TemplateSpeculation:
+        """
+        Empieza a generar el template con los servicios predichos antes de tener el análisis
+        
+        Args:
+            template_id: ID del template que se generará
+            project_name: Nombre del proyecto
+            services: Servicios predichos (detección local); se pueden añadir más con predict()
+        """
+        return self.speculation.start(template_id, project_name, services)
+    
+    def generate_from_speculation(self, speculation: TemplateSpeculation, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Genera el template desde el análisis reutilizando las partes especuladas que coinciden"""
+        
+        scaffolder_template, content_files, summary = speculation.commit(analysis)
+        template_data = self.assemble_template(
+            analysis, speculation.template_id, speculation.project_name, scaffolder_template, content_files
+        )
+        template_data["metadata"]["speculation"] = summary
+        return template_data
+    
+    def assemble_template(self, analysis: Dict[str, Any], template_id: str, project_name: str,
+                          scaffolder_template: Dict[str, Any], content_files: Dict[str, str]) -> Dict[str, Any]:
+        """Construye la estructura completa del template a partir de sus partes ya generadas"""
+        
         # Estructura completa del template
         template_structure = {
             "template_id": template_id,
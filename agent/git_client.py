@@ -3,6 +3,7 @@ import subprocess
 import yaml
 from typing import Optional
 from datetime import datetime
+from processors import request_trace
 
 class GitClient:
     def __init__(self, repo_url: str = None, local_path: str = "../templates-repo"):
@@ -63,11 +64,12 @@ class GitClient:
         if self.use_minio and self.minio_client:
             try:
                 print(f"📤 Subiendo YAML a MinIO para proyecto: {project_name}")
-                minio_metadata = self.minio_client.upload_yaml_definition(
-                    yaml_content, 
-                    project_name, 
-                    source_type='text'
-                )
+                with request_trace.stage('minio'):
+                    minio_metadata = self.minio_client.upload_yaml_definition(
+                        yaml_content, 
+                        project_name, 
+                        source_type='text'
+                    )
                 print(f"✅ YAML subido a MinIO: {minio_metadata['public_url']}")
             except Exception as e:
                 print(f"⚠️ Error subiendo a MinIO: {e}")
@@ -103,10 +105,11 @@ class GitClient:
         # 6. Subir documentación completa a MinIO si está disponible
         if self.use_minio and self.minio_client:
             try:
-                docs_urls = self.minio_client.upload_documentation(
-                    os.path.join(project_dir, "docs"), 
-                    project_name
-                )
+                with request_trace.stage('minio'):
+                    docs_urls = self.minio_client.upload_documentation(
+                        os.path.join(project_dir, "docs"), 
+                        project_name
+                    )
                 print(f"✅ Documentación subida a MinIO: {len(docs_urls)} archivos")
             except Exception as e:
                 print(f"⚠️ Error subiendo documentación: {e}")
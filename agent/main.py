@@ -1,20 +1,27 @@
 from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from processors.vision import VisionProcessor
 from processors.text import TextProcessor
+from processors import llm
+from processors.circuit_breaker import breakers
+from processors.similarity_index import SimilarityIndex
+from processors.local_analyzer import LocalAnalyzer
+from processors import request_trace
+from processors.request_trace import RequestTraceMiddleware
 from validators.backstage_validator import BackstageValidator
 from generators.backstage_generator import BackstageGenerator
 from generators.template_generator import TemplateGenerator
 from git_client import GitClient
-from database import create_tables, get_db, save_analysis, get_recent_analyses, save_github_config, get_active_github_config
+from database import create_tables, get_db, SessionLocal, save_analysis, get_recent_analyses, save_github_config, get_active_github_config, get_request_metrics
 import tempfile
 import os
 import hashlib
 import json
 import uuid
+from datetime import datetime, timedelta
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 
@@ -35,6 +42,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Tiempos por etapa y consumo de tokens de cada petición de análisis (tabla request_metrics)
+app.add_middleware(RequestTraceMiddleware, paths=[
+    "/scaffolder/actions/ai-analyze-text",
+    "/scaffolder/actions/ai-analyze-image",
+    "/api/analyze/text",
+    "/api/analyze/image",
+    "/api/analyze/text/stream",
+    "/api/analyze/image/stream",
+    "/process-text",
+    "/process-image"
+])
+
 # Crear tablas al iniciar
 create_tables()
 
@@ -47,6 +66,10 @@ text_processor = TextProcessor()
 validator = BackstageValidator()
 template_generator = TemplateGenerator()
 git_client = GitClient()
+# Descripciones equivalentes a otras ya procesadas reutilizan su template (SIMILARITY_THRESHOLD).
+# La salvaguarda de servicios usa su propio detector: no depende de LOCAL_ANALYZER_ENABLED
+service_detector = LocalAnalyzer(text_processor.backstage_generator.aws_service_mappings.keys())
+similarity_index = SimilarityIndex(services_of=lambda text: service_detector.detect(text)[0])
 
 # Modelos Pydantic para Backstage Integration
 class ScaffolderInput(BaseModel):
@@ -59,6 +82,7 @@ class ScaffolderOutput(BaseModel):
     templateId: str
     repositoryUrl: Optional[str] = None
     catalogEntityRef: Optional[str] = None
+    degraded: bool = False
     
 class AnalysisRequest(BaseModel):
     """Request model for AI analysis"""
@@ -85,14 +109,17 @@ class TemplateRequest(BaseModel):
 @app.get("/health")
 async def health_check():
     """Health check endpoint for Backstage monitoring"""
+    circuit_breakers = breakers.snapshot()
+    gemini_available = text_processor.router.available() and vision.router.available()
     return {
-        "status": "healthy",
+        "status": "healthy" if gemini_available else "degraded",
         "version": "1.0.0",
         "services": {
-            "gemini_ai": "connected",
+            "gemini_ai": "connected" if gemini_available else "degraded",
             "github": "configured",
             "database": "connected"
-        }
+        },
+        "circuit_breakers": circuit_breakers
     }
 
 # Backstage Scaffolder Actions
@@ -106,27 +133,46 @@ async def scaffolder_analyze_text(input_data: ScaffolderInput, db: Session = Dep
         if not description:
             raise HTTPException(status_code=400, detail="Description is required")
         
-        # Procesar con IA
-        analysis = text_processor.process(description)
+        # Descripción equivalente a una ya procesada: se devuelve su template sin LLM, generador ni git
+        match = await llm.run_for_channel("scaffolder", similarity_index.find, description)
+        if match:
+            request_trace.annotate(analysis_id=match["analysis_id"], analysis_path="similar")
+            return ScaffolderOutput(
+                templateId=match["template_id"],
+                catalogEntityRef=f"template:default/{match['template_id']}",
+                degraded=False
+            )
         
-        # Generar template
+        # Generar template especulativamente con los servicios predichos mientras responde la IA
         template_id = f"ai-template-{uuid.uuid4().hex[:8]}"
-        template_data = template_generator.generate_from_analysis(analysis, template_id, project_name)
+        speculation = template_generator.speculate(template_id, project_name, service_detector.detect(description)[0])
+        
+        # Procesar con IA
+        analysis = await text_processor.process_async(description, channel="scaffolder", on_services=speculation.predict)
+        
+        # Generar template (solo se regeneran las partes que no coinciden con la predicción)
+        with request_trace.stage("generate"):
+            template_data = await llm.run_for_channel("scaffolder", template_generator.generate_from_speculation, speculation, analysis)
         
         # Guardar en base de datos
-        save_analysis(db, "text", description, json.dumps(analysis), template_id)
+        with request_trace.stage("db"):
+            record = await llm.run_for_channel("scaffolder", save_analysis, db, "text", description, json.dumps(analysis), template_id)
+        request_trace.annotate(analysis_id=record.id, analysis_path=analysis.get("analysis_path"))
+        similarity_index.add(record.id, description, template_id, analysis)
         
         # Subir a GitHub (si está configurado)
         repo_url = None
         try:
-            repo_url = git_client.create_template_repository(template_id, template_data)
+            with request_trace.stage("git"):
+                repo_url = await llm.run_for_channel("scaffolder", git_client.create_template_repository, template_id, template_data)
         except Exception as e:
             print(f"Warning: Could not create GitHub repository: {e}")
         
         return ScaffolderOutput(
             templateId=template_id,
             repositoryUrl=repo_url,
-            catalogEntityRef=f"template:default/{template_id}"
+            catalogEntityRef=f"template:default/{template_id}",
+            degraded=analysis.get("degraded", False)
         )
         
     except Exception as e:
@@ -150,27 +196,37 @@ async def scaffolder_analyze_image(
             tmp_file_path = tmp_file.name
         
         try:
+            # Generar template especulativamente con los iconos detectados mientras responde la IA
+            template_id = f"ai-image-template-{uuid.uuid4().hex[:8]}"
+            speculation = template_generator.speculate(template_id, project_name)
+            
             # Procesar con IA
-            analysis = vision.process_image(tmp_file_path)
+            analysis = await vision.process_image_async(tmp_file_path, channel="scaffolder", on_services=speculation.predict)
             
-            # Generar template
-            template_id = f"ai-image-template-{uuid.uuid4().hex[:8]}"
-            template_data = template_generator.generate_from_analysis(analysis, template_id, project_name)
+            # Generar template (solo se regeneran las partes que no coinciden con la predicción)
+            with request_trace.stage("generate"):
+                template_data = await llm.run_for_channel("scaffolder", template_generator.generate_from_speculation, speculation, analysis)
             
             # Guardar en base de datos
-            save_analysis(db, "image", f"Image analysis for {project_name}", json.dumps(analysis), template_id)
+            with request_trace.stage("db"):
+                record = await llm.run_for_channel(
+                    "scaffolder", save_analysis, db, "image", f"Image analysis for {project_name}", json.dumps(analysis), template_id
+                )
+            request_trace.annotate(analysis_id=record.id, analysis_path=analysis.get("analysis_path"))
             
             # Subir a GitHub (si está configurado)
             repo_url = None
             try:
-                repo_url = git_client.create_template_repository(template_id, template_data)
+                with request_trace.stage("git"):
+                    repo_url = await llm.run_for_channel("scaffolder", git_client.create_template_repository, template_id, template_data)
             except Exception as e:
                 print(f"Warning: Could not create GitHub repository: {e}")
             
             return ScaffolderOutput(
                 templateId=template_id,
                 repositoryUrl=repo_url,
-                catalogEntityRef=f"template:default/{template_id}"
+                catalogEntityRef=f"template:default/{template_id}",
+                degraded=analysis.get("degraded", False)
             )
             
         finally:
@@ -180,23 +236,50 @@ async def scaffolder_analyze_image(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _reused_template(match: Dict[str, Any]) -> Dict[str, Any]:
+    """Referencia del análisis cuyo template se reutiliza"""
+    return {
+        "analysis_id": match["analysis_id"],
+        "template_ref": match["template_ref"],
+        "similarity": match["similarity"]
+    }
+
 # API Endpoints (para desarrollo y testing)
 @app.post("/api/analyze/text")
 async def api_analyze_text(request: AnalysisRequest, db: Session = Depends(get_db)):
     """API endpoint to analyze text description"""
     try:
-        analysis = text_processor.process(request.description)
+        # Descripción equivalente a una ya procesada: se devuelve su template sin LLM, generador ni git
+        match = await llm.run_blocking(similarity_index.find, request.description)
+        if match:
+            request_trace.annotate(analysis_id=match["analysis_id"], analysis_path="similar")
+            return {
+                "analysis": match["analysis"],
+                "template_id": match["template_id"],
+                "template_data": None,
+                "reused_template": _reused_template(match),
+                "status": "success"
+            }
         
-        # Generar template si se solicita
+        # Generar template especulativamente con los servicios predichos mientras responde la IA
         template_id = f"api-template-{uuid.uuid4().hex[:8]}"
-        template_data = template_generator.generate_from_analysis(
-            analysis, 
-            template_id, 
-            request.project_name or "api-project"
+        speculation = template_generator.speculate(
+            template_id,
+            request.project_name or "api-project",
+            service_detector.detect(request.description)[0]
         )
         
+        analysis = await text_processor.process_async(request.description, on_services=speculation.predict)
+        
+        # Generar template (solo se regeneran las partes que no coinciden con la predicción)
+        with request_trace.stage("generate"):
+            template_data = await llm.run_blocking(template_generator.generate_from_speculation, speculation, analysis)
+        
         # Guardar análisis
-        save_analysis(db, "text", request.description, json.dumps(analysis), template_id)
+        with request_trace.stage("db"):
+            record = await llm.run_blocking(save_analysis, db, "text", request.description, json.dumps(analysis), template_id)
+        request_trace.annotate(analysis_id=record.id, analysis_path=analysis.get("analysis_path"))
+        similarity_index.add(record.id, request.description, template_id, analysis)
         
         return {
             "analysis": analysis,
@@ -223,15 +306,23 @@ async def api_analyze_image(
             tmp_file_path = tmp_file.name
         
         try:
+            # Generar template especulativamente con los iconos detectados mientras responde la IA
+            template_id = f"api-image-template-{uuid.uuid4().hex[:8]}"
+            speculation = template_generator.speculate(template_id, project_name)
+            
             # Procesar con IA
-            analysis = vision.process_image(tmp_file_path)
+            analysis = await vision.process_image_async(tmp_file_path, on_services=speculation.predict)
             
-            # Generar template
-            template_id = f"api-image-template-{uuid.uuid4().hex[:8]}"
-            template_data = template_generator.generate_from_analysis(analysis, template_id, project_name)
+            # Generar template (solo se regeneran las partes que no coinciden con la predicción)
+            with request_trace.stage("generate"):
+                template_data = await llm.run_blocking(template_generator.generate_from_speculation, speculation, analysis)
             
             # Guardar análisis
-            save_analysis(db, "image", f"Image analysis for {project_name}", json.dumps(analysis), template_id)
+            with request_trace.stage("db"):
+                record = await llm.run_blocking(
+                    save_analysis, db, "image", f"Image analysis for {project_name}", json.dumps(analysis), template_id
+                )
+            request_trace.annotate(analysis_id=record.id, analysis_path=analysis.get("analysis_path"))
             
             return {
                 "analysis": analysis,
@@ -246,6 +337,119 @@ async def api_analyze_image(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Streaming (Server-Sent Events) de los resultados por etapa
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Formatea un evento SSE"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+async def _stream_pipeline(analyze, input_type: str, input_content: str, template_id: str,
+                           project_name: str, cleanup_path: Optional[str] = None,
+                           predicted_services: Optional[List[str]] = None):
+    """
+    Ejecuta el pipeline completo emitiendo un evento SSE al terminar cada etapa
+    
+    analyze recibe el callback on_services de la especulación: el template se genera
+    en segundo plano con los servicios predichos mientras responde la IA. Las
+    descripciones equivalentes a otra ya procesada terminan con su template.
+    """
+    try:
+        if input_type == "text":
+            match = await llm.run_blocking(similarity_index.find, input_content)
+            if match:
+                request_trace.annotate(analysis_id=match["analysis_id"], analysis_path="similar")
+                yield _sse_event("services_detected", {
+                    "services": match["analysis"].get("services", []),
+                    "analysis": match["analysis"]
+                })
+                yield _sse_event("done", {
+                    "analysis": match["analysis"],
+                    "template_id": match["template_id"],
+                    "template_data": None,
+                    "reused_template": _reused_template(match),
+                    "status": "success"
+                })
+                return
+        
+        speculation = template_generator.speculate(template_id, project_name, predicted_services)
+        analysis = await analyze(speculation.predict)
+        yield _sse_event("services_detected", {
+            "services": analysis.get("services", []),
+            "analysis": analysis
+        })
+        
+        with request_trace.stage("generate"):
+            template_data = await llm.run_blocking(template_generator.generate_from_speculation, speculation, analysis)
+        yield _sse_event("scaffolder_template_generated", {
+            "template_id": template_id,
+            "scaffolder_template": template_data["scaffolder_template"]
+        })
+        yield _sse_event("content_files_generated", {"content_files": template_data["content_files"]})
+        
+        with request_trace.stage("db"):
+            db = SessionLocal()
+            try:
+                record = await llm.run_blocking(save_analysis, db, input_type, input_content, json.dumps(analysis), template_id)
+            finally:
+                db.close()
+        request_trace.annotate(analysis_id=record.id, analysis_path=analysis.get("analysis_path"))
+        if input_type == "text":
+            similarity_index.add(record.id, input_content, template_id, analysis)
+        yield _sse_event("persisted", {"template_id": template_id})
+        
+        repo_url = None
+        try:
+            with request_trace.stage("git"):
+                repo_url = await llm.run_blocking(git_client.create_template_repository, template_id, template_data)
+        except Exception as e:
+            print(f"Warning: Could not create GitHub repository: {e}")
+        yield _sse_event("pushed", {"repository_url": repo_url})
+        
+        yield _sse_event("done", {
+            "analysis": analysis,
+            "template_id": template_id,
+            "template_data": template_data,
+            "repository_url": repo_url,
+            "status": "success"
+        })
+        
+    except Exception as e:
+        request_trace.annotate(status="error")
+        yield _sse_event("error", {"status": "error", "message": str(e)})
+    finally:
+        if cleanup_path and os.path.exists(cleanup_path):
+            os.unlink(cleanup_path)
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@app.post("/api/analyze/text/stream")
+async def api_analyze_text_stream(request: AnalysisRequest):
+    """Streaming variant of /api/analyze/text: emits one SSE event per pipeline stage"""
+    template_id = f"api-template-{uuid.uuid4().hex[:8]}"
+    events = _stream_pipeline(
+        lambda on_services: text_processor.process_async(request.description, on_services=on_services),
+        "text", request.description, template_id, request.project_name or "api-project",
+        predicted_services=service_detector.detect(request.description)[0]
+    )
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/api/analyze/image/stream")
+async def api_analyze_image_stream(
+    file: UploadFile = File(...),
+    project_name: str = Form("api-image-project")
+):
+    """Streaming variant of /api/analyze/image: emits one SSE event per pipeline stage"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
+        tmp_file.write(await file.read())
+        tmp_file_path = tmp_file.name
+    
+    template_id = f"api-image-template-{uuid.uuid4().hex[:8]}"
+    events = _stream_pipeline(
+        lambda on_services: vision.process_image_async(tmp_file_path, on_services=on_services),
+        "image", f"Image analysis for {project_name}", template_id, project_name,
+        cleanup_path=tmp_file_path
+    )
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
 @app.get("/api/templates")
 async def get_templates(db: Session = Depends(get_db)):
     """Get recent template analyses"""
@@ -280,6 +484,73 @@ async def get_github_config(db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Get processor performance metrics"""
+    return {
+        "analysis_cache": {
+            "text": text_processor.cache.stats(),
+            "image": vision.diagram_cache.stats()
+        },
+        "llm": llm.get_stats(),
+        "scheduler": llm.scheduler.stats(),
+        "api_keys": text_processor.router.key_pool.stats(),
+        "cassette": text_processor.router.cassette.stats(),
+        "context_cache": text_processor.router.context_cache.stats(),
+        "image_normalization": vision.normalizer.stats(),
+        "icon_matching": vision.icon_matcher.stats(),
+        "template_speculation": template_generator.speculation.stats(),
+        "similarity_index": similarity_index.stats(),
+        "single_flight": {
+            "text": text_processor.single_flight.stats(),
+            "image": vision.single_flight.stats()
+        },
+        "text_batching": text_processor.batcher.stats() if text_processor.batcher else {"enabled": False},
+        "analysis_paths": {
+            "text": text_processor.get_path_stats()
+        },
+        "prompt_compaction": text_processor.compactor.stats(),
+        "prompt_variants": {
+            "text": text_processor.prompts.stats(),
+            "image": vision.prompts.stats()
+        },
+        "model_routing": {
+            "text": text_processor.router.get_stats(),
+            "image": vision.router.get_stats()
+        },
+        "status": "success"
+    }
+
+@app.get("/api/metrics/requests")
+async def get_request_metrics_summary(days: int = 7, endpoint: Optional[str] = None, db: Session = Depends(get_db)):
+    """Per-request stage timing and token usage: p50/p95 per stage, per endpoint and per day"""
+    try:
+        since = datetime.utcnow() - timedelta(days=days)
+        rows = get_request_metrics(db, since, endpoint)
+        return {
+            "since": since.isoformat(),
+            **request_trace.aggregate(rows),
+            "status": "success"
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/api/cache")
+async def invalidate_cache(input_type: Optional[str] = None, description: Optional[str] = None):
+    """Invalidate cached analyses (by input type, or a single text description)"""
+    try:
+        removed = 0
+        if input_type in (None, "text"):
+            removed += text_processor.invalidate_cache(description)
+        if input_type in (None, "image") and not description:
+            removed += vision.diagram_cache.invalidate()
+        return {
+            "invalidated": removed,
+            "status": "success"
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Mantener endpoints legacy para compatibilidad (DEPRECATED)
 @app.post("/process-text")
 async def process_text_legacy(description: str = Form(...), db: Session = Depends(get_db)):
@@ -321,7 +592,7 @@ async def process_image_frontend(file: UploadFile):
         
         try:
             # Procesar imagen con IA
-            analysis_result = vision.process_image(tmp_path)
+            analysis_result = await vision.process_image_async(tmp_path)
             
             # Generar nombre único para el template
             template_name = f"aws-image-app-{hashlib.md5(content).hexdigest()[:8]}"
@@ -336,8 +607,10 @@ async def process_image_frontend(file: UploadFile):
             }
             
             # Generar template completo
-            template_files = template_generator.generate_aws_template(template_data)
-            github_url = git_client.save_template(template_name, template_files)
+            with request_trace.stage("generate"):
+                template_files = await llm.run_blocking(template_generator.generate_aws_template, template_data)
+            with request_trace.stage("git"):
+                github_url = await llm.run_blocking(git_client.save_template, template_name, template_files)
             
             return {
                 "status": "success",
@@ -0,0 +1,138 @@
+"""
+Esquema de salida estructurada para los análisis de Gemini
+
+Las llamadas piden JSON (response_mime_type) restringido por un esquema con
+los campos del análisis, de modo que la respuesta se decodifica directamente
+con json.loads en lugar de buscar el objeto con expresiones regulares.
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from processors import request_trace
+
+PARAMETER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "title": {"type": "string"},
+        "type": {"type": "string"}
+    },
+    "required": ["name", "title", "type"]
+}
+
+ANALYSIS_PROPERTIES = {
+    "services": {"type": "array", "items": {"type": "string"}},
+    "solution_type": {"type": "string"},
+    "title": {"type": "string"},
+    "description": {"type": "string"},
+    "component_type": {"type": "string"},
+    "tags": {"type": "array", "items": {"type": "string"}},
+    "parameters": {"type": "array", "items": PARAMETER_SCHEMA}
+}
+
+ANALYSIS_REQUIRED = ["services", "solution_type", "title", "description", "component_type", "tags", "parameters"]
+
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": ANALYSIS_PROPERTIES,
+    "required": ANALYSIS_REQUIRED
+}
+
+# Visión en una sola pasada: el análisis incluye la descripción de la
+# arquitectura y las entidades, sin una segunda llamada de extracción
+COMPONENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "service": {"type": "string"},
+        "description": {"type": "string"},
+        "connects_to": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["name", "service", "description"]
+}
+
+VISION_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": dict(
+        ANALYSIS_PROPERTIES,
+        architecture_description={"type": "string"},
+        components={"type": "array", "items": COMPONENT_SCHEMA}
+    ),
+    "required": ANALYSIS_REQUIRED + ["architecture_description", "components"]
+}
+
+# Micro-batching: un array de análisis identificados por id
+BATCH_ANALYSIS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": dict(ANALYSIS_PROPERTIES, id={"type": "string"}),
+        "required": ["id"] + ANALYSIS_REQUIRED
+    }
+}
+
+def json_generation_config(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """generation_config para pedir JSON restringido por un esquema"""
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": schema
+    }
+
+def decode_json(text: str) -> Any:
+    """Decodificación estricta: la respuesta debe ser JSON completo"""
+    return json.loads(text)
+
+def validate_analysis(data: Any) -> Optional[Dict[str, Any]]:
+    """
+    Valida y normaliza un análisis decodificado
+
+    Returns:
+        El análisis normalizado, o None si no tiene servicios AWS o los tipos no encajan
+    """
+    if not isinstance(data, dict):
+        return None
+
+    services = data.get("services")
+    if not isinstance(services, list):
+        return None
+
+    # Servicios únicos, en el orden en que aparecen
+    seen = set()
+    normalized_services: List[str] = []
+    for service in services:
+        if isinstance(service, str) and service.strip() and service.strip().lower() not in seen:
+            seen.add(service.strip().lower())
+            normalized_services.append(service.strip())
+    if not normalized_services:
+        return None
+
+    data["services"] = normalized_services
+    if not isinstance(data.get("tags", []), list):
+        data["tags"] = []
+    if not isinstance(data.get("parameters", []), list):
+        data["parameters"] = []
+    if "components" in data:
+        components = data["components"] if isinstance(data["components"], list) else []
+        data["components"] = [component for component in components if isinstance(component, dict)]
+    return data
+
+def parse_analysis(text: str) -> Optional[Dict[str, Any]]:
+    """Decodifica y valida la respuesta de un análisis individual"""
+    with request_trace.stage('parse'):
+        data = decode_json(text)
+    with request_trace.stage('validate'):
+        return validate_analysis(data)
+
+def parse_batch_analysis(text: str) -> Dict[str, Dict[str, Any]]:
+    """Decodifica la respuesta de un lote y devuelve {id: análisis} de los elementos válidos"""
+    data = decode_json(text)
+    results = {}
+    if isinstance(data, list):
+        for entry in data:
+            if not isinstance(entry, dict):
+                continue
+            item_id = str(entry.pop("id", ""))
+            analysis = validate_analysis(entry)
+            if analysis is not None:
+                results[item_id] = analysis
+    return results
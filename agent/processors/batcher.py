@@ -0,0 +1,143 @@
+"""
+Micro-batching de descripciones de texto
+
+Agrupa las descripciones pendientes durante una ventana corta (hasta N
+elementos o M milisegundos) y las envía a Gemini en un único prompt que
+devuelve un array JSON indexado por id. Cada resultado se entrega a su
+llamador; si el lote falla, los elementos se reintentan uno a uno.
+"""
+import contextvars
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+class TextBatcher:
+    """Agrupador de peticiones de análisis de texto en prompts multi-elemento"""
+
+    def __init__(self,
+                 batch_fn: Callable[[List[Tuple[str, str]], str], Dict[str, dict]],
+                 single_fn: Callable[[str, str], Optional[dict]],
+                 max_items: int = None,
+                 window_ms: int = None,
+                 workers: int = None):
+        """
+        Inicializar batcher
+
+        Args:
+            batch_fn: Analiza ([(id, descripción)], canal) en una llamada y devuelve {id: análisis}
+            single_fn: Analiza (descripción, canal) individualmente (reintento tras fallo del lote)
+            max_items: Tamaño máximo del lote (default: TEXT_BATCH_MAX_ITEMS o 8)
+            window_ms: Espera máxima para completar un lote (default: TEXT_BATCH_WINDOW_MS o 50)
+            workers: Lotes enviados en paralelo (default: TEXT_BATCH_WORKERS o 4)
+        """
+        self.batch_fn = batch_fn
+        self.single_fn = single_fn
+        self.max_items = max_items or int(os.getenv('TEXT_BATCH_MAX_ITEMS', '8'))
+        self.window_ms = window_ms or int(os.getenv('TEXT_BATCH_WINDOW_MS', '50'))
+
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or int(os.getenv('TEXT_BATCH_WORKERS', '4')),
+            thread_name_prefix="text-batch"
+        )
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._stats = {
+            "items": 0,
+            "batches": 0,
+            "batched_items": 0,
+            "batch_failures": 0,
+            "individual_retries": 0
+        }
+
+        self._collector = threading.Thread(target=self._collect, name="text-batch-collector", daemon=True)
+        self._collector.start()
+
+    def submit(self, text_description: str, channel: str = 'dev') -> Future:
+        """Encola una descripción; el Future se resuelve con el análisis o None"""
+        future = Future()
+        with self._lock:
+            self._next_id += 1
+            item_id = str(self._next_id)
+            self._stats["items"] += 1
+        # El contexto del llamador (traza de la petición) viaja con el elemento
+        self._queue.put((item_id, text_description, channel, future, contextvars.copy_context()))
+        return future
+
+    def analyze(self, text_description: str, channel: str = 'dev') -> Optional[dict]:
+        """Versión bloqueante de submit()"""
+        return self.submit(text_description, channel).result()
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de lotes y reintentos"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_batch_size"] = round(stats["batched_items"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["pending"] = self._queue.qsize()
+        stats["max_items"] = self.max_items
+        stats["window_ms"] = self.window_ms
+        return stats
+
+    def _collect(self):
+        """Bucle del hilo colector: forma lotes por tamaño o por ventana de tiempo"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window_ms / 1000.0
+
+            while len(batch) < self.max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # El hilo colector no tiene traza: cada elemento lleva la suya
+            self._executor.submit(self._flush, batch)
+
+    def _flush(self, batch: List[Tuple[str, str, str, Future, contextvars.Context]]):
+        """Envía un lote y reparte los resultados a cada llamador"""
+        if len(batch) == 1:
+            self._run_single(batch[0])
+            return
+
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["batched_items"] += len(batch)
+
+        # El lote hereda la prioridad más alta de sus elementos
+        channel = 'scaffolder' if any(item[2] == 'scaffolder' for item in batch) else 'dev'
+        try:
+            # La llamada compartida se anota en la traza del primer elemento del lote
+            results = batch[0][4].copy().run(
+                self.batch_fn, [(item[0], item[1]) for item in batch], channel
+            ) or {}
+        except Exception as e:
+            print(f"Error en lote de {len(batch)} descripciones: {e}")
+            results = {}
+
+        if len(results) < len(batch):
+            with self._lock:
+                self._stats["batch_failures"] += 1
+
+        for item in batch:
+            item_id, future = item[0], item[3]
+            result = results.get(item_id)
+            if result is not None:
+                future.set_result(result)
+            else:
+                # Dividir: los elementos sin resultado válido se reintentan solos
+                with self._lock:
+                    self._stats["individual_retries"] += 1
+                self._run_single(item)
+
+    def _run_single(self, item: Tuple[str, str, str, Future, contextvars.Context]):
+        _, text_description, channel, future, context = item
+        try:
+            future.set_result(context.copy().run(self.single_fn, text_description, channel))
+        except Exception as e:
+            future.set_exception(e)
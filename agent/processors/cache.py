@@ -0,0 +1,191 @@
+"""
+Caché de análisis direccionada por contenido para los procesadores de IA
+
+Nivel 1: LRU en memoria con TTL (por proceso)
+Nivel 2: tabla analysis_cache en PostgreSQL (compartida entre reinicios y workers)
+"""
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from processors import request_trace
+
+def normalize_description(text: str) -> str:
+    """Normaliza una descripción para que variaciones triviales compartan clave"""
+    normalized = unicodedata.normalize('NFKC', text or '').casefold()
+    normalized = re.sub(r'\s+', ' ', normalized)
+    return normalized.strip().strip('"\'.,;:!?¡¿ ')
+
+def build_cache_key(content: str, prompt_version: str, model_name: str) -> str:
+    """Genera clave sha256 a partir del contenido, versión de prompt y modelo"""
+    raw = f"{prompt_version}\x00{model_name}\x00{content}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class AnalysisCache:
+    """Caché de dos niveles para resultados de análisis de IA"""
+
+    def __init__(self, input_type: str = 'text',
+                 max_entries: int = None,
+                 ttl_seconds: int = None,
+                 persistent: bool = None,
+                 persistent_ttl_seconds: int = None):
+        """
+        Inicializar caché
+
+        Args:
+            input_type: 'text' o 'image' (se guarda con cada entrada persistente)
+            max_entries: Tamaño máximo del LRU en memoria (default: ANALYSIS_CACHE_MAX_ENTRIES o 512)
+            ttl_seconds: TTL del nivel en memoria (default: ANALYSIS_CACHE_TTL o 3600)
+            persistent: Usar la tabla analysis_cache (default: ANALYSIS_CACHE_PERSISTENT o true)
+            persistent_ttl_seconds: TTL del nivel persistente (default: ANALYSIS_CACHE_DB_TTL o 7 días)
+        """
+        self.input_type = input_type
+        self.max_entries = max_entries or int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', '512'))
+        self.ttl_seconds = ttl_seconds or int(os.getenv('ANALYSIS_CACHE_TTL', '3600'))
+        if persistent is None:
+            persistent = os.getenv('ANALYSIS_CACHE_PERSISTENT', 'true').lower() == 'true'
+        self.persistent = persistent
+        self.persistent_ttl_seconds = persistent_ttl_seconds or int(os.getenv('ANALYSIS_CACHE_DB_TTL', str(7 * 24 * 3600)))
+
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "persistent_errors": 0
+        }
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Obtener análisis cacheado (memoria primero, luego base de datos)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+
+        value = self._get_persistent(key)
+        if value is not None:
+            self._set_memory(key, value)
+            with self._lock:
+                self._stats["persistent_hits"] += 1
+            return copy.deepcopy(value)
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: Dict[str, Any], model_name: str = None, prompt_version: str = None):
+        """Guardar análisis en ambos niveles"""
+        self._set_memory(key, copy.deepcopy(value))
+        self._set_persistent(key, value, model_name, prompt_version)
+        with self._lock:
+            self._stats["stores"] += 1
+
+    def invalidate(self, key: str = None) -> int:
+        """
+        Invalidar entradas de la caché
+
+        Args:
+            key: Clave concreta a invalidar; si es None se vacía la caché de este tipo
+
+        Returns:
+            int: Número de entradas eliminadas (memoria + persistente)
+        """
+        with self._lock:
+            if key is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                removed = 1 if self._entries.pop(key, None) else 0
+            self._stats["invalidations"] += 1
+
+        if self.persistent:
+            try:
+                from database import SessionLocal, delete_cached_analyses
+                db = SessionLocal()
+                try:
+                    removed += delete_cached_analyses(db, cache_key=key, input_type=self.input_type)
+                finally:
+                    db.close()
+            except Exception as e:
+                self._persistent_error("invalidando", e)
+
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de aciertos/fallos de la caché"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._entries)
+
+        hits = stats["memory_hits"] + stats["persistent_hits"]
+        lookups = hits + stats["misses"]
+        stats["hits"] = hits
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["persistent"] = self.persistent
+        return stats
+
+    def _set_memory(self, key: str, value: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _get_persistent(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.persistent:
+            return None
+
+        try:
+            from database import SessionLocal, get_cached_analysis
+            with request_trace.stage('db'):
+                db = SessionLocal()
+                try:
+                    entry = get_cached_analysis(db, key)
+                    return json.loads(entry.result_json) if entry else None
+                finally:
+                    db.close()
+        except Exception as e:
+            self._persistent_error("leyendo", e)
+            return None
+
+    def _set_persistent(self, key: str, value: Dict[str, Any], model_name: str, prompt_version: str):
+        if not self.persistent:
+            return
+
+        try:
+            from database import SessionLocal, save_cached_analysis
+            with request_trace.stage('db'):
+                db = SessionLocal()
+                try:
+                    save_cached_analysis(
+                        db, key, self.input_type, json.dumps(value),
+                        model_name=model_name,
+                        prompt_version=prompt_version,
+                        ttl_seconds=self.persistent_ttl_seconds
+                    )
+                finally:
+                    db.close()
+        except Exception as e:
+            self._persistent_error("guardando", e)
+
+    def _persistent_error(self, action: str, error: Exception):
+        with self._lock:
+            self._stats["persistent_errors"] += 1
+        print(f"⚠️ Error {action} caché persistente de análisis: {error}")
@@ -0,0 +1,237 @@
+"""
+Grabación y reproducción (cassette) de respuestas de Gemini
+
+En modo 'record' cada llamada real se guarda como par hash del prompt ->
+respuesta (con su latencia y uso de tokens). En modo 'replay' las
+respuestas se sirven desde disco sin red ni API key, con una latencia
+simulada configurable, para benchmarks deterministas de todo lo que hay
+después del LLM.
+"""
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+
+OFF = 'off'
+RECORD = 'record'
+REPLAY = 'replay'
+
+class CassetteMissError(Exception):
+    """No hay respuesta grabada para el prompt en modo replay"""
+
+class CassetteResponse:
+    """Respuesta reproducida con la misma interfaz que usa el agente (text, usage_metadata)"""
+
+    def __init__(self, entry: Dict[str, Any]):
+        self.text = entry["text"]
+        usage = entry.get("usage") or {}
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=usage.get("prompt_token_count", 0),
+            candidates_token_count=usage.get("candidates_token_count", 0),
+            total_token_count=usage.get("total_token_count", 0)
+        )
+        self.model_name = entry.get("model")
+
+def prompt_hash(contents, **kwargs) -> str:
+    """
+    Hash estable de una petición: partes del prompt y configuración de generación
+
+    El modelo no forma parte de la clave: el router puede elegir otro modelo
+    en cada ejecución y la reproducción debe seguir encontrando la respuesta.
+    """
+    digest = hashlib.sha256()
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    for part in parts:
+        if isinstance(part, str):
+            digest.update(b"text:" + part.encode('utf-8'))
+        elif isinstance(part, dict) and 'data' in part:
+            # Blob ya codificado (imagen normalizada)
+            digest.update(f"blob:{part.get('mime_type')}:".encode('utf-8'))
+            digest.update(part['data'])
+        elif hasattr(part, 'tobytes') and hasattr(part, 'size'):
+            # Imagen PIL: se hashean los píxeles decodificados
+            digest.update(f"image:{part.mode}:{part.size}:".encode('utf-8'))
+            digest.update(part.tobytes())
+        else:
+            digest.update(b"part:" + repr(part).encode('utf-8'))
+    digest.update(b"config:" + json.dumps(kwargs, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+def _usage_dict(response) -> Dict[str, int]:
+    usage = getattr(response, 'usage_metadata', None)
+    return {
+        name: int(getattr(usage, name, 0) or 0)
+        for name in ("prompt_token_count", "candidates_token_count", "total_token_count")
+    }
+
+class Cassette:
+    """Almacén local de respuestas de Gemini para grabar y reproducir"""
+
+    def __init__(self, mode: str = None, directory: str = None, latency: str = None,
+                 p50_ms: float = None, p95_ms: float = None, seed: int = None):
+        """
+        Inicializar cassette
+
+        Args:
+            mode: 'off', 'record' o 'replay' (default: GEMINI_CASSETTE_MODE o off)
+            directory: Carpeta de las grabaciones (default: GEMINI_CASSETTE_DIR o ./cassettes)
+            latency: Latencia en replay: 'recorded', 'lognormal' o 'none' (default: GEMINI_CASSETTE_LATENCY o recorded)
+            p50_ms: Mediana para 'lognormal' (default: GEMINI_CASSETTE_P50_MS o 1500)
+            p95_ms: Percentil 95 para 'lognormal' (default: GEMINI_CASSETTE_P95_MS o 4000)
+            seed: Semilla de la latencia simulada (default: GEMINI_CASSETTE_SEED o 42)
+        """
+        self.mode = (mode or os.getenv('GEMINI_CASSETTE_MODE', OFF)).lower()
+        if self.mode not in (OFF, RECORD, REPLAY):
+            print(f"⚠️ GEMINI_CASSETTE_MODE desconocido '{self.mode}', se desactiva el cassette")
+            self.mode = OFF
+        self.directory = directory or os.getenv('GEMINI_CASSETTE_DIR', './cassettes')
+        self.latency = (latency or os.getenv('GEMINI_CASSETTE_LATENCY', 'recorded')).lower()
+        self.p50_ms = p50_ms or float(os.getenv('GEMINI_CASSETTE_P50_MS', '1500'))
+        self.p95_ms = p95_ms or float(os.getenv('GEMINI_CASSETTE_P95_MS', '4000'))
+        self._random = random.Random(seed if seed is not None else int(os.getenv('GEMINI_CASSETTE_SEED', '42')))
+
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "recorded": 0,
+            "replayed": 0,
+            "misses": 0
+        }
+
+        if self.mode != OFF:
+            os.makedirs(self.directory, exist_ok=True)
+        if self.mode == REPLAY:
+            self._load()
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    def generate_content(self, model, model_name: str, contents, key_contents=None, consume=None, **kwargs):
+        """
+        Sustituye a model.generate_content según el modo del cassette
+
+        Args:
+            model: GenerativeModel real (no se usa en replay)
+            model_name: Nombre del modelo, se guarda con la grabación
+            contents: Prompt o lista [prompt, imagen]
+            key_contents: Prompt completo para la clave, si contents omite un prefijo cacheado
+            consume: Si se indica, la llamada se hace en streaming y consume(stream) produce la respuesta;
+                     en replay recibe la respuesta grabada como único trozo
+        """
+        if self.mode == OFF:
+            return self._invoke(model, contents, consume, **kwargs)
+
+        key = prompt_hash(key_contents if key_contents is not None else contents, **kwargs)
+        if self.mode == REPLAY:
+            response = self._replay(key)
+            return consume([response]) if consume else response
+
+        start = time.perf_counter()
+        response = self._invoke(model, contents, consume, **kwargs)
+        self._record(key, model_name, response, (time.perf_counter() - start) * 1000)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        """Modo, entradas y contadores de grabación/reproducción"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["mode"] = self.mode
+        stats["latency"] = self.latency if self.mode == REPLAY else None
+        return stats
+
+    def _invoke(self, model, contents, consume, **kwargs):
+        if consume is None:
+            return model.generate_content(contents, **kwargs)
+        return consume(model.generate_content(contents, stream=True, **kwargs))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load(self):
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                self._entries[entry["key"]] = entry
+            except Exception as e:
+                print(f"⚠️ Grabación inválida {filename}: {e}")
+        print(f"📼 Cassette en replay: {len(self._entries)} respuestas cargadas de {self.directory}")
+
+    def _record(self, key: str, model_name: str, response, latency_ms: float):
+        try:
+            text = response.text
+        except Exception as e:
+            # Respuestas bloqueadas o sin texto no se graban
+            print(f"⚠️ Respuesta no grabada en cassette: {e}")
+            return
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and os.path.exists(self._path(key)):
+                with open(self._path(key), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            # Regrabar el mismo prompt acumula muestras de latencia
+            latencies: List[float] = (entry or {}).get("latencies_ms", [])
+            latencies.append(round(latency_ms, 1))
+            entry = {
+                "key": key,
+                "model": model_name,
+                "text": text,
+                "usage": _usage_dict(response),
+                "latencies_ms": latencies[-50:],
+                "recorded_at": datetime.utcnow().isoformat()
+            }
+            self._entries[key] = entry
+            with open(self._path(key), 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False, indent=2)
+            self._stats["recorded"] += 1
+
+    def _replay(self, key: str) -> CassetteResponse:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+            else:
+                self._stats["replayed"] += 1
+                delay_ms = self._delay_ms(entry)
+        if entry is None:
+            raise CassetteMissError(f"Sin grabación para el prompt {key[:12]}")
+
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000.0)
+        return CassetteResponse(entry)
+
+    def _delay_ms(self, entry: Dict[str, Any]) -> float:
+        if self.latency == 'none':
+            return 0.0
+        if self.latency == 'lognormal':
+            # p95 = p50 * exp(1.645 * sigma)
+            sigma = math.log(max(self.p95_ms, self.p50_ms) / self.p50_ms) / 1.645
+            return self._random.lognormvariate(math.log(self.p50_ms), sigma)
+        # 'recorded': una muestra real de esta respuesta
+        latencies = entry.get("latencies_ms") or [0.0]
+        return self._random.choice(latencies)
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+def get_cassette() -> Cassette:
+    """Cassette compartido por todos los routers del proceso"""
+    global _cassette
+    with _cassette_lock:
+        if _cassette is None:
+            load_dotenv()
+            _cassette = Cassette()
+        return _cassette
@@ -0,0 +1,153 @@
+"""
+Circuit breaker para las llamadas a Gemini
+
+Un breaker por modelo y API key. Si la tasa de fallos (errores o llamadas
+más lentas que el umbral) supera el límite, el circuito se abre y las
+peticiones van directamente al fallback local. Pasado el tiempo de
+apertura, se permite una sonda (half-open); si responde bien, se cierra.
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Tuple
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitOpenError(Exception):
+    """El circuito está abierto: no se intenta la llamada al modelo"""
+
+class CircuitBreaker:
+    """Breaker de un par (modelo, API key)"""
+
+    def __init__(self, name: str,
+                 failure_rate_threshold: float = None,
+                 slow_call_ms: float = None,
+                 window: int = None,
+                 min_calls: int = None,
+                 open_seconds: float = None,
+                 half_open_probes: int = None):
+        """
+        Inicializar breaker
+
+        Args:
+            name: Identificador (modelo/key) para métricas
+            failure_rate_threshold: Fracción de fallos que abre el circuito (default: BREAKER_FAILURE_RATE o 0.5)
+            slow_call_ms: Llamadas más lentas cuentan como fallo (default: BREAKER_SLOW_CALL_MS o 20000)
+            window: Llamadas recientes consideradas (default: BREAKER_WINDOW o 20)
+            min_calls: Llamadas mínimas antes de evaluar (default: BREAKER_MIN_CALLS o 5)
+            open_seconds: Tiempo abierto antes de sondear (default: BREAKER_OPEN_SECONDS o 30)
+            half_open_probes: Sondas simultáneas en half-open (default: BREAKER_HALF_OPEN_PROBES o 1)
+        """
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold or float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))
+        self.slow_call_ms = slow_call_ms or float(os.getenv('BREAKER_SLOW_CALL_MS', '20000'))
+        self.min_calls = min_calls or int(os.getenv('BREAKER_MIN_CALLS', '5'))
+        self.open_seconds = open_seconds or float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+        self.half_open_probes = half_open_probes or int(os.getenv('BREAKER_HALF_OPEN_PROBES', '1'))
+
+        self._results = deque(maxlen=window or int(os.getenv('BREAKER_WINDOW', '20')))  # True = fallo
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "rejected": 0,
+            "opened": 0
+        }
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def allow_request(self) -> bool:
+        """Indica si se puede llamar al modelo (reserva una sonda en half-open)"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def record_success(self, latency_ms: float):
+        """Registra una llamada correcta (las lentas cuentan como fallo)"""
+        self._record(latency_ms > self.slow_call_ms)
+
+    def record_failure(self):
+        """Registra una llamada fallida"""
+        self._record(True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado del breaker para /health y métricas"""
+        with self._lock:
+            state = self._current_state()
+            calls = len(self._results)
+            failures = sum(self._results)
+            return {
+                "state": state,
+                "failure_rate": round(failures / calls, 4) if calls else 0.0,
+                "calls": calls,
+                "rejected": self._stats["rejected"],
+                "opened": self._stats["opened"],
+                "retry_in_seconds": round(max(0.0, self._opened_at + self.open_seconds - time.monotonic()), 1)
+                if state == OPEN else 0.0
+            }
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+        return self._state
+
+    def _record(self, failed: bool):
+        with self._lock:
+            state = self._current_state()
+            if state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if failed:
+                    self._open()
+                else:
+                    self._state = CLOSED
+                    self._results.clear()
+                return
+
+            self._results.append(failed)
+            if state == CLOSED and len(self._results) >= self.min_calls:
+                if sum(self._results) / len(self._results) >= self.failure_rate_threshold:
+                    self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probes_in_flight = 0
+        self._stats["opened"] += 1
+        print(f"⚠️ Circuit breaker abierto: {self.name}")
+
+class CircuitBreakerRegistry:
+    """Breakers indexados por (modelo, id de API key)"""
+
+    def __init__(self):
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name: str, key_id: str = 'default') -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get((model_name, key_id))
+            if breaker is None:
+                breaker = CircuitBreaker(f"{model_name}/{key_id}")
+                self._breakers[(model_name, key_id)] = breaker
+            return breaker
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {f"{model}/{key_id}": breaker.snapshot() for (model, key_id), breaker in breakers.items()}
+
+# Registro compartido por todos los procesadores del proceso
+breakers = CircuitBreakerRegistry()
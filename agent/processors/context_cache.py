@@ -0,0 +1,234 @@
+"""
+Caché de contexto para el preámbulo estático de los prompts
+
+Las instrucciones y el ejemplo JSON de los prompts de análisis son iguales
+en todas las peticiones. El prompt se divide en un prefijo estático y un
+sufijo por petición; el prefijo se sube una vez por modelo como
+CachedContent de Gemini y cada llamada solo envía su parte variable.
+La caché se crea con las credenciales por defecto del SDK (genai.configure),
+así que las keys del pool deben pertenecer al mismo proyecto para usarla.
+La caché se renueva antes de caducar (TTL) y, si el proveedor no la admite
+(prefijo por debajo del mínimo de tokens, modelo sin soporte, error), la
+petición se envía completa sin caché.
+
+Los prefijos actuales (~300-500 tokens) no alcanzan el mínimo de 1024 del
+proveedor, por eso el modo por defecto es 'off'.
+
+El modo 'local' emula el ciclo de vida de la caché (creación, TTL,
+renovación, caducidad) sin llamadas al proveedor, para pruebas.
+"""
+import datetime
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+import google.generativeai as genai
+from google.generativeai import caching
+
+from processors.llm import estimate_tokens
+
+OFF = 'off'
+GEMINI = 'gemini'
+LOCAL = 'local'
+
+class CachedPrefix:
+    """Un prefijo cacheado para un modelo, compartido por las keys del pool"""
+
+    def __init__(self, name: str, content, tokens: int, expires_at: float):
+        self.name = name
+        # CachedContent del proveedor (None en modo local)
+        self.content = content
+        self.tokens = tokens
+        self.expires_at = expires_at
+        # GenerativeModel ligado a la caché para cada API key
+        self._models: Dict[str, Any] = {}
+
+    def model_for(self, key):
+        """
+        GenerativeModel que usa esta caché con el cliente de la key
+
+        Args:
+            key: ApiKey del pool
+
+        Returns:
+            GenerativeModel, o None en modo local (la petición se envía completa)
+        """
+        if self.content is None:
+            return None
+        model = self._models.get(key.key_id)
+        if model is None:
+            model = genai.GenerativeModel.from_cached_content(self.content)
+            if key.client is not None:
+                model._client = key.client
+            self._models[key.key_id] = model
+        return model
+
+class ContextCache:
+    """Gestiona los prefijos cacheados de los routers Gemini"""
+
+    def __init__(self, mode: str = None, ttl_seconds: int = None, refresh_seconds: int = None,
+                 min_tokens: int = None, retry_seconds: int = None):
+        """
+        Inicializar caché de contexto
+
+        Args:
+            mode: 'gemini', 'local' u 'off' (default: PROMPT_CACHE_MODE u off)
+            ttl_seconds: Vida de cada caché (default: PROMPT_CACHE_TTL_SECONDS o 3600)
+            refresh_seconds: Se renueva el TTL cuando queda menos de esto (default: PROMPT_CACHE_REFRESH_SECONDS o 300)
+            min_tokens: Prefijos más cortos no se cachean; mínimo del proveedor (default: PROMPT_CACHE_MIN_TOKENS o 1024)
+            retry_seconds: Tras un fallo al crear la caché, tiempo sin reintentar (default: PROMPT_CACHE_RETRY_SECONDS o 3600)
+        """
+        self.mode = (mode or os.getenv('PROMPT_CACHE_MODE', OFF)).lower()
+        if self.mode not in (OFF, GEMINI, LOCAL):
+            print(f"⚠️ PROMPT_CACHE_MODE desconocido '{self.mode}', se desactiva la caché de contexto")
+            self.mode = OFF
+        self.ttl_seconds = ttl_seconds or int(os.getenv('PROMPT_CACHE_TTL_SECONDS', '3600'))
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else int(os.getenv('PROMPT_CACHE_REFRESH_SECONDS', '300'))
+        self.min_tokens = min_tokens if min_tokens is not None else int(os.getenv('PROMPT_CACHE_MIN_TOKENS', '1024'))
+        self.retry_seconds = retry_seconds if retry_seconds is not None else int(os.getenv('PROMPT_CACHE_RETRY_SECONDS', '3600'))
+
+        self._entries: Dict[Tuple[str, str], CachedPrefix] = {}
+        # Prefijos cuya creación falló -> instante a partir del cual se reintenta
+        self._unsupported: Dict[Tuple[str, str], float] = {}
+        self._creating = set()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "created": 0,
+            "refreshed": 0,
+            "expired": 0,
+            "inline": 0,
+            "failures": 0,
+            "cached_prefix_tokens": 0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != OFF
+
+    def lookup(self, model_name: str, prefix: str) -> Optional[CachedPrefix]:
+        """
+        Prefijo cacheado vigente para este modelo, creándolo o renovándolo si hace falta
+
+        Args:
+            model_name: Modelo Gemini
+            prefix: Preámbulo estático del prompt
+
+        Returns:
+            CachedPrefix vigente, o None si la petición debe enviarse completa
+        """
+        if not self.enabled:
+            return None
+
+        entry_key = (model_name, hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:16])
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None and entry.expires_at <= now:
+                # Caducada en el proveedor: hay que volver a crearla
+                del self._entries[entry_key]
+                self._stats["expired"] += 1
+                entry = None
+
+            if entry is None:
+                if self._unsupported.get(entry_key, 0.0) > now or entry_key in self._creating:
+                    self._stats["inline"] += 1
+                    return None
+                self._creating.add(entry_key)
+            else:
+                self._stats["hits"] += 1
+                self._stats["cached_prefix_tokens"] += entry.tokens
+                if entry.expires_at - now >= self.refresh_seconds or entry_key in self._creating:
+                    return entry
+                self._creating.add(entry_key)
+
+        try:
+            if entry is not None:
+                self._refresh(entry)
+                return entry
+            return self._create(entry_key, model_name, prefix)
+        finally:
+            with self._lock:
+                self._creating.discard(entry_key)
+
+    def invalidate(self, model_name: str, name: str):
+        """Descarta una caché que el proveedor ya no reconoce (borrada o caducada antes de tiempo)"""
+        with self._lock:
+            for entry_key, entry in list(self._entries.items()):
+                if entry_key[0] == model_name and entry.name == name:
+                    del self._entries[entry_key]
+                    self._stats["expired"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Aciertos, creaciones, renovaciones y tokens de prefijo servidos desde caché"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["mode"] = self.mode
+        stats["ttl_seconds"] = self.ttl_seconds
+        return stats
+
+    def _create(self, entry_key, model_name: str, prefix: str) -> Optional[CachedPrefix]:
+        tokens = estimate_tokens(prefix)
+        if tokens < self.min_tokens:
+            # Por debajo del mínimo del proveedor la creación fallaría siempre
+            return self._mark_unsupported(entry_key, None)
+
+        try:
+            if self.mode == LOCAL:
+                entry = CachedPrefix(f"local/{entry_key[1]}", None, tokens, time.time() + self.ttl_seconds)
+            else:
+                content = caching.CachedContent.create(
+                    model=model_name,
+                    display_name=f"prefix-{entry_key[1]}",
+                    contents=[prefix],
+                    ttl=datetime.timedelta(seconds=self.ttl_seconds)
+                )
+                usage = getattr(content, 'usage_metadata', None)
+                tokens = getattr(usage, 'total_token_count', 0) or tokens
+                entry = CachedPrefix(content.name, content, tokens, time.time() + self.ttl_seconds)
+        except Exception as e:
+            return self._mark_unsupported(entry_key, e)
+
+        with self._lock:
+            self._entries[entry_key] = entry
+            self._stats["created"] += 1
+        return entry
+
+    def _refresh(self, entry: CachedPrefix):
+        """Amplía el TTL de una caché próxima a caducar"""
+        try:
+            if entry.content is not None:
+                entry.content.update(ttl=datetime.timedelta(seconds=self.ttl_seconds))
+        except Exception as e:
+            # La caché sigue vigente hasta su caducidad; se reintenta en la próxima petición
+            print(f"⚠️ No se pudo renovar la caché de contexto {entry.name}: {e}")
+            return
+        with self._lock:
+            entry.expires_at = time.time() + self.ttl_seconds
+            self._stats["refreshed"] += 1
+
+    def _mark_unsupported(self, entry_key, error: Optional[Exception]) -> None:
+        with self._lock:
+            self._unsupported[entry_key] = time.time() + self.retry_seconds
+            self._stats["inline"] += 1
+            if error is not None:
+                self._stats["failures"] += 1
+        if error is not None:
+            print(f"⚠️ Caché de contexto no disponible para {entry_key[0]}, se envía el prompt completo: {error}")
+        return None
+
+_context_cache = None
+_context_cache_lock = threading.Lock()
+
+def get_context_cache() -> ContextCache:
+    """Caché de contexto compartida por todos los routers del proceso"""
+    global _context_cache
+    with _context_cache_lock:
+        if _context_cache is None:
+            load_dotenv()
+            _context_cache = ContextCache()
+        return _context_cache
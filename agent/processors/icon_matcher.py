@@ -0,0 +1,289 @@
+"""
+Detección local de servicios AWS por sus iconos (sin LLM ni red)
+
+La mayoría de los diagramas usan el set oficial de iconos de arquitectura
+AWS. El detector busca cada icono de la biblioteca en el diagrama mediante
+correlación cruzada normalizada (NCC) calculada con FFT de NumPy: primero
+una pasada gruesa a media resolución con pocas escalas y después, solo para
+los candidatos, un barrido fino de escala en una ventana local. Si la
+confianza es alta el análisis se resuelve localmente; si no, los servicios
+detectados se pasan a Gemini como pistas.
+"""
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from processors.local_analyzer import ALIASES, CANONICAL_NAMES
+
+DEFAULT_ICON_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'icons', 'aws')
+
+# Nombre del fichero del set oficial (sin prefijo Arch_/Res_ ni sufijo de tamaño) -> servicio
+OFFICIAL_ICON_NAMES = {
+    'amazon-simple-storage-service': 'S3',
+    'amazon-s3': 'S3',
+    'aws-lambda': 'Lambda',
+    'amazon-cloudfront': 'CloudFront',
+    'amazon-route-53': 'Route 53',
+    'aws-certificate-manager': 'ACM',
+    'amazon-api-gateway': 'API Gateway',
+    'amazon-dynamodb': 'DynamoDB',
+    'amazon-rds': 'RDS',
+    'amazon-aurora': 'Aurora',
+    'amazon-ec2': 'EC2',
+    'amazon-elastic-container-service': 'ECS',
+    'aws-fargate': 'Fargate',
+    'amazon-elastic-file-system': 'EFS',
+    'elastic-load-balancing': 'ELB',
+    'amazon-virtual-private-cloud': 'VPC',
+    'amazon-simple-queue-service': 'SQS',
+    'amazon-simple-notification-service': 'SNS',
+    'amazon-eventbridge': 'EventBridge',
+    'amazon-cloudwatch': 'CloudWatch',
+    'aws-x-ray': 'X-Ray',
+}
+
+def icon_service_name(filename: str) -> str:
+    """Servicio representado por un fichero de icono (nombre oficial o nombre corto)"""
+    stem = os.path.splitext(os.path.basename(filename))[0].lower()
+    stem = re.sub(r'^(arch|res)[-_]', '', stem)
+    stem = re.sub(r'([-_](16|32|48|64|light|dark))+$', '', stem)
+    stem = stem.replace('_', '-')
+    if stem in OFFICIAL_ICON_NAMES:
+        return OFFICIAL_ICON_NAMES[stem]
+
+    # Nombre corto: s3.png, lambda.png, api-gateway.png
+    key = stem.replace('-', ' ')
+    key = ALIASES.get(key, ALIASES.get(stem, key))
+    return CANONICAL_NAMES.get(key, CANONICAL_NAMES.get(key.replace(' ', ''), stem.upper()))
+
+def _to_gray(image: Image.Image) -> np.ndarray:
+    """Escala de grises en [0, 1] con la transparencia sobre fondo blanco"""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    return np.asarray(image.convert('L'), dtype=np.float32) / 255.0
+
+def _crop_to_content(gray: np.ndarray, threshold: float = 0.97) -> np.ndarray:
+    """Recorta el margen blanco alrededor del icono"""
+    mask = gray < threshold
+    if not mask.any():
+        return gray
+    rows = np.where(mask.any(axis=1))[0]
+    columns = np.where(mask.any(axis=0))[0]
+    return gray[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1]
+
+def _window_sums(values: np.ndarray, height: int, width: int) -> np.ndarray:
+    """Suma de cada ventana height x width (posiciones válidas) con imagen integral"""
+    integral = np.pad(values.astype(np.float64), ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    return (integral[height:, width:] - integral[:-height, width:]
+            - integral[height:, :-width] + integral[:-height, :-width])
+
+def _resize(gray: np.ndarray, size: int) -> np.ndarray:
+    """Reduce/amplía un icono para que su lado mayor mida size píxeles"""
+    scale = size / max(gray.shape)
+    shape = (max(1, round(gray.shape[1] * scale)), max(1, round(gray.shape[0] * scale)))
+    return np.asarray(Image.fromarray((gray * 255).astype(np.uint8)).resize(shape, Image.LANCZOS),
+                      dtype=np.float32) / 255.0
+
+def _centered(template: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Plantilla de media cero y su norma"""
+    centered = template - template.mean()
+    return centered, float(np.sqrt((centered * centered).sum()))
+
+def ncc_peak(canvas: np.ndarray, template: np.ndarray, norm: float,
+             canvas_fft: np.ndarray = None, deviation: np.ndarray = None) -> Tuple[float, int, int]:
+    """
+    Máximo de la correlación cruzada normalizada de una plantilla sobre la imagen
+
+    Args:
+        canvas: Imagen en escala de grises
+        template: Plantilla de media cero (ver _centered)
+        norm: Norma de la plantilla
+        canvas_fft: rfft2 de canvas, si ya se calculó
+        deviation: Desviación por ventana para este tamaño de plantilla, si ya se calculó
+
+    Returns:
+        Tupla (puntuación NCC, fila, columna) de la mejor posición
+    """
+    height, width = canvas.shape
+    t_height, t_width = template.shape
+    if t_height > height or t_width > width or norm <= 1e-6:
+        return 0.0, 0, 0
+
+    if deviation is None:
+        window_sum = _window_sums(canvas, t_height, t_width)
+        window_sq = _window_sums(canvas * canvas, t_height, t_width)
+        deviation = np.sqrt(np.maximum(window_sq - window_sum * window_sum / (t_height * t_width), 0.0))
+    if canvas_fft is None:
+        canvas_fft = np.fft.rfft2(canvas)
+
+    # Correlación con la plantilla de media cero: sum(I * T0) en cada posición válida
+    correlation = np.fft.irfft2(canvas_fft * np.conj(np.fft.rfft2(template, s=(height, width))), s=(height, width))
+    correlation = correlation[:height - t_height + 1, :width - t_width + 1]
+
+    # Ventanas casi planas (fondo) no pueden contener un icono
+    valid = deviation > 1e-3 * np.sqrt(t_height * t_width)
+    if not valid.any():
+        return 0.0, 0, 0
+    ncc = np.where(valid, correlation / (deviation * norm + 1e-9), 0.0)
+    row, column = np.unravel_index(int(ncc.argmax()), ncc.shape)
+    return float(ncc[row, column]), int(row), int(column)
+
+class IconMatcher:
+    """Detector de servicios AWS por plantillas de iconos multi-escala"""
+
+    def __init__(self, icon_dir: str = None, enabled: bool = None, max_edge: int = None,
+                 scales: List[int] = None, threshold: float = None, confident: float = None,
+                 min_services: int = None):
+        """
+        Inicializar detector
+
+        Args:
+            icon_dir: Carpeta de iconos (default: AWS_ICON_LIBRARY_DIR o agent/icons/aws)
+            enabled: Activar la detección local (default: ICON_MATCH_ENABLED o true)
+            max_edge: Lado mayor del diagrama durante la búsqueda (default: ICON_MATCH_MAX_EDGE o 640)
+            scales: Tamaños del icono en píxeles a esa escala (default: ICON_MATCH_SCALES o 20,24,28,34,40,48)
+            threshold: NCC mínima para considerar un icono presente (default: ICON_MATCH_THRESHOLD o 0.75)
+            confident: NCC mínima de todos los iconos para responder sin LLM (default: ICON_MATCH_CONFIDENT o 0.85)
+            min_services: Servicios mínimos para responder sin LLM (default: ICON_MATCH_MIN_SERVICES o 2)
+        """
+        self.icon_dir = icon_dir or os.getenv('AWS_ICON_LIBRARY_DIR', DEFAULT_ICON_DIR)
+        self.enabled = enabled if enabled is not None else os.getenv('ICON_MATCH_ENABLED', 'true').lower() == 'true'
+        self.max_edge = max_edge or int(os.getenv('ICON_MATCH_MAX_EDGE', '640'))
+        self.scales = scales or [int(size) for size in os.getenv('ICON_MATCH_SCALES', '20,24,28,34,40,48').split(',') if size.strip()]
+        self.threshold = threshold if threshold is not None else float(os.getenv('ICON_MATCH_THRESHOLD', '0.75'))
+        self.confident = confident if confident is not None else float(os.getenv('ICON_MATCH_CONFIDENT', '0.85'))
+        self.min_services = min_services or int(os.getenv('ICON_MATCH_MIN_SERVICES', '2'))
+        # Búsqueda gruesa a media resolución; solo los candidatos se refinan a resolución completa
+        self.coarse_factor = 0.5
+        self.candidate_threshold = self.threshold * 0.6
+
+        # Iconos recortados por servicio y plantillas de la búsqueda gruesa
+        self.icons: Dict[str, List[np.ndarray]] = {}
+        self._coarse_templates: List[Tuple[str, int, np.ndarray, float]] = []
+        if self.enabled:
+            self._load_library()
+
+        self._lock = threading.Lock()
+        self._stats = {
+            "images": 0,
+            "confident": 0,
+            "total_ms": 0.0
+        }
+
+    @property
+    def available(self) -> bool:
+        """Hay biblioteca de iconos y la detección está activada"""
+        return self.enabled and bool(self.icons)
+
+    def detect(self, image: Image.Image) -> Dict[str, Any]:
+        """
+        Busca los iconos de la biblioteca en el diagrama
+
+        Returns:
+            Dict con services (en orden de puntuación), scores por servicio,
+            confidence (mínima de los detectados), confident y elapsed_ms
+        """
+        start = time.perf_counter()
+        canvas = self._prepare(image, self.max_edge)
+        coarse = self._prepare(image, max(1, int(self.max_edge * self.coarse_factor)))
+        coarse_fft = np.fft.rfft2(coarse)
+        deviations = {}
+
+        # 1. Búsqueda gruesa: mejor posición y tamaño por servicio
+        candidates: Dict[str, Tuple[float, int, int, int]] = {}
+        for service, size, template, norm in self._coarse_templates:
+            shape = template.shape
+            if shape not in deviations and shape[0] <= coarse.shape[0] and shape[1] <= coarse.shape[1]:
+                window_sum = _window_sums(coarse, *shape)
+                window_sq = _window_sums(coarse * coarse, *shape)
+                deviations[shape] = np.sqrt(np.maximum(window_sq - window_sum * window_sum / (shape[0] * shape[1]), 0.0))
+            score, row, column = ncc_peak(coarse, template, norm, coarse_fft, deviations.get(shape))
+            if score > candidates.get(service, (0.0,))[0]:
+                candidates[service] = (score, row, column, size)
+
+        # 2. Refinado a resolución completa con barrido fino de escala alrededor del candidato
+        ratio = canvas.shape[1] / coarse.shape[1]
+        scores: Dict[str, float] = {}
+        for service, (score, row, column, size) in candidates.items():
+            if score < self.candidate_threshold:
+                continue
+            best = self._refine(canvas, service, int(row * ratio), int(column * ratio), size)
+            if best >= self.threshold:
+                scores[service] = round(best, 3)
+
+        services = sorted(scores, key=scores.get, reverse=True)
+        confidence = min(scores.values()) if scores else 0.0
+        confident = len(services) >= self.min_services and confidence >= self.confident
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self._stats["images"] += 1
+            self._stats["total_ms"] += elapsed_ms
+            if confident:
+                self._stats["confident"] += 1
+
+        return {
+            "services": services,
+            "scores": scores,
+            "confidence": round(confidence, 3),
+            "confident": confident,
+            "elapsed_ms": round(elapsed_ms, 1)
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Diagramas analizados, resueltos localmente y tiempo medio"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_ms"] = round(stats.pop("total_ms") / stats["images"], 1) if stats["images"] else 0.0
+        stats["icons"] = len(self.icons)
+        stats["available"] = self.available
+        return stats
+
+    def _refine(self, canvas: np.ndarray, service: str, row: int, column: int, size: int) -> float:
+        """Mejor NCC en una ventana local probando tamaños de ±25 % píxel a píxel"""
+        best = 0.0
+        for icon in self.icons[service]:
+            for fine_size in range(max(8, int(size * 0.75)), int(size * 1.25) + 2):
+                template, norm = _centered(_resize(icon, fine_size))
+                margin = max(4, fine_size // 3)
+                top, left = max(0, row - margin), max(0, column - margin)
+                region = canvas[top:row + template.shape[0] + margin, left:column + template.shape[1] + margin]
+                best = max(best, ncc_peak(region, template, norm)[0])
+        return best
+
+    def _prepare(self, image: Image.Image, max_edge: int) -> np.ndarray:
+        """Diagrama en escala de grises reducido al tamaño de búsqueda"""
+        image = image.copy()
+        image.thumbnail((max_edge, max_edge), Image.BILINEAR)
+        return _to_gray(image)
+
+    def _load_library(self):
+        if not os.path.isdir(self.icon_dir):
+            print(f"ℹ️ Biblioteca de iconos AWS no encontrada en {self.icon_dir}; detección local desactivada")
+            return
+
+        for filename in sorted(os.listdir(self.icon_dir)):
+            if not filename.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
+                continue
+            try:
+                icon = _crop_to_content(_to_gray(Image.open(os.path.join(self.icon_dir, filename))))
+            except Exception as e:
+                print(f"⚠️ Icono inválido {filename}: {e}")
+                continue
+
+            service = icon_service_name(filename)
+            self.icons.setdefault(service, []).append(icon)
+            for size in self.scales:
+                template, norm = _centered(_resize(icon, max(4, round(size * self.coarse_factor))))
+                if norm > 1e-6:
+                    self._coarse_templates.append((service, size, template, norm))
+
+        print(f"🧩 Biblioteca de iconos AWS: {len(self.icons)} servicios cargados de {self.icon_dir}")
@@ -0,0 +1,147 @@
+"""
+Caché de análisis de diagramas por hash perceptual
+
+- Coincidencia exacta: sha256 de los bytes subidos (sin decodificar la imagen)
+- Casi duplicados: dHash/pHash calculado con PIL + NumPy y distancia de Hamming
+"""
+import copy
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+import numpy as np
+from PIL import Image
+
+def content_sha256(data: bytes) -> str:
+    """sha256 de los bytes originales de la imagen"""
+    return hashlib.sha256(data).hexdigest()
+
+def dhash(image: Image.Image, hash_size: int = 16) -> np.ndarray:
+    """Difference hash: compara píxeles adyacentes de la imagen reducida"""
+    gray = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return np.packbits(bits.flatten())
+
+def phash(image: Image.Image, hash_size: int = 16) -> np.ndarray:
+    """Perceptual hash: umbral sobre las bajas frecuencias de la DCT"""
+    size = hash_size * 4
+    gray = image.convert('L').resize((size, size), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.float64)
+
+    # DCT-II separable mediante matriz de cosenos
+    k = np.arange(size)
+    dct_matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * size))
+    dct = dct_matrix @ pixels @ dct_matrix.T
+
+    low = dct[:hash_size, :hash_size]
+    bits = low > np.median(low)
+    return np.packbits(bits.flatten())
+
+HASH_FUNCTIONS = {
+    'dhash': dhash,
+    'phash': phash
+}
+
+class DiagramCache:
+    """Caché en memoria de análisis de diagramas indexada por hash perceptual"""
+
+    def __init__(self, max_entries: int = None, max_distance: int = None,
+                 hash_algorithm: str = None, hash_size: int = None):
+        """
+        Inicializar caché
+
+        Args:
+            max_entries: Número máximo de diagramas (default: DIAGRAM_CACHE_MAX_ENTRIES o 256)
+            max_distance: Distancia de Hamming máxima para considerar duplicado
+                          (default: DIAGRAM_CACHE_MAX_DISTANCE o 10)
+            hash_algorithm: 'dhash' o 'phash' (default: DIAGRAM_CACHE_HASH o dhash)
+            hash_size: Lado de la matriz del hash; bits = hash_size² (default: 16)
+        """
+        self.max_entries = max_entries or int(os.getenv('DIAGRAM_CACHE_MAX_ENTRIES', '256'))
+        if max_distance is None:
+            max_distance = int(os.getenv('DIAGRAM_CACHE_MAX_DISTANCE', '10'))
+        self.max_distance = max_distance
+        self.hash_algorithm = hash_algorithm or os.getenv('DIAGRAM_CACHE_HASH', 'dhash')
+        if self.hash_algorithm not in HASH_FUNCTIONS:
+            raise ValueError(f"Algoritmo de hash no soportado: {self.hash_algorithm}")
+        self.hash_size = hash_size or int(os.getenv('DIAGRAM_CACHE_HASH_SIZE', '16'))
+
+        self._entries = OrderedDict()  # sha256 -> {"namespace", "hash", "value"}
+        self._lock = threading.Lock()
+        self._stats = {
+            "exact_hits": 0,
+            "similar_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0
+        }
+
+    def compute_hash(self, image: Image.Image) -> np.ndarray:
+        """Calcula el hash perceptual configurado para una imagen ya decodificada"""
+        return HASH_FUNCTIONS[self.hash_algorithm](image, self.hash_size)
+
+    def get_exact(self, sha256: str, namespace: str) -> Optional[Dict[str, Any]]:
+        """Busca por sha256 de los bytes; no requiere decodificar la imagen"""
+        with self._lock:
+            entry = self._entries.get(sha256)
+            if entry and entry["namespace"] == namespace:
+                self._entries.move_to_end(sha256)
+                self._stats["exact_hits"] += 1
+                return copy.deepcopy(entry["value"])
+        return None
+
+    def get_similar(self, image_hash: np.ndarray, namespace: str) -> Optional[Dict[str, Any]]:
+        """Busca el diagrama más parecido dentro del umbral de Hamming"""
+        with self._lock:
+            candidates = [(key, entry) for key, entry in self._entries.items()
+                          if entry["namespace"] == namespace]
+            if candidates:
+                hashes = np.stack([entry["hash"] for _, entry in candidates])
+                distances = np.unpackbits(np.bitwise_xor(hashes, image_hash), axis=1).sum(axis=1)
+                best = int(np.argmin(distances))
+                if distances[best] <= self.max_distance:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    self._stats["similar_hits"] += 1
+                    return copy.deepcopy(entry["value"])
+
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, sha256: str, image_hash: np.ndarray, namespace: str, value: Dict[str, Any]):
+        """Guarda el análisis de un diagrama"""
+        with self._lock:
+            self._entries[sha256] = {
+                "namespace": namespace,
+                "hash": image_hash,
+                "value": copy.deepcopy(value)
+            }
+            self._entries.move_to_end(sha256)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self) -> int:
+        """Vacía la caché de diagramas"""
+        with self._lock:
+            removed = len(self._entries)
+            self._entries.clear()
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de aciertos exactos, por similitud y fallos"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+
+        hits = stats["exact_hits"] + stats["similar_hits"]
+        lookups = hits + stats["misses"]
+        stats["hits"] = hits
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["hash_algorithm"] = self.hash_algorithm
+        stats["max_distance"] = self.max_distance
+        return stats
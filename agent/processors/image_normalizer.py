@@ -0,0 +1,181 @@
+"""
+Normalización de imágenes antes de enviarlas a Gemini
+
+Las fotos de móvil y las exportaciones 8K suben megabytes y cuestan más
+tokens de imagen. Antes del envío la imagen se decodifica en modo draft
+(JPEG), se corrige su orientación, se eliminan EXIF y canal alfa, se limita
+el lado mayor y se recodifica: PNG con paleta o en escala de grises para
+diagramas con pocos colores, WebP para fotografías.
+"""
+import io
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+from PIL import Image, ImageOps
+
+# Gemini factura 258 tokens por imagen pequeña o por cada tesela de 768x768
+IMAGE_TOKENS_PER_TILE = 258
+IMAGE_TILE_SIZE = 768
+SMALL_IMAGE_EDGE = 384
+
+def estimate_image_tokens(size: Tuple[int, int]) -> int:
+    """Tokens de imagen estimados según sus dimensiones"""
+    width, height = size
+    if width <= SMALL_IMAGE_EDGE and height <= SMALL_IMAGE_EDGE:
+        return IMAGE_TOKENS_PER_TILE
+    tiles = math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE)
+    return tiles * IMAGE_TOKENS_PER_TILE
+
+class ImageNormalizer:
+    """Reduce, limpia y recodifica imágenes para la subida multimodal"""
+
+    def __init__(self, enabled: bool = None, max_edge: int = None, output_format: str = None,
+                 webp_quality: int = None, palette_colors: int = None):
+        """
+        Inicializar normalizador
+
+        Args:
+            enabled: Activar la normalización (default: IMAGE_NORMALIZE_ENABLED o true)
+            max_edge: Lado mayor máximo en píxeles (default: IMAGE_MAX_EDGE o 1536)
+            output_format: 'auto', 'png' o 'webp' (default: IMAGE_NORMALIZE_FORMAT o auto)
+            webp_quality: Calidad WebP 1-100 (default: IMAGE_WEBP_QUALITY o 80)
+            palette_colors: Colores de la paleta PNG; 'auto' usa PNG si la imagen no tiene más
+                            (default: IMAGE_PALETTE_COLORS o 256)
+        """
+        self.enabled = enabled if enabled is not None else os.getenv('IMAGE_NORMALIZE_ENABLED', 'true').lower() == 'true'
+        self.max_edge = max_edge or int(os.getenv('IMAGE_MAX_EDGE', '1536'))
+        self.output_format = (output_format or os.getenv('IMAGE_NORMALIZE_FORMAT', 'auto')).lower()
+        self.webp_quality = webp_quality or int(os.getenv('IMAGE_WEBP_QUALITY', '80'))
+        self.palette_colors = palette_colors or int(os.getenv('IMAGE_PALETTE_COLORS', '256'))
+
+        self._lock = threading.Lock()
+        self._stats = {
+            "images": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "image_tokens_in": 0,
+            "image_tokens_out": 0,
+            "total_ms": 0.0,
+            "formats": {}
+        }
+
+    def decode(self, image_bytes: bytes, full_resolution: Callable[[Tuple[int, int]], bool] = None) -> Image.Image:
+        """
+        Decodifica los bytes subidos; los JPEG se decodifican en modo draft
+        a la escala mínima que sigue cubriendo el lado máximo
+
+        Args:
+            image_bytes: Fichero subido
+            full_resolution: Predicado sobre el tamaño original; si devuelve True no se usa draft
+                             (p. ej. imágenes que se analizarán por teselas)
+        """
+        image = Image.open(io.BytesIO(image_bytes))
+        original_size = image.size
+        keep_full = full_resolution is not None and full_resolution(original_size)
+        if self.enabled and not keep_full and image.format == 'JPEG' and max(image.size) > self.max_edge:
+            # draft() solo reduce si ambos lados siguen cubriendo el tamaño pedido
+            scale = self.max_edge / max(image.size)
+            image.draft('RGB', (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+        image.load()
+        # Tamaño antes de la reducción en draft, para las métricas
+        image.info['original_size'] = original_size
+        return image
+
+    def normalize(self, image: Image.Image, original_bytes: int) -> Tuple[Any, Dict[str, Any]]:
+        """
+        Prepara la imagen para Gemini
+
+        Args:
+            image: Imagen decodificada (con decode())
+            original_bytes: Tamaño del fichero subido
+
+        Returns:
+            Tupla (parte de contenido para generate_content, métricas de la normalización)
+        """
+        if not self.enabled:
+            return image, {"bytes_in": original_bytes, "bytes_out": original_bytes, "format": "original"}
+
+        start = time.perf_counter()
+        original_size = tuple(image.info.get('original_size', image.size))
+
+        # Orientación EXIF aplicada a los píxeles antes de descartar los metadatos
+        image = ImageOps.exif_transpose(image)
+        image = self._flatten(image)
+        if max(image.size) > self.max_edge:
+            image = image.copy()
+            image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+
+        data, mime_type, encoding = self._encode(image)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        info = {
+            "bytes_in": original_bytes,
+            "bytes_out": len(data),
+            "size_in": list(original_size),
+            "size_out": list(image.size),
+            "format": encoding,
+            "normalize_ms": round(elapsed_ms, 1)
+        }
+        with self._lock:
+            self._stats["images"] += 1
+            self._stats["bytes_in"] += original_bytes
+            self._stats["bytes_out"] += len(data)
+            self._stats["image_tokens_in"] += estimate_image_tokens(original_size)
+            self._stats["image_tokens_out"] += estimate_image_tokens(image.size)
+            self._stats["total_ms"] += elapsed_ms
+            self._stats["formats"][encoding] = self._stats["formats"].get(encoding, 0) + 1
+
+        # Blob ya codificado: el SDK lo envía tal cual en lugar de recodificar a WebP sin pérdida
+        return {"mime_type": mime_type, "data": data}, info
+
+    def stats(self) -> Dict[str, Any]:
+        """Bytes y tokens de imagen antes y después de normalizar"""
+        with self._lock:
+            stats = dict(self._stats, formats=dict(self._stats["formats"]))
+        stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+        stats["compression_ratio"] = round(stats["bytes_out"] / stats["bytes_in"], 4) if stats["bytes_in"] else 1.0
+        stats["avg_normalize_ms"] = round(stats.pop("total_ms") / stats["images"], 1) if stats["images"] else 0.0
+        stats["enabled"] = self.enabled
+        stats["max_edge"] = self.max_edge
+        return stats
+
+    def _flatten(self, image: Image.Image) -> Image.Image:
+        """Elimina el canal alfa sobre fondo blanco y deja la imagen en RGB o L"""
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            rgba = image.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            return background
+        if image.mode not in ('RGB', 'L'):
+            return image.convert('RGB')
+        return image
+
+    def _is_grayscale(self, image: Image.Image) -> bool:
+        if image.mode == 'L':
+            return True
+        sample = image.copy()
+        sample.thumbnail((128, 128))
+        red, green, blue = sample.split()
+        return red.tobytes() == green.tobytes() == blue.tobytes()
+
+    def _encode(self, image: Image.Image) -> Tuple[bytes, str, str]:
+        output_format = self.output_format
+        if output_format == 'auto':
+            # Diagramas: pocos colores planos -> PNG con paleta; fotografías -> WebP
+            output_format = 'png' if image.getcolors(maxcolors=self.palette_colors) is not None else 'webp'
+
+        buffer = io.BytesIO()
+        if output_format == 'webp':
+            image.save(buffer, format='WEBP', quality=self.webp_quality, method=4)
+            return buffer.getvalue(), 'image/webp', 'webp'
+
+        if self._is_grayscale(image):
+            image.convert('L').save(buffer, format='PNG', optimize=True)
+            return buffer.getvalue(), 'image/png', 'png-grayscale'
+
+        palette = image.quantize(colors=self.palette_colors, method=Image.MEDIANCUT)
+        palette.save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue(), 'image/png', 'png-palette'
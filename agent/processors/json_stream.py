@@ -0,0 +1,199 @@
+"""
+Consumo en streaming de respuestas JSON de Gemini
+
+Aunque la salida está restringida a JSON, esperar a que generate_content
+termine incluye cualquier texto que el modelo añada después del objeto.
+El escáner incremental sigue la profundidad de llaves y corchetes (fuera
+de cadenas) y la lectura se corta, cancelando el stream, en cuanto el
+objeto de nivel superior queda cerrado y es parseable. La lista de
+servicios se publica en cuanto su array se cierra, antes del resto. Si el
+último trozo (con el consumo) no llega, el consumo se estima y se marca.
+"""
+import json
+import re
+import time
+from types import SimpleNamespace
+from typing import Callable, Iterable, List, Optional
+
+from processors.prompt_compactor import estimate_tokens
+
+_SERVICES_PATTERN = re.compile(r'"services"\s*:\s*(\[[^\[\]]*\])')
+
+class IncrementalJSONScanner:
+    """Detecta el cierre del valor JSON de nivel superior a medida que llega el texto"""
+
+    def __init__(self):
+        self.buffer = ""
+        self._depth = 0
+        # Inicio del valor JSON (el modelo puede anteponer texto)
+        self._start = None
+        self._in_string = False
+        self._escaped = False
+        self._end = None
+        self.services: Optional[List[str]] = None
+
+    @property
+    def complete(self) -> bool:
+        return self._end is not None
+
+    @property
+    def document(self) -> str:
+        """Texto del valor JSON completo (o todo lo recibido si aún no cerró)"""
+        return self.buffer[self._start:self._end] if self._end is not None else self.buffer
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Añade texto recibido
+
+        Returns:
+            True si el valor de nivel superior ya está cerrado y es parseable
+        """
+        if self._end is not None:
+            return True
+
+        offset = len(self.buffer)
+        self.buffer += chunk
+        for index in range(offset, len(self.buffer)):
+            char = self.buffer[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                if self._depth == 0:
+                    self._start = index
+                self._depth += 1
+            elif char in '}]' and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0 and self._parseable(index + 1):
+                    self._end = index + 1
+                    break
+
+        if self.services is None:
+            match = _SERVICES_PATTERN.search(self.buffer)
+            if match:
+                try:
+                    services = json.loads(match.group(1))
+                    if isinstance(services, list):
+                        self.services = [str(service) for service in services]
+                except ValueError:
+                    pass
+        return self._end is not None
+
+    def _parseable(self, end: int) -> bool:
+        try:
+            json.loads(self.buffer[self._start:end])
+            return True
+        except ValueError:
+            return False
+
+def consume_json_stream(stream: Iterable, on_services: Callable[[List[str]], None] = None):
+    """
+    Lee un stream de generate_content hasta que el JSON de nivel superior se cierra
+
+    Args:
+        stream: Respuesta de generate_content(stream=True), o cualquier iterable de trozos con .text
+        on_services: Se llama una vez con los servicios en cuanto su array está completo
+
+    Returns:
+        Respuesta con text (solo el JSON), usage_metadata (del último trozo recibido),
+        truncated (se canceló antes del final), usage_estimated, chunks y first_chunk_ms
+    """
+    start = time.perf_counter()
+    scanner = IncrementalJSONScanner()
+    usage = None
+    chunks = 0
+    first_chunk_ms = None
+    truncated = False
+    for chunk in stream:
+        chunks += 1
+        if first_chunk_ms is None:
+            first_chunk_ms = (time.perf_counter() - start) * 1000
+        usage = getattr(chunk, 'usage_metadata', None) or usage
+        try:
+            text = chunk.text
+        except Exception:
+            # Trozos sin texto (solo finish_reason o métricas de uso)
+            continue
+
+        surfaced = scanner.services is not None
+        closed = scanner.feed(text)
+        if on_services and not surfaced and scanner.services is not None:
+            on_services(scanner.services)
+        if closed:
+            truncated = _cancel(stream)
+            break
+
+    return SimpleNamespace(
+        text=scanner.document,
+        usage_metadata=usage,
+        truncated=truncated,
+        usage_estimated=False,
+        chunks=chunks,
+        first_chunk_ms=round(first_chunk_ms or 0.0, 1)
+    )
+
+def needs_usage_estimate(response) -> bool:
+    """El stream terminó sin el consumo de salida (cancelado o sin métricas en el último trozo)"""
+    if getattr(response, 'usage_estimated', None) is not False:
+        return False
+    usage = response.usage_metadata
+    return response.truncated or usage is None or not getattr(usage, 'candidates_token_count', None)
+
+def estimate_usage(response, count_prompt_tokens: Callable[[], int], reserved_prompt_tokens: int,
+                   reserved_output_tokens: int):
+    """
+    Sustituye el consumo de un stream incompleto por una estimación explícita
+
+    Al cancelar el stream no llega el último trozo, que es el que trae los
+    tokens de salida: sin esto el ajuste TPM, el uso por key y el ledger de la
+    petición contarían 0. Los tokens de prompt salen de count_tokens (o de la
+    reserva si falla) y los de salida de lo recibido, nunca por debajo de la
+    salida reservada (el modelo pudo generar más antes de la cancelación).
+
+    Args:
+        response: Respuesta de consume_json_stream
+        count_prompt_tokens: Cuenta los tokens del prompt (model.count_tokens)
+        reserved_prompt_tokens: Tokens de prompt estimados en la reserva
+        reserved_output_tokens: Tokens de salida reservados por llamada
+    """
+    usage = response.usage_metadata
+    prompt_tokens = getattr(usage, 'prompt_token_count', None) if usage is not None else None
+    if not prompt_tokens:
+        try:
+            prompt_tokens = count_prompt_tokens()
+        except Exception as e:
+            print(f"⚠️ count_tokens falló, se usa la estimación de la reserva: {e}")
+            prompt_tokens = reserved_prompt_tokens
+    output_tokens = max(
+        (getattr(usage, 'candidates_token_count', None) or 0) if usage is not None else 0,
+        estimate_tokens(response.text),
+        reserved_output_tokens
+    )
+    response.usage_metadata = SimpleNamespace(
+        prompt_token_count=prompt_tokens,
+        candidates_token_count=output_tokens,
+        total_token_count=prompt_tokens + output_tokens
+    )
+    response.usage_estimated = True
+    return response
+
+def _cancel(stream) -> bool:
+    """Cancela la llamada en streaming subyacente, si sigue abierta"""
+    if getattr(stream, '_done', True):
+        return False
+    iterator = getattr(stream, '_iterator', None)
+    cancel = getattr(iterator, 'cancel', None)
+    if cancel is None:
+        return False
+    try:
+        cancel()
+    except Exception as e:
+        print(f"⚠️ No se pudo cancelar el stream: {e}")
+        return False
+    return True
@@ -0,0 +1,169 @@
+"""
+Pool de API keys de Gemini con reparto por cuota restante
+
+genai.configure() es estado global del proceso, así que cada key tiene su
+propio cliente GenerativeServiceClient. Las peticiones van a la key con más
+cuota disponible (RPM/TPM por key); una key que recibe 429 se retira
+temporalmente con backoff exponencial.
+"""
+import hashlib
+import itertools
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as api_exceptions
+
+from processors.scheduler import TokenBucket
+
+def key_fingerprint(api_key: str) -> str:
+    """Identificador estable de una key para métricas (sin exponerla)"""
+    return f"key-{hashlib.sha256(api_key.encode()).hexdigest()[:8]}"
+
+def is_rate_limited(error: Exception) -> bool:
+    """Indica si el error es un 429 (cuota agotada)"""
+    return isinstance(error, (api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests))
+
+class ApiKey:
+    """Una API key con su cliente, cuota y estado de backoff"""
+
+    def __init__(self, api_key: Optional[str], rpm: int, tpm: int):
+        self.key_id = key_fingerprint(api_key) if api_key else 'default'
+        # Sin key explícita se usa el cliente por defecto del SDK (genai.configure)
+        self.client = glm.GenerativeServiceClient(client_options={"api_key": api_key}) if api_key else None
+        self.rpm = TokenBucket(rpm)
+        self.tpm = TokenBucket(tpm)
+        self.cooldown_until = 0.0
+        self.backoff_seconds = 0.0
+        self.usage = {
+            "requests": 0,
+            "tokens": 0,
+            "failures": 0,
+            "rate_limited": 0
+        }
+
+    def remaining(self, now: float) -> float:
+        """Fracción de cuota disponible (1.0 si la key no tiene límites)"""
+        self.rpm.refill(now)
+        self.tpm.refill(now)
+        fractions = [bucket.tokens / bucket.capacity for bucket in (self.rpm, self.tpm) if not bucket.unlimited]
+        return min(fractions) if fractions else 1.0
+
+class ApiKeyPool:
+    """Reparte las llamadas entre varias API keys según su cuota restante"""
+
+    def __init__(self, api_keys: List[str] = None, rpm: int = None, tpm: int = None,
+                 backoff_seconds: float = None, max_backoff_seconds: float = None):
+        """
+        Inicializar pool
+
+        Args:
+            api_keys: Keys disponibles (default: GEMINI_API_KEYS separadas por comas, o GEMINI_API_KEY)
+            rpm: Peticiones por minuto de cada key (default: GEMINI_KEY_RPM o 0 = sin límite)
+            tpm: Tokens por minuto de cada key (default: GEMINI_KEY_TPM o 0 = sin límite)
+            backoff_seconds: Retiro inicial tras un 429 (default: GEMINI_KEY_BACKOFF_SECONDS o 5)
+            max_backoff_seconds: Retiro máximo (default: GEMINI_KEY_MAX_BACKOFF_SECONDS o 300)
+        """
+        if api_keys is None:
+            api_keys = [key.strip() for key in os.getenv('GEMINI_API_KEYS', '').split(',') if key.strip()]
+            if not api_keys and os.getenv('GEMINI_API_KEY'):
+                api_keys = [os.getenv('GEMINI_API_KEY')]
+        rpm = rpm if rpm is not None else int(os.getenv('GEMINI_KEY_RPM', '0'))
+        tpm = tpm if tpm is not None else int(os.getenv('GEMINI_KEY_TPM', '0'))
+
+        # Keys repetidas en la configuración cuentan una sola vez
+        unique_keys = list(dict.fromkeys(api_keys))
+        self.keys = [ApiKey(api_key, rpm, tpm) for api_key in unique_keys] or [ApiKey(None, rpm, tpm)]
+        self.backoff_seconds = backoff_seconds or float(os.getenv('GEMINI_KEY_BACKOFF_SECONDS', '5'))
+        self.max_backoff_seconds = max_backoff_seconds or float(os.getenv('GEMINI_KEY_MAX_BACKOFF_SECONDS', '300'))
+        self._rotation = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def key_ids(self) -> List[str]:
+        return [key.key_id for key in self.keys]
+
+    def select(self, tokens: int = 1, usable: Callable[[str], bool] = None) -> ApiKey:
+        """
+        Elige la key con más cuota restante y reserva la petición en ella
+
+        Args:
+            tokens: Tokens estimados de la petición
+            usable: Filtro opcional por key_id (p. ej. breaker del modelo cerrado)
+
+        Returns:
+            La key elegida; si todas están retiradas, la que antes se recupera
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [key for key in self.keys if usable is None or usable(key.key_id)] or self.keys
+            ready = [key for key in candidates if key.cooldown_until <= now]
+
+            if ready:
+                # Rotación para repartir entre keys con la misma cuota restante
+                offset = next(self._rotation)
+                ordered = ready[offset % len(ready):] + ready[:offset % len(ready)]
+                key = max(ordered, key=lambda candidate: candidate.remaining(now))
+            else:
+                key = min(candidates, key=lambda candidate: candidate.cooldown_until)
+
+            key.rpm.consume(1)
+            key.tpm.consume(key.tpm.clamp(tokens))
+            key.usage["requests"] += 1
+            return key
+
+    def release(self, key: ApiKey, reserved_tokens: int):
+        """Devuelve la reserva de una petición que no llegó a enviarse (p. ej. breaker abierto)"""
+        with self._lock:
+            key.rpm.adjust(-1)
+            key.tpm.adjust(-key.tpm.clamp(reserved_tokens))
+            key.usage["requests"] -= 1
+
+    def record_success(self, key: ApiKey, reserved_tokens: int, used_tokens: int = None):
+        """Anota el consumo real y restablece el backoff de la key"""
+        with self._lock:
+            key.backoff_seconds = 0.0
+            if used_tokens is not None:
+                key.tpm.adjust(used_tokens - key.tpm.clamp(reserved_tokens))
+                key.usage["tokens"] += used_tokens
+
+    def record_failure(self, key: ApiKey, error: Exception):
+        """Anota un fallo; un 429 retira la key con backoff exponencial"""
+        with self._lock:
+            key.usage["failures"] += 1
+            if not is_rate_limited(error):
+                return
+            key.usage["rate_limited"] += 1
+            key.backoff_seconds = min(self.max_backoff_seconds,
+                                      key.backoff_seconds * 2 if key.backoff_seconds else self.backoff_seconds)
+            key.cooldown_until = time.monotonic() + key.backoff_seconds
+        print(f"⚠️ API key {key.key_id} limitada (429), retirada {key.backoff_seconds:.0f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        """Uso, cuota restante y backoff por key"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                key.key_id: dict(
+                    key.usage,
+                    remaining_quota=round(key.remaining(now), 3),
+                    cooling_down=key.cooldown_until > now,
+                    retry_in_seconds=round(max(0.0, key.cooldown_until - now), 1)
+                )
+                for key in self.keys
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_key_pool() -> ApiKeyPool:
+    """Pool compartido por todos los routers del proceso"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            load_dotenv()
+            _pool = ApiKeyPool()
+        return _pool
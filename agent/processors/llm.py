@@ -0,0 +1,141 @@
+"""
+Ejecución no bloqueante de llamadas a Gemini
+
+El SDK de Gemini es síncrono: las llamadas se ejecutan en un pool de hilos
+acotado para no congelar el event loop de FastAPI. La admisión de cada
+llamada la decide el planificador (prioridad por canal, RPM, TPM y límite
+de llamadas en vuelo).
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+
+from processors.prompt_compactor import estimate_tokens
+from processors.scheduler import LLMScheduler
+
+# Máximo de llamadas simultáneas a Gemini en este proceso
+MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))
+# Hilos para el trabajo bloqueante (caché, llamadas al modelo, git)
+EXECUTOR_WORKERS = int(os.getenv('GEMINI_EXECUTOR_WORKERS', str(MAX_CONCURRENCY * 2)))
+# Hilos reservados para las acciones del scaffolder (no compiten con el tráfico de desarrollo)
+SCAFFOLDER_WORKERS = int(os.getenv('SCHEDULER_SCAFFOLDER_WORKERS', '4'))
+# Tokens de salida que se reservan por llamada hasta conocer el consumo real
+EXPECTED_OUTPUT_TOKENS = int(os.getenv('SCHEDULER_OUTPUT_TOKENS', '512'))
+# Tokens que Gemini factura por imagen
+IMAGE_TOKENS = 258
+
+_executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="ai-agent")
+_scaffolder_executor = ThreadPoolExecutor(max_workers=SCAFFOLDER_WORKERS, thread_name_prefix="ai-agent-scaffolder")
+scheduler = LLMScheduler(max_concurrency=MAX_CONCURRENCY)
+_stats_lock = threading.Lock()
+_stats = {
+    "in_flight": 0,
+    "waiting": 0,
+    "completed": 0,
+    "failed": 0,
+    "cancelled": 0
+}
+
+def _update_stats(**deltas):
+    with _stats_lock:
+        for name, delta in deltas.items():
+            _stats[name] += delta
+
+def estimate_request_tokens(contents) -> int:
+    """Tokens estimados de una petición: prompt, imágenes y salida esperada"""
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    tokens = EXPECTED_OUTPUT_TOKENS
+    for part in parts:
+        tokens += estimate_tokens(part) if isinstance(part, str) else IMAGE_TOKENS
+    return tokens
+
+def usage_tokens(response) -> Any:
+    """Tokens reales de una respuesta, o None si el SDK no los informa"""
+    usage = getattr(response, 'usage_metadata', None)
+    total = getattr(usage, 'total_token_count', None) if usage is not None else None
+    return total or None
+
+class Reservation:
+    """Hueco concedido por el planificador para una llamada"""
+
+    def __init__(self, tokens: int, wait_ms: float):
+        self.tokens = tokens
+        self.wait_ms = wait_ms
+        self.used_tokens = None
+        self.cancelled = False
+
+    def settle(self, response):
+        """Anota el consumo real de la respuesta para ajustar el presupuesto TPM"""
+        self.used_tokens = usage_tokens(response)
+
+    def cancel(self):
+        """La llamada se abandona antes de enviarse: la reserva se devuelve entera"""
+        self.cancelled = True
+
+@contextmanager
+def scheduled(contents, channel: str = 'dev'):
+    """
+    Reserva turno en el planificador durante una llamada al modelo
+
+    Args:
+        contents: Prompt o lista [prompt, imagen] (para estimar tokens)
+        channel: 'scaffolder' o 'dev'
+    """
+    tokens = estimate_request_tokens(contents)
+    _update_stats(waiting=1)
+    try:
+        wait_ms = scheduler.acquire(channel, tokens)
+    finally:
+        _update_stats(waiting=-1)
+
+    reservation = Reservation(tokens, wait_ms)
+    _update_stats(in_flight=1)
+    try:
+        yield reservation
+        _update_stats(completed=1)
+    except Exception:
+        _update_stats(**({"cancelled": 1} if reservation.cancelled else {"failed": 1}))
+        raise
+    finally:
+        _update_stats(in_flight=-1)
+        scheduler.release(tokens, reservation.used_tokens, reservation.cancelled)
+
+def generate_content(model, contents, channel: str = 'dev', **kwargs):
+    """Llama a model.generate_content cuando el planificador concede turno"""
+    with scheduled(contents, channel) as reservation:
+        response = model.generate_content(contents, **kwargs)
+        reservation.settle(response)
+        return response
+
+def submit(executor: ThreadPoolExecutor, func: Callable, *args, **kwargs) -> Future:
+    """
+    Envía una función a un pool de hilos con una copia del contexto actual
+
+    ThreadPoolExecutor no propaga los ContextVar: sin la copia, la traza de la
+    petición (request_trace) no existe en el hilo y sus llamadas al modelo no
+    se anotan. Todo salto a un pool del agente pasa por aquí.
+    """
+    context = contextvars.copy_context()
+    return executor.submit(context.run, func, *args, **kwargs)
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """Ejecuta una función bloqueante en el pool acotado sin bloquear el event loop"""
+    return await run_for_channel('dev', func, *args, **kwargs)
+
+async def run_for_channel(channel: str, func: Callable, *args, **kwargs) -> Any:
+    """Como run_blocking, pero las acciones del scaffolder usan su propio pool de hilos"""
+    executor = _scaffolder_executor if channel == 'scaffolder' else _executor
+    return await asyncio.wrap_future(submit(executor, func, *args, **kwargs))
+
+def get_stats() -> Dict[str, Any]:
+    """Estado del pool y del planificador de llamadas a Gemini"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["max_concurrency"] = MAX_CONCURRENCY
+    stats["executor_workers"] = EXECUTOR_WORKERS
+    stats["scaffolder_workers"] = SCAFFOLDER_WORKERS
+    return stats
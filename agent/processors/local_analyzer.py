@@ -0,0 +1,240 @@
+"""
+Analizador local basado en reglas para descripciones explícitas
+
+Cuando la descripción nombra sus servicios de forma explícita
+("API Gateway + Lambda + DynamoDB"), la detección por palabras clave da la
+respuesta correcta en microsegundos. El analizador calcula una confianza y
+solo devuelve un análisis completo si supera el umbral configurado.
+"""
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Nombre canónico de cada clave de BackstageGenerator.aws_service_mappings
+CANONICAL_NAMES = {
+    'api gateway': 'API Gateway',
+    'apigw': 'API Gateway',
+    'lambda': 'Lambda',
+    'ec2': 'EC2',
+    'ecs': 'ECS',
+    'fargate': 'Fargate',
+    'dynamodb': 'DynamoDB',
+    'rds': 'RDS',
+    'aurora': 'Aurora',
+    'mysql': 'RDS',
+    'postgres': 'RDS',
+    's3': 'S3',
+    'efs': 'EFS',
+    'cloudfront': 'CloudFront',
+    'elb': 'ELB',
+    'alb': 'ALB',
+    'nlb': 'NLB',
+    'route53': 'Route 53',
+    'vpc': 'VPC',
+    'sqs': 'SQS',
+    'sns': 'SNS',
+    'eventbridge': 'EventBridge',
+    'cloudwatch': 'CloudWatch',
+    'x-ray': 'X-Ray',
+}
+
+# Variantes de escritura habituales
+ALIASES = {
+    'api-gateway': 'api gateway',
+    'apigateway': 'api gateway',
+    'amazon api gateway': 'api gateway',
+    'aws lambda': 'lambda',
+    'dynamo db': 'dynamodb',
+    'dynamo': 'dynamodb',
+    'amazon s3': 's3',
+    'route 53': 'route53',
+    'cloud front': 'cloudfront',
+    'postgresql': 'postgres',
+    'xray': 'x-ray',
+    'event bridge': 'eventbridge',
+    'cloud watch': 'cloudwatch',
+}
+
+# Nombres que el modelo suele devolver y no están en el analizador local
+MODEL_ALIASES = {
+    'acm': 'ACM',
+    'certificate manager': 'ACM',
+    'application load balancer': 'ALB',
+    'network load balancer': 'NLB',
+    'elastic load balancing': 'ELB',
+    'simple storage service': 'S3',
+    'simple queue service': 'SQS',
+    'simple notification service': 'SNS',
+    'elastic container service': 'ECS',
+    'relational database service': 'RDS',
+}
+
+# Conectores y relleno que no restan explicitud
+FILLER_WORDS = {
+    'aws', 'amazon', 'and', 'y', 'with', 'con', 'plus', 'using', 'usando', 'uses', 'usa',
+    'a', 'an', 'the', 'un', 'una', 'el', 'la', 'los', 'las', 'de', 'del', 'en', 'in', 'on',
+    'for', 'para', 'to', 'a', 'behind', 'detrás', 'tras', 'over', 'sobre', 'via', 'por',
+    'architecture', 'arquitectura', 'app', 'application', 'aplicación', 'stack', 'api',
+}
+
+# Términos genéricos que sugieren servicios no nombrados explícitamente
+AMBIGUOUS_TERMS = [
+    'database', 'base de datos', 'queue', 'cola', 'cache', 'caché', 'cdn', 'storage',
+    'almacenamiento', 'container', 'contenedor', 'kubernetes', 'load balancer',
+    'balanceador', 'auth', 'autenticación', 'search', 'búsqueda', 'streaming', 'ml',
+    'machine learning', 'data lake', 'warehouse',
+]
+
+# Negaciones que excluyen el servicio que les sigue ("S3 + Lambda sin RDS", "migrar de RDS a Aurora")
+NEGATION_PATTERN = re.compile(
+    r'\b(?:sin|no|ni|without|not|nor|except|excepto|salvo|instead of|en lugar de|en vez de|'
+    r'(?:migrar|migrando|migrate|migrating|moving|mover) (?:de|from))\b',
+    re.IGNORECASE
+)
+# Separadores y conectores que cierran la ventana de una negación
+NEGATION_BREAK = re.compile(r'[+,;.:()/&]|\b(?:con|with|y|and|plus|pero|but|a|to|hacia|into)\b', re.IGNORECASE)
+# Palabras previas a un servicio en las que se busca la negación
+NEGATION_WINDOW_WORDS = 4
+
+def canonical_service(name: str) -> str:
+    """Nombre canónico de un servicio para comparar ("Amazon S3", "s3" y "S3" son el mismo)"""
+    key = re.sub(r'\(.*?\)', ' ', str(name)).lower()
+    key = re.sub(r'^\s*(amazon|aws)\s+', '', key)
+    key = ' '.join(key.split())
+    if key in MODEL_ALIASES:
+        return MODEL_ALIASES[key]
+    key = ALIASES.get(key, key)
+    return CANONICAL_NAMES.get(key, CANONICAL_NAMES.get(key.replace(' ', ''), name.strip()))
+
+class LocalAnalyzer:
+    """Análisis de servicios AWS por reglas con puntuación de confianza"""
+
+    def __init__(self, service_keys: Iterable[str], threshold: float = None, max_words: int = None):
+        """
+        Inicializar analizador
+
+        Args:
+            service_keys: Claves de servicio conocidas (BackstageGenerator.aws_service_mappings)
+            threshold: Confianza mínima para evitar el LLM (default: LOCAL_ANALYZER_THRESHOLD o 0.8)
+            max_words: Descripciones más largas pierden confianza (default: LOCAL_ANALYZER_MAX_WORDS o 40)
+        """
+        terms = {key: key for key in service_keys}
+        terms.update({alias: key for alias, key in ALIASES.items() if key in terms})
+        self._terms = terms
+        self._pattern = re.compile(
+            r'(?<![\w-])(' + '|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)) + r')(?![\w-])',
+            re.IGNORECASE
+        )
+        self.threshold = threshold if threshold is not None else float(os.getenv('LOCAL_ANALYZER_THRESHOLD', '0.8'))
+        self.max_words = max_words or int(os.getenv('LOCAL_ANALYZER_MAX_WORDS', '40'))
+
+    def detect(self, description: str) -> Tuple[List[str], float]:
+        """
+        Detecta servicios y calcula la confianza
+
+        Las menciones negadas ("sin RDS") no cuentan como servicio y restan
+        confianza: la descripción necesita interpretación.
+
+        Returns:
+            Tupla (servicios canónicos en orden de aparición, confianza 0..1)
+        """
+        services: List[str] = []
+        negated = set()
+        for match in self._pattern.finditer(description):
+            key = self._terms[match.group(1).lower()]
+            name = CANONICAL_NAMES.get(key, key.upper())
+            if self._negated(description, match.start()):
+                negated.add(name)
+            elif name not in services:
+                services.append(name)
+
+        if not services:
+            return [], 0.0
+
+        # Palabras que no son servicios ni conectores: cuanto menos "texto libre", más explícita
+        remainder = self._pattern.sub(' ', description.lower())
+        words = re.findall(r'[\wáéíóúñü]+', remainder)
+        content_words = [word for word in words if word not in FILLER_WORDS and not word.isdigit()]
+        total_words = len(content_words) + len(services)
+        coverage = len(services) / total_words
+
+        confidence = 0.6 * coverage + 0.4 * min(1.0, len(services) / 3.0)
+
+        # Términos genéricos sin servicio concreto: puede haber servicios implícitos
+        desc_lower = description.lower()
+        ambiguous = sum(1 for term in AMBIGUOUS_TERMS if re.search(r'\b' + re.escape(term) + r'\b', desc_lower))
+        confidence -= 0.15 * ambiguous
+        confidence -= 0.15 * len(negated - set(services))
+
+        # Descripciones largas suelen requerir interpretación
+        if total_words > self.max_words:
+            confidence *= self.max_words / total_words
+
+        return services, round(max(0.0, min(1.0, confidence)), 3)
+
+    @staticmethod
+    def _negated(description: str, start: int) -> bool:
+        """La mención que empieza en start está dentro de la ventana de una negación"""
+        window = description[:start]
+        breaks = list(NEGATION_BREAK.finditer(window))
+        if breaks:
+            window = window[breaks[-1].end():]
+        return bool(NEGATION_PATTERN.search(' '.join(window.split()[-NEGATION_WINDOW_WORDS:])))
+
+    def analyze(self, description: str) -> Optional[Dict[str, Any]]:
+        """
+        Devuelve un análisis completo si la confianza supera el umbral
+
+        Returns:
+            Dict con el mismo formato que el análisis de Gemini, o None
+        """
+        services, confidence = self.detect(description)
+        if not services or confidence < self.threshold:
+            return None
+        return self.build_analysis(services, description, confidence)
+
+    def build_analysis(self, services: List[str], description: str, confidence: float) -> Dict[str, Any]:
+        """
+        Análisis con el formato de Gemini a partir de servicios ya detectados
+
+        Args:
+            services: Servicios canónicos
+            description: Texto de origen (descripción del usuario o del diagrama)
+            confidence: Confianza de la detección
+        """
+        solution_type = self._solution_type(services)
+        return {
+            "services": services,
+            "solution_type": solution_type,
+            "title": f"AWS {solution_type.replace('-', ' ').title()} with {', '.join(services[:3])}",
+            "description": description.strip()[:200],
+            "component_type": "service",
+            "tags": ["aws", solution_type] + [service.lower().replace(' ', '-') for service in services[:5]],
+            "parameters": self._parameters(services),
+            "confidence": confidence
+        }
+
+    def _solution_type(self, services: List[str]) -> str:
+        names = set(services)
+        if names & {'SQS', 'SNS', 'EventBridge'} and 'Lambda' in names:
+            return 'event-driven'
+        if 'Lambda' in names:
+            return 'serverless'
+        if names & {'ECS', 'Fargate'}:
+            return 'microservices'
+        if names <= {'S3', 'CloudFront', 'Route 53'}:
+            return 'static-website'
+        return 'web-app'
+
+    def _parameters(self, services: List[str]) -> List[Dict[str, str]]:
+        parameters = [
+            {"name": "environment", "title": "Environment", "type": "string"},
+            {"name": "region", "title": "AWS Region", "type": "string"}
+        ]
+        if 'CloudFront' in services or 'Route 53' in services:
+            parameters.append({"name": "domain_name", "title": "Domain Name", "type": "string"})
+        if 'RDS' in services or 'Aurora' in services:
+            parameters.append({"name": "db_instance_class", "title": "DB Instance Class", "type": "string"})
+        if 'Lambda' in services:
+            parameters.append({"name": "lambda_runtime", "title": "Lambda Runtime", "type": "string"})
+        return parameters
@@ -0,0 +1,432 @@
+"""
+Enrutado de modelos Gemini según latencia, con peticiones de cobertura (hedging)
+
+Cada modelo lleva una ventana móvil de latencias y errores. Las peticiones
+van al modelo con mejor p50 y tasa de error aceptable; si ese modelo supera
+su presupuesto p95 (contado desde que el planificador le da turno), se
+lanza un duplicado al segundo modelo y se usa la primera respuesta correcta;
+la perdedora se abandona si aún esperaba turno. Con cola en el planificador
+no se duplica.
+"""
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import google.generativeai as genai
+from google.api_core import exceptions as api_exceptions
+
+from processors import llm, request_trace
+from processors.circuit_breaker import breakers, CircuitOpenError, OPEN
+from processors.key_pool import get_key_pool
+from processors.cassette import get_cassette
+from processors.context_cache import get_context_cache
+from processors.json_stream import consume_json_stream, estimate_usage, needs_usage_estimate
+
+DEFAULT_MODELS = 'gemini-2.5-flash,gemini-flash-latest,gemini-pro-latest'
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() == 'true'
+
+@dataclass
+class RoutingPolicy:
+    """Política de enrutado de un tipo de tráfico (scaffolder o API de desarrollo)"""
+    hedge: bool = False
+    hedge_percentile: float = 95.0
+    min_hedge_ms: float = 500.0
+    min_samples: int = 5
+    max_error_rate: float = 0.5
+
+def load_policies() -> Dict[str, RoutingPolicy]:
+    """Políticas por endpoint configurables por variables de entorno"""
+    return {
+        'scaffolder': RoutingPolicy(
+            hedge=_env_bool('ROUTER_SCAFFOLDER_HEDGE', 'true'),
+            hedge_percentile=float(os.getenv('ROUTER_SCAFFOLDER_HEDGE_PERCENTILE', '95')),
+            min_hedge_ms=float(os.getenv('ROUTER_SCAFFOLDER_MIN_HEDGE_MS', '500')),
+        ),
+        'dev': RoutingPolicy(
+            hedge=_env_bool('ROUTER_DEV_HEDGE', 'false'),
+            hedge_percentile=float(os.getenv('ROUTER_DEV_HEDGE_PERCENTILE', '95')),
+            min_hedge_ms=float(os.getenv('ROUTER_DEV_MIN_HEDGE_MS', '1000')),
+        ),
+    }
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentil por rango más cercano"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+class HedgeCancelled(Exception):
+    """La llamada perdedora de un hedge se abandonó antes de enviarse"""
+
+class HedgeAttempt:
+    """Señales entre generate() y una llamada lanzada en el pool del router"""
+
+    def __init__(self):
+        # La llamada obtuvo turno en el planificador (o terminó antes de obtenerlo)
+        self.admitted = threading.Event()
+        # Otra llamada ya respondió: si aún no se ha enviado, se abandona
+        self.cancelled = threading.Event()
+        # Latencia de la llamada al modelo; generate() anota en la traza solo la de la ganadora
+        self.latency_ms: Optional[float] = None
+
+class ModelStats:
+    """Ventana móvil de latencia y errores de un modelo"""
+
+    def __init__(self, window: int):
+        self._samples = deque(maxlen=window)  # (latency_ms, ok)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+
+    def record(self, latency_ms: float, ok: bool):
+        with self._lock:
+            self._samples.append((latency_ms, ok))
+            self.requests += 1
+
+    def record_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def record_hedge_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def record_hedge_skipped(self):
+        with self._lock:
+            self.hedges_skipped += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = list(self._samples)
+            snapshot = {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedges_skipped": self.hedges_skipped
+            }
+        latencies = [latency for latency, ok in samples if ok]
+        errors = sum(1 for _, ok in samples if not ok)
+        snapshot.update({
+            "samples": len(samples),
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+            "error_rate": round(errors / len(samples), 4) if samples else 0.0
+        })
+        return snapshot
+
+    def latency_percentile(self, pct: float) -> float:
+        with self._lock:
+            latencies = [latency for latency, ok in self._samples if ok]
+        return percentile(latencies, pct)
+
+class ModelRouter:
+    """Elige el modelo Gemini por latencia y error, con hedging opcional"""
+
+    def __init__(self, name: str, model_names: List[str] = None, window: int = None):
+        """
+        Inicializar router
+
+        Args:
+            name: Nombre del router ('text' o 'vision'), para métricas
+            model_names: Modelos candidatos en orden de preferencia (default: GEMINI_MODELS)
+            window: Tamaño de la ventana móvil de muestras (default: ROUTER_WINDOW o 50)
+        """
+        self.name = name
+        if model_names is None:
+            model_names = [m.strip() for m in os.getenv('GEMINI_MODELS', DEFAULT_MODELS).split(',') if m.strip()]
+        self.model_names = model_names
+        # Un GenerativeModel por (modelo, API key), cada uno con el cliente de su key
+        self.key_pool = get_key_pool()
+        # Grabación/reproducción de respuestas (GEMINI_CASSETTE_MODE)
+        self.cassette = get_cassette()
+        # Preámbulos estáticos cacheados en el proveedor (PROMPT_CACHE_MODE)
+        self.context_cache = get_context_cache()
+        self.models = {}
+        for model_name in model_names:
+            for key in self.key_pool.keys:
+                model = genai.GenerativeModel(model_name)
+                if key.client is not None:
+                    model._client = key.client
+                self.models[(model_name, key.key_id)] = model
+        window = window or int(os.getenv('ROUTER_WINDOW', '50'))
+        self.stats = {model_name: ModelStats(window) for model_name in model_names}
+        self.policies = load_policies()
+        # Fracción de peticiones enviadas a otro modelo para mantener sus estadísticas al día
+        self.explore_rate = float(os.getenv('ROUTER_EXPLORE_RATE', '0.05'))
+        # Respuestas JSON consumidas en streaming y cortadas al cerrarse el objeto
+        self.streaming = _env_bool('GEMINI_STREAMING', 'true')
+        self._stream_lock = threading.Lock()
+        self._stream_stats = {
+            "streamed": 0,
+            "early_terminated": 0,
+            "estimated_usage": 0,
+            "chunks": 0,
+            "first_chunk_ms_total": 0.0
+        }
+        self._executor = ThreadPoolExecutor(
+            max_workers=llm.MAX_CONCURRENCY * 2,
+            thread_name_prefix=f"router-{name}"
+        )
+
+    @property
+    def primary_model_name(self) -> Optional[str]:
+        """Modelo preferido por configuración"""
+        return self.model_names[0] if self.model_names else None
+
+    @property
+    def cache_scope(self) -> str:
+        """
+        Conjunto de modelos que pueden responder (se usa en las claves de caché)
+
+        Con hedging o fallback la respuesta puede venir de cualquiera de ellos,
+        así que cambiar la lista de modelos separa las entradas cacheadas.
+        """
+        return ','.join(self.model_names)
+
+    def rank_models(self, channel: str = 'dev') -> List[str]:
+        """Ordena los modelos: sanos y rápidos primero, sin muestras después, con errores al final"""
+        policy = self.policies.get(channel, self.policies['dev'])
+
+        def sort_key(item):
+            index, model_name = item
+            snapshot = self.stats[model_name].snapshot()
+            unhealthy = (snapshot["samples"] >= policy.min_samples and snapshot["error_rate"] > policy.max_error_rate) \
+                or self._circuit_open(model_name)
+            sampled = snapshot["samples"] >= policy.min_samples
+            return (unhealthy, not sampled, snapshot["p50_ms"] if sampled else 0.0, index)
+
+        return [model_name for _, model_name in sorted(enumerate(self.model_names), key=sort_key)]
+
+    def available(self) -> bool:
+        """Hay al menos un modelo cuyo circuito no está abierto"""
+        return any(not self._circuit_open(model_name) for model_name in self.model_names)
+
+    def generate(self, contents, channel: str = 'dev', prefix: str = None, stream: bool = None,
+                 on_services: Callable[[List[str]], None] = None, **kwargs) -> Tuple[Any, str]:
+        """
+        Genera contenido con el mejor modelo disponible
+
+        Args:
+            contents: Prompt o lista [prompt, imagen] para generate_content
+            channel: 'scaffolder' o 'dev' (selecciona la política de enrutado)
+            prefix: Preámbulo estático que precede a contents; se sirve desde la caché de contexto si es posible
+            stream: Consumir la respuesta JSON en streaming y cortarla al cerrarse (default: GEMINI_STREAMING)
+            on_services: Con streaming, recibe la lista de servicios en cuanto llega, antes del resto de la respuesta
+
+        Returns:
+            Tupla (respuesta, nombre del modelo que respondió)
+        """
+        if not self.model_names:
+            raise ValueError("No hay modelos de Gemini configurados")
+
+        streaming = self.streaming if stream is None else stream
+        if streaming:
+            kwargs["consume"] = lambda chunks: self._consume_stream(chunks, on_services)
+
+        policy = self.policies.get(channel, self.policies['dev'])
+        ranked = self.rank_models(channel)
+        candidates = [model_name for model_name in ranked[1:]
+                      if not self._circuit_open(model_name)]
+        if candidates and random.random() < self.explore_rate:
+            explored = random.choice(candidates)
+            ranked.remove(explored)
+            ranked.insert(0, explored)
+        primary = ranked[0]
+
+        budget_ms = None
+        primary_stats = self.stats[primary]
+        if policy.hedge and len(ranked) > 1 and primary_stats.snapshot()["samples"] >= policy.min_samples:
+            budget_ms = max(policy.min_hedge_ms, primary_stats.latency_percentile(policy.hedge_percentile))
+
+        if budget_ms is None:
+            try:
+                return self._call(primary, contents, channel, prefix, **kwargs), primary
+            except Exception as e:
+                if len(ranked) < 2:
+                    raise
+                # Reintentar una vez con el siguiente modelo del ranking
+                print(f"⚠️ Modelo {primary} falló ({e}), reintentando con {ranked[1]}")
+                return self._call(ranked[1], contents, channel, prefix, **kwargs), ranked[1]
+
+        attempts = {}
+        futures = {}
+
+        def launch(model_name: str):
+            attempt = HedgeAttempt()
+            future = llm.submit(self._executor, self._call, model_name, contents, channel, prefix,
+                                attempt=attempt, **kwargs)
+            future.add_done_callback(lambda _: attempt.admitted.set())
+            futures[future], attempts[future] = model_name, attempt
+            return attempt
+
+        # El presupuesto empieza con la admisión: la espera en la cola del planificador no es latencia del modelo
+        launch(primary).admitted.wait()
+        done, _ = wait(futures, timeout=budget_ms / 1000.0)
+
+        if not done:
+            if llm.scheduler.backlog():
+                # Con cola en el planificador el duplicado solo consumiría el mismo cupo RPM/TPM
+                primary_stats.record_hedge_skipped()
+            else:
+                # El primario supera su p95: duplicar la petición al siguiente modelo
+                primary_stats.record_hedge()
+                request_trace.record_hedge()
+                launch(ranked[1])
+
+        pending = set(futures)
+        last_error, last_failed = None, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error, last_failed = e, future
+                    continue
+                model_name = futures[future]
+                # Solo el tiempo de la ganadora cuenta en la etapa llm de la petición
+                request_trace.record_call(model_name, attempts[future].latency_ms or 0.0)
+                if model_name != primary:
+                    self.stats[model_name].record_hedge_win()
+                # La perdedora se abandona si aún no se ha enviado (su reserva vuelve al planificador)
+                for other in pending:
+                    attempts[other].cancelled.set()
+                    other.cancel()
+                return response, model_name
+
+        request_trace.record_call(futures[last_failed], attempts[last_failed].latency_ms or 0.0, answered=False)
+        raise last_error
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Latencias p50/p95 y tasa de error por modelo"""
+        return {
+            "models": {model_name: self.stats[model_name].snapshot() for model_name in self.model_names},
+            "ranking": {channel: self.rank_models(channel) for channel in self.policies},
+            "policies": {channel: vars(policy) for channel, policy in self.policies.items()},
+            "circuit_breakers": {f"{model_name}/{key_id}": breakers.get(model_name, key_id).snapshot()
+                                 for model_name in self.model_names for key_id in self.key_pool.key_ids},
+            "streaming": self._streaming_stats()
+        }
+
+    def _consume_stream(self, chunks, on_services: Callable[[List[str]], None] = None):
+        response = consume_json_stream(chunks, on_services)
+        with self._stream_lock:
+            self._stream_stats["streamed"] += 1
+            self._stream_stats["chunks"] += response.chunks
+            self._stream_stats["first_chunk_ms_total"] += response.first_chunk_ms
+            if response.truncated:
+                self._stream_stats["early_terminated"] += 1
+        return response
+
+    def _record_estimated_usage(self):
+        with self._stream_lock:
+            self._stream_stats["estimated_usage"] += 1
+
+    def _streaming_stats(self) -> Dict[str, Any]:
+        with self._stream_lock:
+            stats = dict(self._stream_stats)
+        streamed = stats["streamed"]
+        stats["avg_first_chunk_ms"] = round(stats.pop("first_chunk_ms_total") / streamed, 1) if streamed else 0.0
+        stats["enabled"] = self.streaming
+        return stats
+
+    def _circuit_open(self, model_name: str) -> bool:
+        """El circuito del modelo está abierto para todas las API keys"""
+        return all(breakers.get(model_name, key_id).state == OPEN for key_id in self.key_pool.key_ids)
+
+    def _call(self, model_name: str, contents, channel: str = 'dev', prefix: str = None,
+              attempt: HedgeAttempt = None, **kwargs):
+        # Prompt completo: es lo que se factura (el prefijo cacheado a precio reducido) y la clave del cassette
+        full_contents = contents
+        if prefix:
+            full_contents = [prefix] + (list(contents) if isinstance(contents, (list, tuple)) else [contents])
+
+        # La espera en la cola del planificador no cuenta como latencia del modelo
+        with llm.scheduled(full_contents, channel) as reservation:
+            if attempt is not None:
+                if attempt.cancelled.is_set():
+                    # Otro modelo respondió mientras esta llamada esperaba turno
+                    reservation.cancel()
+                    raise HedgeCancelled(f"Hedge de {model_name} cancelado")
+                attempt.admitted.set()
+            key = self.key_pool.select(
+                reservation.tokens,
+                usable=lambda key_id: breakers.get(model_name, key_id).state != OPEN
+            )
+            breaker = breakers.get(model_name, key.key_id)
+            if not breaker.allow_request():
+                # La llamada no se envía: la key y el planificador recuperan su cuota
+                self.key_pool.release(key, reservation.tokens)
+                reservation.cancel()
+                raise CircuitOpenError(f"Circuito abierto para {breaker.name}")
+
+            # Admitida por el breaker: cualquier salida registra un resultado (una sonda half-open nunca queda ocupada)
+            latency_ms = None
+            try:
+                model, request_contents, cached = self.models[(model_name, key.key_id)], full_contents, None
+                if prefix and not self.cassette.replaying:
+                    cached = self.context_cache.lookup(model_name, prefix)
+                    cached_model = cached.model_for(key) if cached is not None else None
+                    if cached_model is not None:
+                        # Solo se envía la parte variable; el prefijo ya está en el proveedor
+                        model, request_contents = cached_model, contents
+                    else:
+                        cached = None
+
+                start = time.perf_counter()
+                try:
+                    response = self.cassette.generate_content(
+                        model, model_name, request_contents, key_contents=full_contents, **kwargs
+                    )
+                except Exception as e:
+                    if cached is not None and isinstance(e, api_exceptions.NotFound):
+                        self.context_cache.invalidate(model_name, cached.name)
+                    failed_ms = (time.perf_counter() - start) * 1000
+                    self.stats[model_name].record(failed_ms, False)
+                    if attempt is not None:
+                        attempt.latency_ms = failed_ms
+                    else:
+                        request_trace.record_llm(model_name, failed_ms)
+                    self.key_pool.record_failure(key, e)
+                    raise
+                latency_ms = (time.perf_counter() - start) * 1000
+                if needs_usage_estimate(response):
+                    base_model = self.models[(model_name, key.key_id)]
+                    estimate_usage(
+                        response,
+                        lambda: base_model.count_tokens(full_contents).total_tokens,
+                        reservation.tokens - llm.EXPECTED_OUTPUT_TOKENS,
+                        llm.EXPECTED_OUTPUT_TOKENS
+                    )
+                    self._record_estimated_usage()
+                if attempt is not None:
+                    # Intento de un hedge: el coste se anota siempre, el tiempo lo decide generate()
+                    attempt.latency_ms = latency_ms
+                    request_trace.record_usage(model_name, response)
+                else:
+                    request_trace.record_llm(model_name, latency_ms, response)
+                reservation.settle(response)
+                self.key_pool.record_success(key, reservation.tokens, reservation.used_tokens)
+            except BaseException:
+                if latency_ms is None:
+                    breaker.record_failure()
+                else:
+                    # El modelo respondió; el fallo fue de la contabilidad local
+                    breaker.record_success(latency_ms)
+                raise
+
+        self.stats[model_name].record(latency_ms, True)
+        breaker.record_success(latency_ms)
+        return response
@@ -0,0 +1,156 @@
+"""
+Compactación de descripciones largas antes de enviarlas al modelo
+
+Estima tokens localmente, elimina ruido (boilerplate, espacios, párrafos
+repetidos) y recorta la entrada a un presupuesto de tokens priorizando las
+frases que mencionan servicios AWS conocidos.
+"""
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Tuple
+
+# Líneas que no aportan información de arquitectura
+BOILERPLATE_PATTERNS = [
+    re.compile(r'^\s*(page|página)\s+\d+(\s+(of|de)\s+\d+)?\s*$', re.IGNORECASE),
+    re.compile(r'^\s*(confidential|confidencial|internal use only|uso interno)\b.*$', re.IGNORECASE),
+    re.compile(r'^\s*(copyright|©|\(c\))\s.*$', re.IGNORECASE),
+    re.compile(r'^\s*(table of contents|tabla de contenidos?|índice)\s*:?\s*$', re.IGNORECASE),
+    re.compile(r'^\s*[-=_*#~]{3,}\s*$'),
+]
+MARKUP_PATTERNS = [
+    (re.compile(r'!\[[^\]]*\]\([^)]*\)'), ' '),       # imágenes markdown
+    (re.compile(r'\[([^\]]+)\]\([^)]*\)'), r'\1'),    # enlaces markdown -> texto
+    (re.compile(r'<[^>]+>'), ' '),                    # etiquetas HTML
+    (re.compile(r'^\s{0,3}(#{1,6}|[-*+>])\s+', re.MULTILINE), ''),  # títulos, viñetas, citas (la numeración se conserva)
+    # Énfasis solo cuando va emparejado; los guiones bajos dentro de palabras
+    # (user_events, s3_bucket) forman parte de nombres de recursos
+    (re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*'), r'\1'),
+    (re.compile(r'(?<!\w)__(?=\S)(.+?)(?<=\S)__(?!\w)'), r'\1'),
+    (re.compile(r'(?<![\w*])\*(?=[^\s*])(.+?)(?<=[^\s*])\*(?![\w*])'), r'\1'),
+    (re.compile(r'`([^`\n]+)`'), r'\1'),
+]
+# No se corta tras la numeración de una lista ("1. Usar S3 ...")
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?;])(?<!\d\.)\s+|\n+')
+
+@lru_cache(maxsize=4096)
+def estimate_tokens(text: str) -> int:
+    """Estimación local de tokens (~4 caracteres o ~0.75 palabras por token)"""
+    if not text:
+        return 0
+    by_chars = len(text) / 4.0
+    by_words = len(text.split()) / 0.75
+    return int(max(by_chars, by_words) + 0.5)
+
+class PromptCompactor:
+    """Reduce descripciones a un presupuesto de tokens conservando lo relevante"""
+
+    def __init__(self, priority_terms: Iterable[str], max_tokens: int = None):
+        """
+        Inicializar compactador
+
+        Args:
+            priority_terms: Términos (servicios AWS) cuyas frases se conservan primero
+            max_tokens: Presupuesto de tokens de la descripción (default: PROMPT_MAX_INPUT_TOKENS o 2000)
+        """
+        self.priority_terms = sorted({term.lower() for term in priority_terms}, key=len, reverse=True)
+        self._term_pattern = re.compile(
+            r'\b(' + '|'.join(re.escape(term) for term in self.priority_terms) + r')\b',
+            re.IGNORECASE
+        ) if self.priority_terms else None
+        self.max_tokens = max_tokens or int(os.getenv('PROMPT_MAX_INPUT_TOKENS', '2000'))
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "compacted": 0,
+            "truncated": 0,
+            "tokens_in": 0,
+            "tokens_out": 0
+        }
+
+    def compact(self, text: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Compacta una descripción
+
+        Args:
+            text: Descripción original
+
+        Returns:
+            Tupla (descripción compactada, métricas de tokens)
+        """
+        tokens_in = estimate_tokens(text)
+        cleaned = self._deduplicate_paragraphs(self._strip_boilerplate(text))
+        tokens_clean = estimate_tokens(cleaned)
+
+        truncated = tokens_clean > self.max_tokens
+        result = self._fit_budget(cleaned) if truncated else cleaned
+        tokens_out = estimate_tokens(result)
+
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["tokens_in"] += tokens_in
+            self._stats["tokens_out"] += tokens_out
+            if tokens_out < tokens_in:
+                self._stats["compacted"] += 1
+            if truncated:
+                self._stats["truncated"] += 1
+
+        return result, {
+            "tokens_in": tokens_in,
+            "tokens_out": tokens_out,
+            "truncated": truncated
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Tokens estimados antes y después de compactar"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["tokens_saved"] = stats["tokens_in"] - stats["tokens_out"]
+        stats["max_tokens"] = self.max_tokens
+        return stats
+
+    def _strip_boilerplate(self, text: str) -> str:
+        for pattern, replacement in MARKUP_PATTERNS:
+            text = pattern.sub(replacement, text)
+
+        lines = []
+        for line in text.splitlines():
+            if any(pattern.match(line) for pattern in BOILERPLATE_PATTERNS):
+                continue
+            lines.append(re.sub(r'[ \t]+', ' ', line).strip())
+
+        text = '\n'.join(lines)
+        return re.sub(r'\n{3,}', '\n\n', text).strip()
+
+    def _deduplicate_paragraphs(self, text: str) -> str:
+        seen = set()
+        paragraphs = []
+        for paragraph in re.split(r'\n\s*\n', text):
+            key = re.sub(r'\W+', ' ', paragraph).strip().casefold()
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            paragraphs.append(paragraph.strip())
+        return '\n\n'.join(paragraphs)
+
+    def _fit_budget(self, text: str) -> str:
+        """Selecciona frases por relevancia (menciones AWS) hasta llenar el presupuesto"""
+        sentences = [s.strip() for s in SENTENCE_SPLIT.split(text) if s and s.strip()]
+
+        scored: List[Tuple[int, int, str]] = []
+        for index, sentence in enumerate(sentences):
+            mentions = len(self._term_pattern.findall(sentence)) if self._term_pattern else 0
+            scored.append((mentions, index, sentence))
+
+        # Más menciones primero; a igualdad, se conserva el orden original
+        selected = []
+        budget = self.max_tokens
+        for mentions, index, sentence in sorted(scored, key=lambda item: (-item[0], item[1])):
+            cost = estimate_tokens(sentence) + 1
+            if cost > budget:
+                continue
+            selected.append((index, sentence))
+            budget -= cost
+
+        return ' '.join(sentence for _, sentence in sorted(selected))
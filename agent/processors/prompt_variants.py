@@ -0,0 +1,160 @@
+"""
+Registro de variantes de prompt con reparto de tráfico y métricas por variante
+
+Cada procesador declara sus variantes con nombre y versión (p. ej. el
+prompt completo y uno compacto que confía en el esquema JSON). El tráfico
+se reparte por pesos configurables sin redeploy (PROMPT_VARIANTS_<TIPO> y,
+opcionalmente, variantes nuevas en PROMPT_VARIANTS_FILE). Por variante se
+registran latencia, tokens de salida, tasa de fallos de parseo y tasa de
+fallback, para elegir el prompt más barato y rápido que sigue detectando
+los servicios.
+"""
+import json
+import os
+import random
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from processors.model_router import percentile
+
+@dataclass
+class PromptVariant:
+    """Preámbulo de prompt con nombre, versión y peso de tráfico"""
+    name: str
+    version: int
+    prefix: str
+    weight: float = 0.0
+
+    @property
+    def key(self) -> str:
+        """Identificador estable de la variante (forma parte de la clave de caché)"""
+        return f"{self.name}@v{self.version}"
+
+class VariantStats:
+    """Contadores y ventana de latencias de una variante"""
+
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.output_tokens = 0
+        self.token_samples = 0
+        self.parse_failures = 0
+        self.fallbacks = 0
+
+class PromptRegistry:
+    """Variantes de un tipo de prompt ('text' o 'vision') y su reparto de tráfico"""
+
+    def __init__(self, kind: str, variants: List[PromptVariant], window: int = None):
+        """
+        Inicializar registro
+
+        Args:
+            kind: Tipo de prompt; selecciona PROMPT_VARIANTS_<KIND> y la sección del fichero
+            variants: Variantes incorporadas; la primera es la de control
+            window: Latencias conservadas por variante (default: PROMPT_VARIANTS_WINDOW o 200)
+        """
+        self.kind = kind
+        self.variants: Dict[str, PromptVariant] = {}
+        for variant in variants:
+            self.variants[variant.name] = variant
+        self._load_file()
+        self._apply_weights()
+
+        window = window or int(os.getenv('PROMPT_VARIANTS_WINDOW', '200'))
+        self._stats = {name: VariantStats(window) for name in self.variants}
+        self._lock = threading.Lock()
+
+    @property
+    def control(self) -> PromptVariant:
+        """Variante de referencia (la primera declarada)"""
+        return next(iter(self.variants.values()))
+
+    def choose(self) -> PromptVariant:
+        """Variante para una petición, al azar según los pesos"""
+        variants = list(self.variants.values())
+        weights = [max(0.0, variant.weight) for variant in variants]
+        if not any(weights):
+            return self.control
+        return random.choices(variants, weights=weights)[0]
+
+    def record(self, variant: PromptVariant, latency_ms: float, response: Any, result: Optional[dict]):
+        """
+        Registra el resultado de una llamada al modelo con esta variante
+
+        Args:
+            variant: Variante usada
+            latency_ms: Duración de la llamada y el parseo
+            response: Respuesta del modelo, o None si la llamada falló
+            result: Análisis parseado, o None si no fue utilizable (se usará el fallback)
+        """
+        usage = getattr(response, 'usage_metadata', None)
+        output_tokens = getattr(usage, 'candidates_token_count', None) if usage is not None else None
+        with self._lock:
+            stats = self._stats[variant.name]
+            stats.requests += 1
+            stats.latencies.append(latency_ms)
+            if output_tokens:
+                stats.output_tokens += output_tokens
+                stats.token_samples += 1
+            if response is not None and result is None:
+                stats.parse_failures += 1
+            if result is None:
+                stats.fallbacks += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Peso, latencia p50/p95, tokens de salida y tasas de fallo por variante"""
+        with self._lock:
+            result = {}
+            for name, variant in self.variants.items():
+                stats = self._stats[name]
+                latencies = list(stats.latencies)
+                requests = stats.requests
+                result[variant.key] = {
+                    "weight": variant.weight,
+                    "requests": requests,
+                    "p50_ms": round(percentile(latencies, 50), 1),
+                    "p95_ms": round(percentile(latencies, 95), 1),
+                    "avg_output_tokens": round(stats.output_tokens / stats.token_samples, 1) if stats.token_samples else 0.0,
+                    "parse_failure_rate": round(stats.parse_failures / requests, 4) if requests else 0.0,
+                    "fallback_rate": round(stats.fallbacks / requests, 4) if requests else 0.0
+                }
+        return result
+
+    def _load_file(self):
+        """Añade o reemplaza variantes desde PROMPT_VARIANTS_FILE ({"text": [{"name", "version", "prefix", "weight"}]})"""
+        path = os.getenv('PROMPT_VARIANTS_FILE')
+        if not path:
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entries = json.load(f).get(self.kind, [])
+            for entry in entries:
+                variant = PromptVariant(
+                    name=entry["name"],
+                    version=int(entry.get("version", 1)),
+                    prefix=entry["prefix"],
+                    weight=float(entry.get("weight", 0.0))
+                )
+                self.variants[variant.name] = variant
+        except Exception as e:
+            print(f"⚠️ No se pudieron cargar variantes de prompt de {path}: {e}")
+
+    def _apply_weights(self):
+        """Pesos de PROMPT_VARIANTS_<KIND> ('default:90,compact:10'); sin configurar, todo a la de control"""
+        spec = os.getenv(f'PROMPT_VARIANTS_{self.kind.upper()}', '')
+        for item in spec.split(','):
+            name, _, weight = item.partition(':')
+            name = name.strip()
+            if not name:
+                continue
+            if name not in self.variants:
+                print(f"⚠️ Variante de prompt desconocida '{name}' en PROMPT_VARIANTS_{self.kind.upper()}")
+                continue
+            try:
+                self.variants[name].weight = float(weight or 0)
+            except ValueError:
+                print(f"⚠️ Peso inválido para la variante '{name}': {weight}")
+        if not any(variant.weight > 0 for variant in self.variants.values()):
+            self.control.weight = 100.0
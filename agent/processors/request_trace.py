@@ -0,0 +1,264 @@
+"""
+Traza por petición: tiempo por etapa del pipeline y consumo de tokens
+
+Cada petición a un endpoint de análisis abre una traza (el middleware
+RequestTraceMiddleware, o traced()) que viaja en un ContextVar, también a
+los hilos de los pools (llm.submit copia el contexto en cada salto). Las etapas
+(LLM, parseo, validación, generación, base de datos, MinIO, git) suman su
+tiempo de reloj a la traza activa, y el router anota tokens de prompt y de
+salida, modelo y coste estimado de cada llamada. En un hedge solo cuenta el
+tiempo de la llamada ganadora; el duplicado suma su coste y un contador.
+Al cerrar la petición la traza se guarda en request_metrics, enlazada con
+su fila de architecture_analyses, y aggregate() calcula p50/p95 por etapa,
+endpoint y día.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from dotenv import load_dotenv
+
+STAGES = ('llm', 'parse', 'validate', 'generate', 'db', 'minio', 'git')
+
+_current: ContextVar[Optional['RequestTrace']] = ContextVar('request_trace', default=None)
+
+_prices: Optional[Dict[str, Tuple[float, float]]] = None
+
+def get_prices() -> Dict[str, Tuple[float, float]]:
+    """Precios USD por millón de tokens (entrada, salida) de LEDGER_PRICES ('modelo:0.30:2.50,...')"""
+    global _prices
+    if _prices is not None:
+        return _prices
+    load_dotenv()
+    prices = {}
+    for item in os.getenv('LEDGER_PRICES', '').split(','):
+        parts = [part.strip() for part in item.split(':')]
+        if len(parts) != 3 or not parts[0]:
+            continue
+        try:
+            prices[parts[0]] = (float(parts[1]), float(parts[2]))
+        except ValueError:
+            print(f"⚠️ Precio inválido en LEDGER_PRICES: {item}")
+    _prices = prices
+    return prices
+
+class RequestTrace:
+    """Tiempos por etapa y tokens de una petición"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.status = 'success'
+        self.analysis_id: Optional[int] = None
+        self.analysis_path: Optional[str] = None
+        self.model_name: Optional[str] = None
+        self.stages: Dict[str, float] = defaultdict(float)
+        self.llm_calls = 0
+        # Llamadas cuyo consumo se estimó (stream cancelado antes del último trozo)
+        self.estimated_calls = 0
+        # Duplicados lanzados por el router (su coste se suma, su tiempo no)
+        self.hedges = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.cost_usd = 0.0
+        self.total_ms = 0.0
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, elapsed_ms: float):
+        with self._lock:
+            self.stages[name] += elapsed_ms
+
+    def record_llm(self, model_name: str, latency_ms: float, response: Any):
+        """Anota una llamada al modelo: tiempo, tokens y coste estimado"""
+        self.record_call(model_name, latency_ms, answered=response is not None)
+        self.record_usage(model_name, response)
+
+    def record_call(self, model_name: str, latency_ms: float, answered: bool = True):
+        """Anota el tiempo de una llamada al modelo (en un hedge, solo la ganadora)"""
+        with self._lock:
+            self.stages['llm'] += latency_ms
+            self.llm_calls += 1
+            if answered:
+                self.model_name = model_name
+
+    def record_usage(self, model_name: str, response: Any):
+        """Anota tokens y coste de una respuesta (también las perdedoras de un hedge, que se facturan)"""
+        usage = getattr(response, 'usage_metadata', None) if response is not None else None
+        prompt_tokens = (getattr(usage, 'prompt_token_count', 0) or 0) if usage is not None else 0
+        output_tokens = (getattr(usage, 'candidates_token_count', 0) or 0) if usage is not None else 0
+        input_price, output_price = get_prices().get(model_name, (0.0, 0.0))
+        with self._lock:
+            if getattr(response, 'usage_estimated', False):
+                self.estimated_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.output_tokens += output_tokens
+            self.cost_usd += (prompt_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+    def record_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self._started) * 1000
+
+def current() -> Optional[RequestTrace]:
+    """Traza de la petición en curso, si la hay"""
+    return _current.get()
+
+@contextmanager
+def traced(endpoint: str):
+    """
+    Abre la traza de una petición y la guarda en request_metrics al terminar
+
+    Args:
+        endpoint: Ruta del endpoint (agrupa las métricas)
+    """
+    trace = RequestTrace(endpoint)
+    token = _current.set(trace)
+    try:
+        yield trace
+    except BaseException:
+        trace.status = 'error'
+        raise
+    finally:
+        _current.reset(token)
+        trace.finish()
+        _persist(trace)
+
+@contextmanager
+def stage(name: str):
+    """Suma el tiempo del bloque a la etapa indicada de la traza activa"""
+    trace = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace.add_stage(name, (time.perf_counter() - start) * 1000)
+
+def annotate(**fields):
+    """Completa la traza activa (analysis_id, analysis_path, status)"""
+    trace = _current.get()
+    if trace is not None:
+        for name, value in fields.items():
+            setattr(trace, name, value)
+
+def record_llm(model_name: str, latency_ms: float, response: Any = None):
+    """Anota una llamada al modelo en la traza activa (response None si falló)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.record_llm(model_name, latency_ms, response)
+
+def record_call(model_name: str, latency_ms: float, answered: bool = True):
+    """Anota solo el tiempo de una llamada en la traza activa (ganadora de un hedge)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.record_call(model_name, latency_ms, answered)
+
+def record_usage(model_name: str, response: Any):
+    """Anota solo tokens y coste de una respuesta en la traza activa (intentos de un hedge)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.record_usage(model_name, response)
+
+def record_hedge():
+    """Cuenta un duplicado lanzado por el router en la traza activa"""
+    trace = _current.get()
+    if trace is not None:
+        trace.record_hedge()
+
+class RequestTraceMiddleware:
+    """
+    Middleware ASGI que abre una traza por petición en las rutas indicadas
+
+    La traza se cierra cuando la respuesta termina de enviarse, incluido el
+    cuerpo de las respuestas en streaming (SSE), y se guarda fuera del event loop.
+    """
+
+    def __init__(self, app, paths: Iterable[str]):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope["path"])
+        token = _current.set(trace)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start" and message["status"] >= 500:
+                trace.status = 'error'
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except BaseException:
+            trace.status = 'error'
+            raise
+        finally:
+            _current.reset(token)
+            trace.finish()
+            await asyncio.get_running_loop().run_in_executor(None, _persist, trace)
+
+def _persist(trace: RequestTrace):
+    if os.getenv('REQUEST_LEDGER_ENABLED', 'true').lower() != 'true':
+        return
+    try:
+        from database import SessionLocal, save_request_metrics
+        db = SessionLocal()
+        try:
+            save_request_metrics(db, trace)
+        finally:
+            db.close()
+    except Exception as e:
+        print(f"⚠️ No se pudieron guardar las métricas de la petición: {e}")
+
+def _distribution(values) -> Dict[str, Any]:
+    # Import diferido: model_router registra sus llamadas en este módulo
+    from processors.model_router import percentile
+    values = [value for value in values if value is not None]
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50), 1),
+        "p95_ms": round(percentile(values, 95), 1)
+    }
+
+def _summary(rows) -> Dict[str, Any]:
+    """Peticiones, latencia total, etapas y consumo de un grupo de filas"""
+    return {
+        "requests": len(rows),
+        "errors": sum(1 for row in rows if row.status == 'error'),
+        "total": _distribution(row.total_ms for row in rows),
+        "stages": {name: _distribution(getattr(row, f"{name}_ms") for row in rows) for name in STAGES},
+        "llm_calls": sum(row.llm_calls or 0 for row in rows),
+        "estimated_calls": sum(row.estimated_calls or 0 for row in rows),
+        "hedges": sum(row.hedges or 0 for row in rows),
+        "prompt_tokens": sum(row.prompt_tokens or 0 for row in rows),
+        "output_tokens": sum(row.output_tokens or 0 for row in rows),
+        "cost_usd": round(sum(row.cost_usd or 0.0 for row in rows), 6)
+    }
+
+def aggregate(rows: Iterable) -> Dict[str, Any]:
+    """
+    Agregados de request_metrics
+
+    Returns:
+        Dict con overall, per_endpoint y per_day (p50/p95 total y por etapa, tokens y coste)
+    """
+    rows = list(rows)
+    per_endpoint, per_day = defaultdict(list), defaultdict(list)
+    for row in rows:
+        per_endpoint[row.endpoint].append(row)
+        per_day[row.created_at.date().isoformat()].append(row)
+    return {
+        "overall": _summary(rows),
+        "per_endpoint": {endpoint: _summary(group) for endpoint, group in sorted(per_endpoint.items())},
+        "per_day": {day: _summary(group) for day, group in sorted(per_day.items())}
+    }
@@ -0,0 +1,211 @@
+"""
+Planificador de llamadas salientes a Gemini con prioridades y token buckets
+
+Todas las llamadas al modelo pasan por aquí. Dos token buckets aplican los
+presupuestos de peticiones por minuto (RPM) y tokens por minuto (TPM), y un
+límite de llamadas en vuelo sustituye al semáforo global. Las peticiones
+esperan en una cola de prioridad: las acciones del scaffolder (producción)
+se atienden antes que el tráfico de desarrollo (/api/analyze/*, /process-*).
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict
+
+# Menor valor = mayor prioridad
+PRIORITIES = {
+    'scaffolder': 0,
+    'dev': 1
+}
+
+class TokenBucket:
+    """Bucket que se rellena de forma continua hasta su capacidad por minuto"""
+
+    def __init__(self, per_minute: float):
+        """
+        Args:
+            per_minute: Capacidad y ritmo de recarga por minuto (0 = sin límite)
+        """
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def refill(self, now: float):
+        if self.unlimited:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def clamp(self, amount: float) -> float:
+        """Una petición nunca puede exigir más que la capacidad completa"""
+        return amount if self.unlimited else min(amount, self.capacity)
+
+    def seconds_until(self, amount: float) -> float:
+        if self.unlimited or self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        if not self.unlimited:
+            self.tokens -= amount
+
+    def adjust(self, amount: float):
+        """Corrige una reserva con el consumo real (puede quedar en negativo)"""
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+class LLMScheduler:
+    """Admisión de llamadas a Gemini por prioridad, RPM, TPM y concurrencia"""
+
+    def __init__(self, rpm: int = None, tpm: int = None, max_concurrency: int = None, window: int = None):
+        """
+        Inicializar planificador
+
+        Args:
+            rpm: Peticiones por minuto (default: GEMINI_RPM o 0 = sin límite)
+            tpm: Tokens por minuto (default: GEMINI_TPM o 0 = sin límite)
+            max_concurrency: Llamadas simultáneas (default: GEMINI_MAX_CONCURRENCY o 8)
+            window: Esperas recientes para p50/p95 por canal (default: SCHEDULER_STATS_WINDOW o 500)
+        """
+        self.rpm = TokenBucket(rpm if rpm is not None else int(os.getenv('GEMINI_RPM', '0')))
+        self.tpm = TokenBucket(tpm if tpm is not None else int(os.getenv('GEMINI_TPM', '0')))
+        self.max_concurrency = max_concurrency or int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))
+        window = window or int(os.getenv('SCHEDULER_STATS_WINDOW', '500'))
+
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+
+        self._stats_lock = threading.Lock()
+        self._waits = {channel: deque(maxlen=window) for channel in PRIORITIES}
+        self._stats = {channel: {"admitted": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0} for channel in PRIORITIES}
+        self._tokens = {"reserved": 0, "used": 0}
+
+    def acquire(self, channel: str = 'dev', tokens: int = 1) -> float:
+        """
+        Espera turno para una llamada al modelo
+
+        Args:
+            channel: 'scaffolder' o 'dev'
+            tokens: Tokens estimados (entrada + salida esperada) que se reservan del bucket TPM
+
+        Returns:
+            Tiempo de espera en cola (ms)
+        """
+        channel = channel if channel in PRIORITIES else 'dev'
+        tokens = self.tpm.clamp(tokens)
+        entry = (PRIORITIES[channel], next(self._sequence))
+        start = time.monotonic()
+
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    timeout = None
+                    if self._waiters[0] == entry and self._in_flight < self.max_concurrency:
+                        now = time.monotonic()
+                        self.rpm.refill(now)
+                        self.tpm.refill(now)
+                        timeout = max(self.rpm.seconds_until(1), self.tpm.seconds_until(tokens))
+                        if timeout <= 0:
+                            break
+                    self._cond.wait(timeout)
+            except BaseException:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+
+            heapq.heappop(self._waiters)
+            self.rpm.consume(1)
+            self.tpm.consume(tokens)
+            self._in_flight += 1
+            # El siguiente en la cola pasa a ser cabeza y debe reevaluar
+            self._cond.notify_all()
+
+        wait_ms = (time.monotonic() - start) * 1000
+        with self._stats_lock:
+            self._waits[channel].append(wait_ms)
+            stats = self._stats[channel]
+            stats["admitted"] += 1
+            stats["total_wait_ms"] += wait_ms
+            stats["max_wait_ms"] = max(stats["max_wait_ms"], wait_ms)
+            self._tokens["reserved"] += tokens
+        return wait_ms
+
+    def release(self, reserved_tokens: int = 0, used_tokens: int = None, cancelled: bool = False):
+        """
+        Libera el hueco de concurrencia y ajusta el bucket TPM con el consumo real
+
+        Args:
+            reserved_tokens: Tokens reservados en acquire()
+            used_tokens: Tokens reales (usage_metadata), o None si se desconocen
+            cancelled: La llamada no llegó a enviarse; se devuelven la petición y los tokens reservados
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if cancelled:
+                self.rpm.adjust(-1)
+                self.tpm.adjust(-self.tpm.clamp(reserved_tokens))
+                used_tokens = None
+            elif used_tokens is not None:
+                self.tpm.adjust(used_tokens - self.tpm.clamp(reserved_tokens))
+            self._cond.notify_all()
+        if used_tokens is not None:
+            with self._stats_lock:
+                self._tokens["used"] += used_tokens
+
+    def backlog(self) -> int:
+        """Llamadas esperando turno en la cola"""
+        with self._cond:
+            return len(self._waiters)
+
+    def stats(self) -> Dict[str, Any]:
+        """Esperas en cola por canal y estado de los buckets"""
+        from processors.model_router import percentile
+
+        with self._cond:
+            now = time.monotonic()
+            self.rpm.refill(now)
+            self.tpm.refill(now)
+            queued = {channel: 0 for channel in PRIORITIES}
+            for priority, _ in self._waiters:
+                for channel, value in PRIORITIES.items():
+                    if value == priority:
+                        queued[channel] += 1
+            buckets = {
+                "rpm": {"limit": self.rpm.capacity, "available": round(self.rpm.tokens, 1)},
+                "tpm": {"limit": self.tpm.capacity, "available": round(self.tpm.tokens, 1)}
+            }
+            in_flight = self._in_flight
+
+        with self._stats_lock:
+            channels = {}
+            for channel, stats in self._stats.items():
+                waits = list(self._waits[channel])
+                channels[channel] = {
+                    "admitted": stats["admitted"],
+                    "queued": queued[channel],
+                    "avg_wait_ms": round(stats["total_wait_ms"] / stats["admitted"], 1) if stats["admitted"] else 0.0,
+                    "p50_wait_ms": round(percentile(waits, 50), 1),
+                    "p95_wait_ms": round(percentile(waits, 95), 1),
+                    "max_wait_ms": round(stats["max_wait_ms"], 1)
+                }
+            tokens = dict(self._tokens)
+
+        return {
+            "queue_wait": channels,
+            "buckets": buckets,
+            "tokens": tokens,
+            "in_flight": in_flight,
+            "max_concurrency": self.max_concurrency
+        }
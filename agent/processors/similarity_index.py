@@ -0,0 +1,353 @@
+"""
+Índice de similitud sobre descripciones ya analizadas
+
+Muchas descripciones nuevas son paráfrasis de otras ya procesadas. El
+índice guarda vectores TF-IDF (unigramas y bigramas) del input_content de
+los análisis de texto de architecture_analyses, en arrays NumPy con
+formato CSR, y compara cada petición por similitud coseno. Por encima del
+umbral se devuelve la referencia al template existente (columna
+github_url) y se evitan el LLM, el generador y el push a git.
+
+Como salvaguarda, las dos descripciones deben nombrar los mismos servicios
+según la detección por palabras clave: "S3 con Lambda" y "S3 con RDS" se
+parecen mucho en TF-IDF pero no son la misma arquitectura. Si en la
+descripción no se detecta ningún servicio, no se reutiliza nada.
+
+El índice se reconstruye desde la base de datos al arrancar y se sincroniza
+periódicamente con las filas nuevas (otros workers). Opcionalmente se
+persiste en un .npz para no releer toda la tabla en cada arranque.
+"""
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from processors.cache import normalize_description
+from processors.local_analyzer import FILLER_WORDS
+
+_WORD_PATTERN = re.compile(r'[\wáéíóúñü]+')
+# Separador de servicios al persistir
+_SEPARATOR = '\x1f'
+
+def tokenize(text: str) -> Counter:
+    """Términos de una descripción: unigramas y bigramas sin palabras vacías"""
+    words = [word for word in _WORD_PATTERN.findall(normalize_description(text))
+             if word not in FILLER_WORDS and not word.isdigit()]
+    terms = Counter(words)
+    terms.update(f"{first} {second}" for first, second in zip(words, words[1:]))
+    return terms
+
+def template_id_from_ref(ref: str) -> str:
+    """ID del template a partir de la referencia guardada (ID o URL del template en el repositorio)"""
+    return ref.rstrip('/').rsplit('/', 1)[-1]
+
+class SimilarityIndex:
+    """Índice TF-IDF en memoria de los análisis de texto guardados"""
+
+    def __init__(self, services_of: Callable[[str], List[str]] = None, threshold: float = None,
+                 enabled: bool = None, path: str = None, sync_seconds: int = None, max_documents: int = None):
+        """
+        Inicializar índice
+
+        Args:
+            services_of: Detección de servicios por palabras clave; si se da, solo se reutilizan
+                         templates de descripciones con los mismos servicios (y ninguno si no detecta servicios)
+            threshold: Similitud coseno mínima para reutilizar (default: SIMILARITY_THRESHOLD o 0.75)
+            enabled: Activar la búsqueda (default: SIMILARITY_INDEX_ENABLED o true)
+            path: Fichero .npz de persistencia (default: SIMILARITY_INDEX_PATH; vacío = sin persistencia)
+            sync_seconds: Intervalo mínimo entre lecturas de filas nuevas (default: SIMILARITY_INDEX_SYNC_SECONDS o 60)
+            max_documents: Documentos conservados, los más recientes (default: SIMILARITY_INDEX_MAX_DOCUMENTS o 20000)
+        """
+        self.services_of = services_of
+        self.threshold = threshold if threshold is not None else float(os.getenv('SIMILARITY_THRESHOLD', '0.75'))
+        self.enabled = enabled if enabled is not None else os.getenv('SIMILARITY_INDEX_ENABLED', 'true').lower() == 'true'
+        self.path = path if path is not None else os.getenv('SIMILARITY_INDEX_PATH', '')
+        self.sync_seconds = sync_seconds if sync_seconds is not None else int(os.getenv('SIMILARITY_INDEX_SYNC_SECONDS', '60'))
+        self.max_documents = max_documents or int(os.getenv('SIMILARITY_INDEX_MAX_DOCUMENTS', '20000'))
+
+        # Documentos en orden de id (análisis, referencia del template, términos, servicios)
+        self._ids: List[int] = []
+        self._refs: List[str] = []
+        self._terms: List[Counter] = []
+        self._services: List[frozenset] = []
+        self._df = Counter()
+        self._known = set()
+        # Mayor id leído de la base de datos (las filas de otros workers pueden llegar desordenadas
+        # respecto a las añadidas por este proceso, por eso add() no lo mueve)
+        self._last_id = 0
+        self._last_sync = None
+        # Matriz CSR normalizada; se reconstruye al cambiar el corpus
+        self._matrix = None
+        self._dirty_persist = False
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._stats = {
+            "lookups": 0,
+            "hits": 0,
+            "below_threshold": 0,
+            "service_mismatch": 0,
+            "no_services": 0,
+            "sync_errors": 0
+        }
+
+        if self.enabled and self.path:
+            self._load()
+
+    def add(self, analysis_id: int, text: str, template_ref: str, analysis: Dict[str, Any] = None):
+        """
+        Añade un análisis recién guardado
+
+        Args:
+            analysis_id: id de la fila en architecture_analyses
+            text: input_content de la fila (descripción)
+            template_ref: Referencia del template (columna github_url)
+            analysis: Análisis guardado; los degradados no se indexan
+        """
+        if not self.enabled or not template_ref or (analysis or {}).get("degraded"):
+            return
+        terms = tokenize(text)
+        if not terms:
+            return
+        services = frozenset(self.services_of(text)) if self.services_of else frozenset()
+        with self._lock:
+            if analysis_id in self._known:
+                return
+            self._append(analysis_id, template_ref, terms, services)
+
+    def find(self, text: str) -> Optional[Dict[str, Any]]:
+        """
+        Busca un análisis anterior equivalente a la descripción
+
+        Returns:
+            Dict con analysis_id, template_ref, template_id, similarity y analysis
+            (el análisis guardado), o None si no hay ninguno por encima del umbral
+        """
+        if not self.enabled:
+            return None
+        self.sync()
+
+        terms = tokenize(text)
+        with self._lock:
+            self._stats["lookups"] += 1
+            if not terms or not self._ids:
+                self._stats["below_threshold"] += 1
+                return None
+            scores = self._scores(terms)
+            # Entre iguales, el más reciente
+            best = len(scores) - 1 - int(np.argmax(scores[::-1]))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                self._stats["below_threshold"] += 1
+                return None
+            analysis_id, template_ref, services = self._ids[best], self._refs[best], self._services[best]
+
+        if self.services_of:
+            requested = frozenset(self.services_of(text))
+            if not requested:
+                # Sin servicios detectados la salvaguarda no puede comparar nada
+                with self._lock:
+                    self._stats["no_services"] += 1
+                return None
+            if requested != services:
+                with self._lock:
+                    self._stats["service_mismatch"] += 1
+                return None
+
+        analysis = self._load_analysis(analysis_id)
+        if analysis is None:
+            return None
+        with self._lock:
+            self._stats["hits"] += 1
+        return {
+            "analysis_id": analysis_id,
+            "template_ref": template_ref,
+            "template_id": template_id_from_ref(template_ref),
+            "similarity": round(similarity, 4),
+            "analysis": analysis
+        }
+
+    def sync(self, force: bool = False):
+        """Incorpora las filas nuevas de architecture_analyses (como mucho cada sync_seconds)"""
+        if not self.enabled:
+            return
+        if not force and self._last_sync is not None and time.monotonic() - self._last_sync < self.sync_seconds:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            # Otra petición ya está sincronizando: se busca con lo que hay
+            return
+        try:
+            self._last_sync = time.monotonic()
+            from database import SessionLocal, get_analyses_after
+            db = SessionLocal()
+            try:
+                while True:
+                    rows = get_analyses_after(db, self._last_id, input_type='text')
+                    for row in rows:
+                        self._add_row(row)
+                    if len(rows) < 1000:
+                        break
+            finally:
+                db.close()
+            self.save()
+        except Exception as e:
+            with self._lock:
+                self._stats["sync_errors"] += 1
+            print(f"⚠️ Error sincronizando el índice de similitud: {e}")
+        finally:
+            self._sync_lock.release()
+
+    def save(self):
+        """Persiste el índice en SIMILARITY_INDEX_PATH (si está configurado y hay cambios)"""
+        if not self.path or not self._dirty_persist:
+            return
+        with self._lock:
+            vocabulary = {term: index for index, term in enumerate(self._df)}
+            indptr = np.zeros(len(self._terms) + 1, dtype=np.int64)
+            indices, counts = [], []
+            for position, terms in enumerate(self._terms):
+                indices.extend(vocabulary[term] for term in terms)
+                counts.extend(terms.values())
+                indptr[position + 1] = len(indices)
+            arrays = {
+                "ids": np.array(self._ids, dtype=np.int64),
+                "refs": np.array(self._refs, dtype=str),
+                "services": np.array([_SEPARATOR.join(sorted(services)) for services in self._services], dtype=str),
+                "vocabulary": np.array(list(vocabulary), dtype=str),
+                "indptr": indptr,
+                "indices": np.array(indices, dtype=np.int64),
+                "counts": np.array(counts, dtype=np.float32),
+                "last_id": np.array(self._last_id, dtype=np.int64)
+            }
+            self._dirty_persist = False
+
+        temporary = f"{self.path}.tmp"
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(temporary, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(temporary, self.path)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar el índice de similitud en {self.path}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Documentos indexados, búsquedas, aciertos y descartes"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["documents"] = len(self._ids)
+            stats["vocabulary"] = len(self._df)
+        stats["enabled"] = self.enabled
+        stats["threshold"] = self.threshold
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+        stats["persistent"] = bool(self.path)
+        return stats
+
+    def _add_row(self, row):
+        try:
+            analysis = json.loads(row.yaml_content)
+        except (TypeError, ValueError):
+            analysis = None
+        if isinstance(analysis, dict):
+            self.add(row.id, row.input_content, row.github_url, analysis)
+        with self._lock:
+            self._last_id = max(self._last_id, row.id)
+
+    def _append(self, analysis_id: int, template_ref: str, terms: Counter, services: frozenset):
+        self._ids.append(analysis_id)
+        self._known.add(analysis_id)
+        self._refs.append(template_ref)
+        self._terms.append(terms)
+        self._services.append(services)
+        self._df.update(terms.keys())
+        if len(self._ids) > self.max_documents:
+            self._evict(len(self._ids) - self.max_documents)
+        self._matrix = None
+        self._dirty_persist = True
+
+    def _evict(self, count: int):
+        """Descarta los documentos más antiguos"""
+        for terms in self._terms[:count]:
+            self._df.subtract(terms.keys())
+        self._df = +self._df
+        self._known.difference_update(self._ids[:count])
+        del self._ids[:count], self._refs[:count], self._terms[:count], self._services[:count]
+
+    def _idf(self, document_frequency: int) -> float:
+        return math.log((1 + len(self._ids)) / (1 + document_frequency)) + 1.0
+
+    def _build(self):
+        """Matriz TF-IDF normalizada en formato CSR (indptr, indices, data) y su vocabulario"""
+        vocabulary = {term: index for index, term in enumerate(self._df)}
+        idf = np.array([self._idf(self._df[term]) for term in vocabulary], dtype=np.float32)
+        indptr = np.zeros(len(self._terms) + 1, dtype=np.int64)
+        indices, data = [], []
+        for position, terms in enumerate(self._terms):
+            columns = np.fromiter((vocabulary[term] for term in terms), dtype=np.int64, count=len(terms))
+            weights = (1.0 + np.log(np.fromiter(terms.values(), dtype=np.float32, count=len(terms)))) * idf[columns]
+            indices.append(columns)
+            data.append(weights / np.linalg.norm(weights))
+            indptr[position + 1] = indptr[position] + len(terms)
+        self._matrix = (indptr, np.concatenate(indices), np.concatenate(data), vocabulary, idf)
+
+    def _scores(self, terms: Counter) -> np.ndarray:
+        """Similitud coseno de la consulta con cada documento"""
+        if self._matrix is None:
+            self._build()
+        indptr, indices, data, vocabulary, idf = self._matrix
+
+        query = np.zeros(len(vocabulary), dtype=np.float32)
+        norm = 0.0
+        for term, count in terms.items():
+            column = vocabulary.get(term)
+            # Los términos desconocidos no puntúan pero sí cuentan en la norma de la consulta
+            weight = (1.0 + math.log(count)) * (idf[column] if column is not None else self._idf(0))
+            norm += weight * weight
+            if column is not None:
+                query[column] = weight
+        query /= math.sqrt(norm)
+        return np.add.reduceat(data * query[indices], indptr[:-1])
+
+    def _load_analysis(self, analysis_id: int) -> Optional[Dict[str, Any]]:
+        try:
+            from database import SessionLocal, get_analysis
+            db = SessionLocal()
+            try:
+                row = get_analysis(db, analysis_id)
+                return json.loads(row.yaml_content) if row else None
+            finally:
+                db.close()
+        except Exception as e:
+            print(f"⚠️ No se pudo leer el análisis {analysis_id} del índice de similitud: {e}")
+            return None
+
+    def _load(self):
+        """Carga el índice persistido; las filas posteriores se leerán en la próxima sincronización"""
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with np.load(self.path) as arrays:
+                vocabulary = arrays["vocabulary"].tolist()
+                indptr, indices, counts = arrays["indptr"], arrays["indices"], arrays["counts"]
+                services = arrays["services"].tolist()
+                for position, (analysis_id, ref) in enumerate(zip(arrays["ids"].tolist(), arrays["refs"].tolist())):
+                    start, end = indptr[position], indptr[position + 1]
+                    terms = Counter({vocabulary[column]: int(count)
+                                     for column, count in zip(indices[start:end].tolist(), counts[start:end].tolist())})
+                    document_services = frozenset(services[position].split(_SEPARATOR)) if services[position] else frozenset()
+                    self._append(analysis_id, ref, terms, document_services)
+                self._last_id = int(arrays["last_id"])
+            self._dirty_persist = False
+            print(f"📚 Índice de similitud cargado: {len(self._ids)} descripciones")
+        except Exception as e:
+            print(f"⚠️ No se pudo cargar el índice de similitud de {self.path}, se reconstruye: {e}")
+            self._ids, self._refs, self._terms, self._services = [], [], [], []
+            self._df = Counter()
+            self._known = set()
+            self._last_id = 0
@@ -0,0 +1,110 @@
+"""
+Single-flight: coalescencia de análisis idénticos en vuelo
+
+Si llega una petición con la misma clave que otra que aún se está
+ejecutando, espera el resultado de la primera en lugar de repetir la
+llamada a Gemini. Los avisos anticipados del primer llamador (p. ej. los
+servicios predichos) se reparten también a los que esperan.
+"""
+import copy
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+class _Flight:
+    """Ejecución en vuelo: resultado y avisos anticipados"""
+
+    def __init__(self):
+        self.future = Future()
+        self.listeners: List[Callable[[Any], None]] = []
+        self.updates: List[Any] = []
+
+class SingleFlight:
+    """Agrupa llamadas concurrentes con la misma clave en una sola ejecución"""
+
+    def __init__(self, name: str = 'default'):
+        self.name = name
+        self._in_flight: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "executions": 0,
+            "coalesced": 0
+        }
+
+    def do(self, key: str, func: Callable, *args, listener: Optional[Callable[[Any], None]] = None, **kwargs) -> Any:
+        """
+        Ejecuta func una sola vez por clave mientras haya llamadas en vuelo
+
+        Args:
+            key: Clave de contenido (hash) que identifica peticiones idénticas
+            func: Función a ejecutar por el primer llamador
+            listener: Recibe cada aviso anticipado publicado con publish(key, ...),
+                      también los anteriores a la llegada de este llamador
+
+        Returns:
+            Resultado de func (copia independiente para cada llamador coalescido)
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                self._stats["coalesced"] += 1
+                leader = False
+            else:
+                flight = _Flight()
+                self._in_flight[key] = flight
+                self._stats["executions"] += 1
+                leader = True
+            if listener is not None:
+                flight.listeners.append(listener)
+            missed = list(flight.updates) if listener is not None else []
+
+        for update in missed:
+            self._notify(listener, update)
+
+        if not leader:
+            return copy.deepcopy(flight.future.result())
+
+        try:
+            result = func(*args, **kwargs)
+            flight.future.set_result(result)
+            return result
+        except Exception as e:
+            flight.future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def publish(self, key: str, update: Any):
+        """
+        Reparte un aviso anticipado de la ejecución en vuelo a todos sus llamadores
+
+        Args:
+            key: Clave pasada a do()
+            update: Valor del aviso (p. ej. lista de servicios predichos)
+        """
+        with self._lock:
+            flight = self._in_flight.get(key)
+            if flight is None:
+                return
+            flight.updates.append(update)
+            listeners = list(flight.listeners)
+        for listener in listeners:
+            self._notify(listener, update)
+
+    @staticmethod
+    def _notify(listener: Callable[[Any], None], update: Any):
+        try:
+            listener(update)
+        except Exception as e:
+            # El aviso de un llamador no puede romper la ejecución compartida
+            print(f"⚠️ Error en aviso anticipado de single-flight: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de llamadas ejecutadas y coalescidas"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._in_flight)
+        return stats
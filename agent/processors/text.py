@@ -1,48 +1,169 @@
 import google.generativeai as genai
 import os
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 from generators.backstage_generator import BackstageGenerator
 from validators.backstage_validator import BackstageValidator
+from processors.cache import AnalysisCache, build_cache_key, normalize_description
+from processors import llm, request_trace
+from processors.singleflight import SingleFlight
+from processors.batcher import TextBatcher
+from processors.model_router import ModelRouter
+from processors.prompt_compactor import PromptCompactor
+from processors.local_analyzer import LocalAnalyzer
+from processors.prompt_variants import PromptRegistry, PromptVariant
+from processors.analysis_schema import (
+    ANALYSIS_SCHEMA, BATCH_ANALYSIS_SCHEMA, json_generation_config, parse_analysis, parse_batch_analysis
+)
+
+# Versión del prompt de análisis; forma parte de la clave de caché
+PROMPT_VERSION = "text-v3"
+
+# Preámbulos estáticos (instrucciones y ejemplo JSON); la parte variable va detrás
+# para que el prefijo pueda servirse desde la caché de contexto del proveedor
+ANALYSIS_PROMPT_PREFIX = """
+            Analiza la descripción de arquitectura AWS que sigue a estas instrucciones y extrae:
+            
+            1. SERVICIOS AWS mencionados (nombres exactos como S3, Lambda, CloudFront, etc.)
+            2. TIPO DE SOLUCIÓN (web-app, data-pipeline, serverless, microservices, etc.)
+            3. TÍTULO descriptivo de la solución
+            4. DESCRIPCIÓN técnica mejorada
+            5. PARÁMETROS necesarios para el template
+            6. TAGS relevantes
+            
+            Responde en formato JSON:
+            {
+                "services": ["S3", "CloudFront", "Lambda", "RDS"],
+                "solution_type": "web-app",
+                "title": "AWS Web Application with CDN",
+                "description": "Aplicación web serverless con S3, CloudFront y Lambda para alta disponibilidad",
+                "component_type": "service",
+                "tags": ["aws", "serverless", "web", "cdn"],
+                "parameters": [
+                    {"name": "environment", "title": "Environment", "type": "string"},
+                    {"name": "region", "title": "AWS Region", "type": "string"},
+                    {"name": "domain_name", "title": "Domain Name", "type": "string"}
+                ]
+            }
+            """
+
+# Variante compacta: la estructura la impone el esquema JSON de la respuesta
+ANALYSIS_PROMPT_COMPACT_PREFIX = """
+            Extrae de la descripción de arquitectura AWS que sigue los servicios AWS mencionados
+            (nombres exactos como S3, Lambda, CloudFront), el tipo de solución, un título, una
+            descripción técnica mejorada, los parámetros del template y tags relevantes.
+            """
+
+BATCH_ANALYSIS_PROMPT_PREFIX = """
+            Analiza CADA una de las descripciones de arquitectura AWS que siguen a estas instrucciones y extrae para cada una:
+            
+            1. SERVICIOS AWS mencionados (nombres exactos como S3, Lambda, CloudFront, etc.)
+            2. TIPO DE SOLUCIÓN (web-app, data-pipeline, serverless, microservices, etc.)
+            3. TÍTULO descriptivo de la solución
+            4. DESCRIPCIÓN técnica mejorada
+            5. PARÁMETROS necesarios para el template
+            6. TAGS relevantes
+            
+            Responde con un array JSON con un objeto por descripción, usando el mismo "id":
+            [
+                {
+                    "id": "1",
+                    "services": ["S3", "CloudFront", "Lambda", "RDS"],
+                    "solution_type": "web-app",
+                    "title": "AWS Web Application with CDN",
+                    "description": "Aplicación web serverless con S3, CloudFront y Lambda para alta disponibilidad",
+                    "component_type": "service",
+                    "tags": ["aws", "serverless", "web", "cdn"],
+                    "parameters": [
+                        {"name": "environment", "title": "Environment", "type": "string"},
+                        {"name": "region", "title": "AWS Region", "type": "string"}
+                    ]
+                }
+            ]
+            """
 
 class TextProcessor:
     def __init__(self):
         # Cargar variables de entorno
         load_dotenv()
         
-        api_key = os.getenv('GEMINI_API_KEY')
-        if not api_key:
+        # GEMINI_API_KEYS (pool de keys) tiene prioridad sobre GEMINI_API_KEY
+        api_keys = [key.strip() for key in os.getenv('GEMINI_API_KEYS', '').split(',') if key.strip()]
+        api_key = os.getenv('GEMINI_API_KEY') or (api_keys[0] if api_keys else None)
+        # En modo replay las respuestas salen del cassette y no hace falta key
+        replaying = os.getenv('GEMINI_CASSETTE_MODE', 'off').lower() == 'replay'
+        if not api_key and not replaying:
             raise ValueError("GEMINI_API_KEY no encontrada en variables de entorno")
         
-        genai.configure(api_key=api_key)
-        # Usar modelo disponible
-        try:
-            self.model = genai.GenerativeModel('gemini-2.5-flash')
-        except:
-            try:
-                self.model = genai.GenerativeModel('gemini-flash-latest')
-            except:
-                try:
-                    self.model = genai.GenerativeModel('gemini-pro-latest')
-                except:
-                    raise ValueError("No se pudo inicializar ningún modelo de Gemini")
+        # Configuración global solo como respaldo: el router usa un cliente por key
+        if api_key:
+            genai.configure(api_key=api_key)
+        # Enrutado entre modelos Gemini por latencia (con hedging según política)
+        self.router = ModelRouter('text')
+        self.model_name = self.router.primary_model_name
+        
+        # Caché de análisis (memoria + base de datos)
+        self.cache = AnalysisCache(input_type='text')
+        # Coalescencia de análisis idénticos en vuelo
+        self.single_flight = SingleFlight('text')
+        
+        # Micro-batching opcional de descripciones en un solo prompt
+        self.batcher = None
+        if os.getenv('TEXT_BATCH_ENABLED', 'false').lower() == 'true':
+            self.batcher = TextBatcher(self._analyze_batch_with_model, self._analyze_with_model)
         
         # Inicializar generador y validador
         self.backstage_generator = BackstageGenerator()
         self.validator = BackstageValidator()
+        
+        # Compactación de descripciones largas (prioriza servicios AWS conocidos)
+        self.compactor = PromptCompactor(self.backstage_generator.aws_service_mappings.keys())
+        
+        # Ruta rápida local para descripciones que nombran sus servicios explícitamente
+        self.local_analyzer = None
+        if os.getenv('LOCAL_ANALYZER_ENABLED', 'true').lower() == 'true':
+            self.local_analyzer = LocalAnalyzer(self.backstage_generator.aws_service_mappings.keys())
+        
+        # Variantes de prompt con reparto de tráfico (PROMPT_VARIANTS_TEXT)
+        self.prompts = PromptRegistry('text', [
+            PromptVariant('default', 1, ANALYSIS_PROMPT_PREFIX),
+            PromptVariant('compact', 1, ANALYSIS_PROMPT_COMPACT_PREFIX)
+        ])
+        
+        # Contadores de la ruta que produjo cada análisis (local, cache, model, fallback)
+        self._path_counts = Counter()
+        self._path_lock = threading.Lock()
     
-    def process(self, text_description: str) -> dict:
+    def process(self, text_description: str, channel: str = 'dev',
+                on_services: Callable[[List[str]], None] = None) -> dict:
         """
         Procesa descripción de texto y devuelve análisis estructurado
         
         Args:
             text_description: Descripción del proyecto
+            channel: Origen de la petición ('scaffolder' o 'dev'), define la política de enrutado
+            on_services: Recibe los servicios en cuanto el modelo los emite (ver analyze_text_for_template)
             
         Returns:
             dict: Análisis estructurado con servicios AWS detectados
         """
+        # El canal forma parte de la clave: una acción del scaffolder no espera a una petición de desarrollo
+        key = f"{channel}:{self.get_cache_key(text_description)}"
+        return self.single_flight.do(
+            key, self._process, text_description, channel,
+            lambda services: self.single_flight.publish(key, services),
+            listener=on_services
+        )
+    
+    def _process(self, text_description: str, channel: str = 'dev',
+                 on_services: Callable[[List[str]], None] = None) -> dict:
+        """Pipeline de process() ejecutado una sola vez por descripción en vuelo"""
         try:
             # Usar el método existente de análisis
-            analysis = self.analyze_text_for_template(text_description)
+            analysis = self.analyze_text_for_template(text_description, channel, on_services)
             
             # Estructurar respuesta
             return {
@@ -51,7 +172,9 @@ class TextProcessor:
                 "services": analysis.get("services", []),
                 "architecture_type": analysis.get("architecture_type", "web-app"),
                 "components": analysis.get("components", []),
-                "type": "text_analysis"
+                "type": "text_analysis",
+                "analysis_path": analysis.get("analysis_path"),
+                "degraded": analysis.get("analysis_path") == "fallback"
             }
             
         except Exception as e:
@@ -62,67 +185,144 @@ class TextProcessor:
                 "architecture_type": "web-app",
                 "components": [],
                 "type": "text_analysis",
+                "degraded": True,
                 "error": str(e)
             }
     
-    def analyze_text_for_template(self, text_description: str) -> dict:
+    async def process_async(self, text_description: str, channel: str = 'dev',
+                            on_services: Callable[[List[str]], None] = None) -> dict:
+        """
+        Versión no bloqueante de process() para handlers async de FastAPI
+        
+        Args:
+            text_description: Descripción del proyecto
+            channel: Origen de la petición ('scaffolder' o 'dev')
+            on_services: Recibe los servicios en cuanto el modelo los emite
+            
+        Returns:
+            dict: Análisis estructurado con servicios AWS detectados
+        """
+        return await llm.run_for_channel(channel, self.process, text_description, channel, on_services)
+    
+    def analyze_text_for_template(self, text_description: str, channel: str = 'dev',
+                                  on_services: Callable[[List[str]], None] = None) -> dict:
         """
         Analiza descripción de texto AWS y extrae servicios para crear template
         
         Args:
             text_description: Descripción de la arquitectura AWS
+            channel: Origen de la petición ('scaffolder' o 'dev')
+            on_services: Recibe los servicios en cuanto el modelo los emite (streaming, sin batching)
             
         Returns:
             Dict con servicios AWS detectados y metadatos para template
         """
+        if self.local_analyzer:
+            local = self.local_analyzer.analyze(text_description)
+            if local is not None:
+                return self._record_path(local, "local")
+        
+        # La variante forma parte de la clave: cada prompt cachea sus propias respuestas
+        variant = self.prompts.choose()
+        cache_key = self.get_cache_key(text_description, variant)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return self._record_path(cached, "cache")
+        
+        # Circuito abierto en todos los modelos: respuesta degradada inmediata
+        if not self.router.available():
+            return self._record_path(self._generate_fallback_template(text_description), "fallback")
+        
+        # Reducir la descripción al presupuesto de tokens antes de llamar al modelo
+        prompt_description, _ = self.compactor.compact(text_description)
+        
+        # El lote usa un prompt propio: solo el tráfico de la variante de control se agrupa
+        if self.batcher and variant is self.prompts.control:
+            result = self.batcher.analyze(prompt_description, channel)
+        else:
+            result = self._analyze_with_model(prompt_description, channel, on_services, variant)
+        if result is not None:
+            result["prompt_variant"] = variant.key
+            # Solo se cachean respuestas reales del modelo, nunca el fallback;
+            # se guarda el modelo que respondió (hedge o fallback) si la traza lo conoce
+            trace = request_trace.current()
+            answered_by = (trace.model_name if trace is not None else None) or self.model_name
+            self.cache.set(cache_key, result, model_name=answered_by,
+                           prompt_version=f"{PROMPT_VERSION}/{variant.key}")
+            return self._record_path(result, "model")
+        
+        # Usar fallback si falla el análisis con IA
+        return self._record_path(self._generate_fallback_template(text_description), "fallback")
+    
+    def _record_path(self, analysis: dict, path: str) -> dict:
+        """Anota en el análisis qué ruta lo produjo y actualiza los contadores"""
+        with self._path_lock:
+            self._path_counts[path] += 1
+        analysis["analysis_path"] = path
+        return analysis
+    
+    def get_path_stats(self) -> dict:
+        """Número de análisis resueltos por cada ruta"""
+        with self._path_lock:
+            return dict(self._path_counts)
+    
+    def get_cache_key(self, text_description: str, variant: PromptVariant = None) -> str:
+        """Clave de caché para una descripción (normalizada + prompt y variante + modelos del router)"""
+        variant = variant or self.prompts.control
+        return build_cache_key(normalize_description(text_description), f"{PROMPT_VERSION}/{variant.key}", self.router.cache_scope)
+    
+    def invalidate_cache(self, text_description: str = None) -> int:
+        """Invalida la caché de una descripción concreta (en todas las variantes) o toda la caché de texto"""
+        if not text_description:
+            return self.cache.invalidate(None)
+        return sum(self.cache.invalidate(self.get_cache_key(text_description, variant))
+                   for variant in self.prompts.variants.values())
+    
+    def _analyze_with_model(self, text_description: str, channel: str = 'dev',
+                            on_services: Callable[[List[str]], None] = None,
+                            variant: PromptVariant = None) -> Optional[dict]:
+        """Llama a Gemini y devuelve el análisis, o None si la respuesta no es utilizable"""
+        variant = variant or self.prompts.control
+        start = time.perf_counter()
+        response, result = None, None
         try:
-            prompt = f"""
-            Analiza esta descripción de arquitectura AWS y extrae:
-            
-            1. SERVICIOS AWS mencionados (nombres exactos como S3, Lambda, CloudFront, etc.)
-            2. TIPO DE SOLUCIÓN (web-app, data-pipeline, serverless, microservices, etc.)
-            3. TÍTULO descriptivo de la solución
-            4. DESCRIPCIÓN técnica mejorada
-            5. PARÁMETROS necesarios para el template
-            6. TAGS relevantes
-            
-            Descripción: "{text_description}"
-            
-            Responde en formato JSON:
-            {{
-                "services": ["S3", "CloudFront", "Lambda", "RDS"],
-                "solution_type": "web-app",
-                "title": "AWS Web Application with CDN",
-                "description": "Aplicación web serverless con S3, CloudFront y Lambda para alta disponibilidad",
-                "component_type": "service",
-                "tags": ["aws", "serverless", "web", "cdn"],
-                "parameters": [
-                    {{"name": "environment", "title": "Environment", "type": "string"}},
-                    {{"name": "region", "title": "AWS Region", "type": "string"}},
-                    {{"name": "domain_name", "title": "Domain Name", "type": "string"}}
-                ]
-            }}
-            """
-            
-            response = self.model.generate_content(prompt)
-            
-            # Extraer JSON de la respuesta
-            import json
-            import re
+            response, _ = self.router.generate(
+                f'Descripción: "{text_description}"', channel=channel,
+                prefix=variant.prefix, on_services=on_services,
+                generation_config=json_generation_config(ANALYSIS_SCHEMA)
+            )
             
-            json_match = re.search(r'\{.*\}', response.text, re.DOTALL)
-            if json_match:
-                result = json.loads(json_match.group())
-                
-                # Validar que tenga servicios AWS
-                if result.get('services') and len(result['services']) > 0:
-                    return result
+            # Salida JSON restringida por esquema: decodificación directa y validación
+            result = parse_analysis(response.text)
             
         except Exception as e:
             print(f"Error analyzing text: {e}")
         
-        # Usar fallback si falla el análisis con IA
-        return self._generate_fallback_template(text_description)
+        self.prompts.record(variant, (time.perf_counter() - start) * 1000, response, result)
+        return result
+    
+    def _analyze_batch_with_model(self, items: List[Tuple[str, str]], channel: str = 'dev') -> Dict[str, dict]:
+        """
+        Analiza varias descripciones en una sola llamada a Gemini
+        
+        Args:
+            items: Lista de (id, descripción)
+            channel: Canal de mayor prioridad presente en el lote
+            
+        Returns:
+            Dict id -> análisis, solo para los elementos con respuesta válida
+        """
+        import json
+        
+        entries = json.dumps([{"id": item_id, "description": text} for item_id, text in items],
+                             ensure_ascii=False, indent=2)
+        response, _ = self.router.generate(
+            f"Descripciones:\n{entries}", channel=channel,
+            prefix=BATCH_ANALYSIS_PROMPT_PREFIX,
+            generation_config=json_generation_config(BATCH_ANALYSIS_SCHEMA)
+        )
+        
+        return parse_batch_analysis(response.text)
     
     def _generate_fallback_template(self, description: str) -> dict:
         """Genera template básico cuando falla el análisis"""
@@ -266,7 +466,8 @@ class TextProcessor:
             ```
             """
             
-            response = self.model.generate_content(prompt)
+            # Respuesta YAML: sin corte por JSON cerrado
+            response, _ = self.router.generate(prompt, stream=False)
             return response.text
             
         except Exception as e:
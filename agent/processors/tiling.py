@@ -0,0 +1,213 @@
+"""
+Análisis por teselas de diagramas de arquitectura muy grandes
+
+Los diagramas empresariales con decenas de servicios se reducen al enviarse
+completos y los iconos pequeños se pierden. En modo teselado la imagen se
+divide en teselas solapadas que se analizan en paralelo (pool acotado), y
+los análisis se fusionan en uno solo sin servicios duplicados.
+"""
+import math
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from processors import llm
+
+Box = Tuple[int, int, int, int]
+
+def tile_grid(size: Tuple[int, int], max_tiles: int) -> Tuple[int, int]:
+    """Columnas y filas que respetan la proporción de la imagen sin superar max_tiles"""
+    width, height = size
+    columns = max(1, min(max_tiles, round(math.sqrt(max_tiles * width / height))))
+    rows = max(1, max_tiles // columns)
+    return columns, rows
+
+def split_tiles(image: Image.Image, columns: int, rows: int, overlap: float) -> List[Tuple[Box, Image.Image]]:
+    """
+    Divide la imagen en teselas solapadas
+
+    Args:
+        image: Imagen completa
+        columns: Teselas por fila
+        rows: Teselas por columna
+        overlap: Fracción de la tesela que se solapa con sus vecinas (0..0.5)
+
+    Returns:
+        Lista de (caja (x0, y0, x1, y1), tesela)
+    """
+    width, height = image.size
+    tile_width = width / columns
+    tile_height = height / rows
+    pad_x = tile_width * overlap / 2
+    pad_y = tile_height * overlap / 2
+
+    tiles = []
+    for row in range(rows):
+        for column in range(columns):
+            box = (
+                max(0, int(column * tile_width - pad_x)),
+                max(0, int(row * tile_height - pad_y)),
+                min(width, int(math.ceil((column + 1) * tile_width + pad_x))),
+                min(height, int(math.ceil((row + 1) * tile_height + pad_y)))
+            )
+            tiles.append((box, image.crop(box)))
+    return tiles
+
+def merge_analyses(analyses: List[Dict[str, Any]], overview: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Fusiona los análisis de las teselas en un único análisis
+
+    Los servicios se deduplican sin distinguir mayúsculas, conservando el
+    orden de primera aparición. Título, descripción y tipo de solución salen
+    de la vista general si existe; si no, del tipo más votado y de la tesela
+    con más servicios.
+    """
+    sources = ([overview] if overview else []) + analyses
+
+    services: List[str] = []
+    seen = set()
+    for analysis in sources:
+        for service in analysis.get("services", []):
+            if service.lower() not in seen:
+                seen.add(service.lower())
+                services.append(service)
+
+    tags: List[str] = []
+    for analysis in sources:
+        for tag in analysis.get("tags", []):
+            if isinstance(tag, str) and tag not in tags:
+                tags.append(tag)
+
+    parameters: List[Dict[str, Any]] = []
+    parameter_names = set()
+    for analysis in sources:
+        for parameter in analysis.get("parameters", []):
+            if isinstance(parameter, dict) and parameter.get("name") not in parameter_names:
+                parameter_names.add(parameter.get("name"))
+                parameters.append(parameter)
+
+    components: List[Dict[str, Any]] = []
+    component_keys = set()
+    for analysis in sources:
+        for component in analysis.get("components", []):
+            key = (str(component.get("service", "")).lower(), str(component.get("name", "")).lower())
+            if key not in component_keys:
+                component_keys.add(key)
+                components.append(component)
+
+    richest = max(analyses, key=lambda analysis: len(analysis.get("services", []))) if analyses else overview
+    headline = overview or richest
+    votes = Counter(analysis.get("solution_type") for analysis in analyses if analysis.get("solution_type"))
+
+    return {
+        "services": services,
+        "solution_type": headline.get("solution_type") if overview else (votes.most_common(1)[0][0] if votes else "web-app"),
+        "title": headline.get("title", "AWS Architecture"),
+        "description": headline.get("description", ""),
+        "component_type": headline.get("component_type", "service"),
+        "tags": tags,
+        "parameters": parameters,
+        "architecture_description": headline.get("architecture_description", headline.get("description", "")),
+        "components": components
+    }
+
+class DiagramTiler:
+    """Analiza diagramas sobredimensionados por teselas en paralelo"""
+
+    def __init__(self, enabled: bool = None, min_edge: int = None, max_tiles: int = None,
+                 overlap: float = None, workers: int = None, overview: bool = None):
+        """
+        Inicializar teselado
+
+        Args:
+            enabled: Activar el modo teselado (default: VISION_TILING_ENABLED o false)
+            min_edge: Lado mayor a partir del cual se tesela (default: VISION_TILE_MIN_EDGE o 2048)
+            max_tiles: Número máximo de teselas (default: VISION_TILE_COUNT o 4)
+            overlap: Solape entre teselas vecinas, 0..0.5 (default: VISION_TILE_OVERLAP o 0.15)
+            workers: Teselas analizadas a la vez (default: VISION_TILE_WORKERS o 4)
+            overview: Analizar también la imagen completa reducida (default: VISION_TILE_OVERVIEW o true)
+        """
+        self.enabled = enabled if enabled is not None else os.getenv('VISION_TILING_ENABLED', 'false').lower() == 'true'
+        self.min_edge = min_edge or int(os.getenv('VISION_TILE_MIN_EDGE', '2048'))
+        self.max_tiles = max_tiles or int(os.getenv('VISION_TILE_COUNT', '4'))
+        self.overlap = min(0.5, max(0.0, overlap if overlap is not None else float(os.getenv('VISION_TILE_OVERLAP', '0.15'))))
+        self.overview = overview if overview is not None else os.getenv('VISION_TILE_OVERVIEW', 'true').lower() == 'true'
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or int(os.getenv('VISION_TILE_WORKERS', '4')),
+            thread_name_prefix="vision-tile"
+        )
+
+    def should_tile(self, size: Tuple[int, int]) -> bool:
+        """Indica si una imagen de este tamaño se analiza por teselas"""
+        return self.enabled and self.max_tiles > 1 and max(size) >= self.min_edge
+
+    def analyze(self, image: Image.Image, analyze_fn: Callable[[Image.Image, str], Optional[dict]]) -> Optional[dict]:
+        """
+        Analiza la imagen por teselas y fusiona los resultados
+
+        Args:
+            image: Imagen completa (sin reducir)
+            analyze_fn: Analiza (imagen, nota de contexto) y devuelve un análisis o None
+
+        Returns:
+            Análisis fusionado con metadatos de teselado, o None si ninguna tesela respondió
+        """
+        start = time.perf_counter()
+        columns, rows = tile_grid(image.size, self.max_tiles)
+        tiles = split_tiles(image, columns, rows, self.overlap)
+
+        def run(index: int, box: Optional[Box], tile: Image.Image, note: str):
+            tile_start = time.perf_counter()
+            try:
+                result = analyze_fn(tile, note)
+            except Exception as e:
+                print(f"Error analizando tesela {index}: {e}")
+                result = None
+            return index, box, result, (time.perf_counter() - tile_start) * 1000
+
+        futures = [
+            llm.submit(
+                self._executor, run, index, box, tile,
+                f"Este es el fragmento {index + 1} de {len(tiles)} (fila {index // columns + 1}, "
+                f"columna {index % columns + 1}) de un diagrama mayor. "
+                f"Lista solo los servicios AWS visibles en este fragmento."
+            )
+            for index, (box, tile) in enumerate(tiles)
+        ]
+        overview_future = llm.submit(
+            self._executor, run, -1, None, image, "Vista general reducida del diagrama completo."
+        ) if self.overview else None
+
+        tile_results = [future.result() for future in futures]
+        overview_result = overview_future.result() if overview_future else None
+
+        analyses = [result for _, _, result, _ in tile_results if result]
+        overview = overview_result[2] if overview_result else None
+        if not analyses and not overview:
+            return None
+
+        merged = merge_analyses(analyses, overview)
+        merged["tiling"] = {
+            "grid": f"{columns}x{rows}",
+            "tiles": len(tiles),
+            "overlap": self.overlap,
+            "successful_tiles": len(analyses),
+            "total_ms": round((time.perf_counter() - start) * 1000, 1),
+            "tile_timings": [
+                {
+                    "index": index,
+                    "box": list(box),
+                    "ms": round(elapsed_ms, 1),
+                    "services": len(result["services"]) if result else 0,
+                    "ok": result is not None
+                }
+                for index, box, result, elapsed_ms in tile_results
+            ]
+        }
+        if overview_result:
+            merged["tiling"]["overview_ms"] = round(overview_result[3], 1)
+        return merged
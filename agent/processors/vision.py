@@ -1,46 +1,28 @@
 import google.generativeai as genai
 from PIL import Image
 import os
+import time
+from typing import Callable, List, Optional
 from generators.backstage_generator import BackstageGenerator
 from validators.backstage_validator import BackstageValidator
+from processors.image_cache import DiagramCache, content_sha256
+from processors.image_normalizer import ImageNormalizer
+from processors.tiling import DiagramTiler
+from processors.icon_matcher import IconMatcher
+from processors.local_analyzer import LocalAnalyzer
+from processors.prompt_variants import PromptRegistry, PromptVariant
+from processors import llm
+from processors.singleflight import SingleFlight
+from processors.model_router import ModelRouter
+from processors.analysis_schema import VISION_ANALYSIS_SCHEMA, json_generation_config, parse_analysis
 
-class VisionProcessor:
-    def __init__(self):
-        genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-        # Usar modelo disponible para visión
-        try:
-            self.model = genai.GenerativeModel('gemini-2.5-flash')
-        except:
-            try:
-                self.model = genai.GenerativeModel('gemini-flash-latest')
-            except:
-                try:
-                    self.model = genai.GenerativeModel('gemini-pro-latest')
-                except:
-                    self.model = None
-        
-        # Inicializar generador y validador
-        self.backstage_generator = BackstageGenerator()
-        self.validator = BackstageValidator()
-    
-    def analyze_architecture_for_template(self, image_path: str) -> dict:
-        """
-        Analiza imagen de arquitectura AWS y extrae servicios para crear template
-        
-        Args:
-            image_path: Ruta a la imagen del diagrama
-            
-        Returns:
-            Dict con servicios AWS detectados y metadatos para template
-        """
-        if not self.model:
-            return self._generate_fallback_template()
-        
-        try:
-            image = Image.open(image_path)
-            
-            prompt = """
-            Analiza esta imagen de arquitectura AWS y extrae:
+# Versión del prompt de análisis; forma parte de la clave de caché
+PROMPT_VERSION = "vision-v4"
+
+# Preámbulo estático (instrucciones y ejemplo JSON); la imagen va detrás
+# para que el prefijo pueda servirse desde la caché de contexto del proveedor
+VISION_PROMPT_PREFIX = """
+            Analiza la imagen de arquitectura AWS que sigue a estas instrucciones y extrae en una sola respuesta:
             
             1. SERVICIOS AWS detectados (nombres exactos como S3, Lambda, CloudFront, etc.)
             2. TIPO DE SOLUCIÓN (web-app, data-pipeline, serverless, etc.)
@@ -48,6 +30,9 @@ class VisionProcessor:
             4. DESCRIPCIÓN técnica
             5. PARÁMETROS necesarios para el template
             6. TAGS relevantes
+            7. DESCRIPCIÓN DE LA ARQUITECTURA en texto plano: servicios, flujo de datos entre ellos y propósito general
+            8. COMPONENTES: una entidad por cada elemento del diagrama, con su servicio AWS,
+               una descripción de su función y los componentes con los que se conecta
             
             Responde en formato JSON:
             {
@@ -60,33 +45,192 @@ class VisionProcessor:
                 "parameters": [
                     {"name": "environment", "title": "Environment", "type": "string"},
                     {"name": "region", "title": "AWS Region", "type": "string"}
+                ],
+                "architecture_description": "Los usuarios acceden por CloudFront, que sirve el contenido estático desde S3 y enruta la API a Lambda, que persiste en RDS.",
+                "components": [
+                    {"name": "static-site", "service": "S3", "description": "Contenido estático del frontend", "connects_to": []},
+                    {"name": "cdn", "service": "CloudFront", "description": "Distribución del sitio y de la API", "connects_to": ["static-site", "api-handler"]}
                 ]
             }
             """
+
+# Variante compacta: la estructura la impone el esquema JSON de la respuesta
+VISION_PROMPT_COMPACT_PREFIX = """
+            Extrae de la imagen de arquitectura AWS que sigue los servicios AWS visibles (nombres
+            exactos como S3, Lambda, CloudFront), el tipo de solución, un título, una descripción
+            técnica, los parámetros del template, tags, una descripción en texto plano del flujo
+            entre servicios y un componente por cada elemento del diagrama con sus conexiones.
+            """
+
+class VisionProcessor:
+    def __init__(self):
+        genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+        # Enrutado entre modelos Gemini por latencia (con hedging según política)
+        self.router = ModelRouter('vision')
+        self.model_name = self.router.primary_model_name
+        
+        # Caché de diagramas por hash perceptual
+        self.diagram_cache = DiagramCache()
+        # Reducción y recodificación de la imagen antes de subirla
+        self.normalizer = ImageNormalizer()
+        # Análisis por teselas de diagramas sobredimensionados (opcional)
+        self.tiler = DiagramTiler()
+        # Coalescencia de análisis idénticos en vuelo
+        self.single_flight = SingleFlight('image')
+        
+        # Inicializar generador y validador
+        self.backstage_generator = BackstageGenerator()
+        self.validator = BackstageValidator()
+        
+        # Variantes de prompt con reparto de tráfico (PROMPT_VARIANTS_VISION)
+        self.prompts = PromptRegistry('vision', [
+            PromptVariant('default', 1, VISION_PROMPT_PREFIX),
+            PromptVariant('compact', 1, VISION_PROMPT_COMPACT_PREFIX)
+        ])
+        
+        # Detección local de servicios por sus iconos oficiales (sin LLM)
+        self.icon_matcher = IconMatcher()
+        self.local_analyzer = LocalAnalyzer(self.backstage_generator.aws_service_mappings.keys())
+    
+    def analyze_architecture_for_template(self, image_path: str, channel: str = 'dev',
+                                          on_services: Callable[[List[str]], None] = None) -> dict:
+        """
+        Analiza imagen de arquitectura AWS y extrae servicios para crear template
+        
+        Args:
+            image_path: Ruta a la imagen del diagrama
+            channel: Origen de la petición ('scaffolder' o 'dev'), define la política de enrutado
+            on_services: Recibe los servicios en cuanto se conocen: primero los iconos detectados
+                         localmente (si hay que consultar al modelo) y después los que emite
+                         el modelo (streaming, sin teselado)
             
-            response = self.model.generate_content([prompt, image])
-            
-            # Extraer JSON de la respuesta
-            import json
-            import re
-            
-            json_match = re.search(r'\{.*\}', response.text, re.DOTALL)
-            if json_match:
-                result = json.loads(json_match.group())
-                
-                # Validar que tenga servicios AWS
-                if result.get('services') and len(result['services']) > 0:
-                    return result
-            
+        Returns:
+            Dict con servicios AWS detectados y metadatos para template
+        """
+        # Sin modelos o con el circuito abierto en todos: respuesta degradada inmediata,
+        # salvo que los iconos puedan resolver el diagrama localmente
+        model_available = bool(self.model_name) and self.router.available()
+        if not model_available and not self.icon_matcher.available:
             return self._generate_fallback_template()
-            
+        
+        try:
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
         except Exception as e:
             print(f"Error analyzing image: {e}")
             return self._generate_fallback_template()
+        
+        # 1. Coincidencia exacta de bytes, antes de decodificar la imagen
+        # La variante forma parte de la clave: cada prompt cachea sus propias respuestas
+        variant = self.prompts.choose()
+        namespace = f"{PROMPT_VERSION}/{variant.key}:{self.router.cache_scope}"
+        sha256 = content_sha256(image_bytes)
+        cached = self.diagram_cache.get_exact(sha256, namespace)
+        if cached is not None:
+            return cached
+        
+        try:
+            # Los JPEG grandes se decodifican en modo draft, salvo si se van a teselar
+            image = self.normalizer.decode(image_bytes, full_resolution=self.tiler.should_tile)
+        except Exception as e:
+            print(f"Error analyzing image: {e}")
+            return self._generate_fallback_template()
+        
+        # 2. Diagramas casi duplicados (re-exportados, redimensionados, PNG→JPEG)
+        image_hash = self.diagram_cache.compute_hash(image)
+        cached = self.diagram_cache.get_similar(image_hash, namespace)
+        if cached is not None:
+            return cached
+        
+        # 3. Iconos oficiales AWS: con confianza alta se responde sin LLM
+        note = None
+        if self.icon_matcher.available:
+            detection = self.icon_matcher.detect(image)
+            if detection["confident"] or (detection["services"] and not model_available):
+                return self._analysis_from_icons(detection, degraded=not detection["confident"])
+            if detection["services"]:
+                note = ("Servicios detectados localmente por sus iconos (confírmalos y añade los que falten): "
+                        + ", ".join(detection["services"]))
+                if on_services:
+                    on_services(detection["services"])
+        if not model_available:
+            return self._generate_fallback_template()
+        
+        if self.tiler.should_tile(image.size):
+            result = self._analyze_tiled(image, len(image_bytes), channel, note, variant)
+        else:
+            image_part, _ = self.normalizer.normalize(image, len(image_bytes))
+            result = self._analyze_with_model(image_part, channel, note, on_services, variant)
+        if result is not None:
+            result["prompt_variant"] = variant.key
+            # Solo se cachean respuestas reales del modelo, nunca el fallback
+            self.diagram_cache.set(sha256, image_hash, namespace, result)
+            return result
+        
+        return self._generate_fallback_template()
+    
+    def _analyze_tiled(self, image: Image.Image, image_bytes: int, channel: str = 'dev',
+                       hints: str = None, variant: PromptVariant = None) -> Optional[dict]:
+        """Analiza un diagrama sobredimensionado por teselas solapadas y fusiona los servicios"""
+        pixels = image.width * image.height
+        
+        def analyze_tile(tile: Image.Image, note: str) -> Optional[dict]:
+            # Bytes de origen atribuidos a la tesela en proporción a su área
+            tile_bytes = image_bytes * tile.width * tile.height // pixels
+            tile_part, _ = self.normalizer.normalize(tile, tile_bytes)
+            return self._analyze_with_model(tile_part, channel, f"{hints}\n{note}" if hints else note,
+                                            variant=variant)
+        
+        return self.tiler.analyze(image, analyze_tile)
+    
+    def _analyze_with_model(self, image, channel: str = 'dev', note: str = None,
+                            on_services: Callable[[List[str]], None] = None,
+                            variant: PromptVariant = None) -> Optional[dict]:
+        """Llama a Gemini con la imagen y devuelve el análisis, o None si no es utilizable"""
+        variant = variant or self.prompts.control
+        start = time.perf_counter()
+        response, result = None, None
+        try:
+            # Prefijo estático cacheable; la nota y la imagen son la parte variable
+            response, _ = self.router.generate(
+                [note, image] if note else [image], channel=channel,
+                prefix=variant.prefix, on_services=on_services,
+                generation_config=json_generation_config(VISION_ANALYSIS_SCHEMA)
+            )
+            
+            # Salida JSON restringida por esquema: decodificación directa y validación
+            result = parse_analysis(response.text)
+            
+        except Exception as e:
+            print(f"Error analyzing image: {e}")
+        
+        self.prompts.record(variant, (time.perf_counter() - start) * 1000, response, result)
+        return result
+    
+    def _analysis_from_icons(self, detection: dict, degraded: bool = False) -> dict:
+        """Análisis completo construido a partir de los iconos detectados localmente"""
+        services = detection["services"]
+        description = f"Arquitectura AWS con {', '.join(services)}"
+        analysis = self.local_analyzer.build_analysis(services, description, detection["confidence"])
+        analysis["architecture_description"] = f"Diagrama con iconos de {', '.join(services)}."
+        analysis["components"] = [
+            {
+                "name": service.lower().replace(' ', '-'),
+                "service": service,
+                "description": f"Icono de {service} detectado en el diagrama",
+                "connects_to": []
+            }
+            for service in services
+        ]
+        analysis["analysis_path"] = "local"
+        analysis["icon_matching"] = detection
+        analysis["degraded"] = degraded
+        return analysis
     
     def _generate_fallback_template(self) -> dict:
         """Genera template básico cuando falla el análisis"""
         return {
+            "degraded": True,
             "services": ["S3", "Lambda", "CloudFront"],
             "solution_type": "web-app",
             "title": "AWS Web Application",
@@ -98,24 +242,29 @@ class VisionProcessor:
                 {"name": "region", "title": "AWS Region", "type": "string"}
             ]
         }
+    
+    def analyze_diagram(self, image_path: str, channel: str = 'dev') -> str:
         """
         Analiza diagrama de arquitectura y genera YAML Backstage válido
         
+        Una sola llamada multimodal devuelve el análisis y la descripción de la
+        arquitectura; el YAML se genera localmente a partir de ella.
+        
         Args:
             image_path: Ruta a la imagen del diagrama
+            channel: Origen de la petición ('scaffolder' o 'dev'), define la política de enrutado
             
         Returns:
             YAML válido para Backstage
         """
-        if not self.model:
+        analysis = self.analyze_architecture_for_template(image_path, channel)
+        if analysis.get("degraded"):
             # Usar generador estándar como fallback
             return self._generate_from_image_name(image_path)
         
         try:
-            image = Image.open(image_path)
-            
-            # 1. Extraer descripción de la imagen usando IA
-            description = self._extract_description_from_image(image)
+            # 1. Descripción extraída en la misma llamada que el análisis
+            description = self._description_from_analysis(analysis)
             
             # 2. Generar definiciones usando el generador estándar
             definitions = self.backstage_generator.generate_from_description(
@@ -147,26 +296,14 @@ class VisionProcessor:
             print(f"Error procesando imagen: {e}")
             return self._generate_from_image_name(image_path)
     
-    def _extract_description_from_image(self, image: Image) -> str:
-        """Extrae descripción textual de la imagen usando IA"""
-        try:
-            prompt = """
-            Analiza este diagrama de arquitectura AWS y describe en texto plano los servicios y conexiones que ves.
-            
-            Enfócate en:
-            1. Servicios AWS identificados (Lambda, S3, CloudFront, etc.)
-            2. Flujo de datos entre servicios
-            3. Propósito general de la arquitectura
-            
-            Responde solo con la descripción en texto, sin formato YAML.
-            """
-            
-            response = self.model.generate_content([prompt, image])
-            return response.text.strip()
-            
-        except Exception as e:
-            print(f"Error extrayendo descripción de imagen: {e}")
-            return "Arquitectura AWS con múltiples servicios interconectados"
+    def _description_from_analysis(self, analysis: dict) -> str:
+        """Descripción textual de la arquitectura a partir del análisis de una sola pasada"""
+        parts = [analysis.get("architecture_description") or analysis.get("description", "")]
+        for component in analysis.get("components", []):
+            parts.append(f"{component.get('service', '')} ({component.get('name', '')}): {component.get('description', '')}")
+        # Los servicios detectados garantizan que el generador crea todas las entidades
+        parts.append("Servicios AWS: " + ", ".join(analysis.get("services", [])))
+        return ". ".join(part.strip() for part in parts if part and part.strip())
     
     def _generate_from_image_name(self, image_path: str) -> str:
         """Genera YAML basado en el nombre de la imagen como fallback"""
@@ -182,68 +319,57 @@ class VisionProcessor:
         )
         
         return self.backstage_generator.to_yaml(definitions)
-        
-        return f"""apiVersion: backstage.io/v1alpha1
-kind: Component
-metadata:
-  name: diagram-architecture-{image_name}
-  description: Arquitectura generada desde diagrama de imagen
-  annotations:
-    aws.com/cost-center: free-tier-audit
-    backstage.io/source-image: {image_name}
-spec:
-  type: service
-  lifecycle: experimental
-  owner: platform-team
-  system: web-platform
----
-apiVersion: backstage.io/v1alpha1
-kind: Resource
-metadata:
-  name: cloud-storage-{image_name}
-  description: Almacenamiento en la nube
-  annotations:
-    aws.com/cost-center: free-tier-audit
-spec:
-  type: storage
-  owner: platform-team
-  system: web-platform
----
-apiVersion: backstage.io/v1alpha1
-kind: Component
-metadata:
-  name: api-service-{image_name}
-  description: Servicio API de la arquitectura
-  annotations:
-    aws.com/cost-center: free-tier-audit
-spec:
-  type: service
-  lifecycle: experimental
-  owner: platform-team
-  system: web-platform"""
-    def process_image(self, image_path: str) -> dict:
+    
+    def process_image(self, image_path: str, channel: str = 'dev',
+                      on_services: Callable[[List[str]], None] = None) -> dict:
         """
         Procesa imagen de arquitectura y devuelve análisis estructurado
         
         Args:
             image_path: Ruta a la imagen
+            channel: Origen de la petición ('scaffolder' o 'dev'), define la política de enrutado
+            on_services: Recibe los servicios predichos antes del análisis final (ver analyze_architecture_for_template)
             
         Returns:
             dict: Análisis estructurado con servicios AWS detectados
         """
+        try:
+            with open(image_path, 'rb') as f:
+                # El canal forma parte de la clave: una acción del scaffolder no espera a una petición de desarrollo
+                key = f"{channel}:{content_sha256(f.read())}"
+        except Exception:
+            # Sin contenido legible no hay nada que coalescer
+            return self._process_image(image_path, channel, on_services)
+        
+        return self.single_flight.do(
+            key, self._process_image, image_path, channel,
+            lambda services: self.single_flight.publish(key, services),
+            listener=on_services
+        )
+    
+    def _process_image(self, image_path: str, channel: str = 'dev',
+                       on_services: Callable[[List[str]], None] = None) -> dict:
+        """Pipeline de process_image() ejecutado una sola vez por imagen en vuelo"""
         try:
             # Usar el método existente de análisis
-            analysis = self.analyze_architecture_for_template(image_path)
+            analysis = self.analyze_architecture_for_template(image_path, channel, on_services)
             
             # Estructurar respuesta
-            return {
+            result = {
                 "title": analysis.get("title", "AWS Application"),
                 "description": analysis.get("description", "Aplicación AWS generada desde imagen"),
                 "services": analysis.get("services", []),
                 "architecture_type": analysis.get("architecture_type", "web-app"),
                 "components": analysis.get("components", []),
-                "type": "image_analysis"
+                "architecture_description": analysis.get("architecture_description", ""),
+                "type": "image_analysis",
+                "degraded": analysis.get("degraded", False)
             }
+            if "tiling" in analysis:
+                result["tiling"] = analysis["tiling"]
+            if "icon_matching" in analysis:
+                result["icon_matching"] = analysis["icon_matching"]
+            return result
             
         except Exception as e:
             return {
@@ -253,5 +379,21 @@ spec:
                 "architecture_type": "web-app",
                 "components": [],
                 "type": "image_analysis",
+                "degraded": True,
                 "error": str(e)
             }
+    
+    async def process_image_async(self, image_path: str, channel: str = 'dev',
+                                  on_services: Callable[[List[str]], None] = None) -> dict:
+        """
+        Versión no bloqueante de process_image() para handlers async de FastAPI
+        
+        Args:
+            image_path: Ruta a la imagen
+            channel: Origen de la petición ('scaffolder' o 'dev')
+            on_services: Recibe los servicios predichos antes del análisis final
+            
+        Returns:
+            dict: Análisis estructurado con servicios AWS detectados
+        """
+        return await llm.run_for_channel(channel, self.process_image, image_path, channel, on_services)
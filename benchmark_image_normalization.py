@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la normalización de imágenes antes de la subida a Gemini
+
+Mide bytes antes/después, tokens de imagen estimados y tiempo de
+normalización. Con --e2e mide además la latencia extremo a extremo del
+análisis con y sin normalización (requiere GEMINI_API_KEY, o un cassette
+grabado con GEMINI_CASSETTE_MODE=replay para una medida sin red).
+
+Uso:
+    python benchmark_image_normalization.py [imagenes...] [--e2e] [--runs N]
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), 'agent'))
+
+from processors.image_normalizer import ImageNormalizer, estimate_image_tokens
+
+DEFAULT_IMAGES = glob.glob(os.path.join(os.path.dirname(__file__), 'examples', 'diagrams', '*')) + \
+    [os.path.join(os.path.dirname(__file__), 'test-image.png')]
+
+def benchmark_normalization(paths, runs):
+    """Bytes, tokens y tiempo de normalización por imagen"""
+    print("🧪 Normalización de imágenes")
+    print("-" * 90)
+    print(f"{'imagen':<40} {'bytes in':>10} {'bytes out':>10} {'ratio':>7} {'tokens':>13} {'formato':>13} {'ms':>7}")
+
+    normalizer = ImageNormalizer(enabled=True)
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            image = normalizer.decode(data)
+            _, info = normalizer.normalize(image, len(data))
+            timings.append((time.perf_counter() - start) * 1000)
+
+        tokens = f"{estimate_image_tokens(tuple(info['size_in']))}→{estimate_image_tokens(tuple(info['size_out']))}"
+        print(f"{os.path.basename(path)[:40]:<40} {info['bytes_in']:>10} {info['bytes_out']:>10} "
+              f"{info['bytes_out'] / info['bytes_in']:>7.2f} {tokens:>13} {info['format']:>13} "
+              f"{statistics.median(timings):>7.1f}")
+
+    stats = normalizer.stats()
+    print("-" * 90)
+    print(f"📊 Total: {stats['bytes_in']} → {stats['bytes_out']} bytes "
+          f"(ratio {stats['compression_ratio']}), tokens de imagen {stats['image_tokens_in']} → {stats['image_tokens_out']}")
+    return True
+
+def benchmark_end_to_end(paths, runs):
+    """Latencia del análisis con Gemini con y sin normalización"""
+    from processors.vision import VisionProcessor
+
+    print("\n🧪 Latencia extremo a extremo (análisis de imagen)")
+    print("-" * 90)
+    vision = VisionProcessor()
+
+    results = {}
+    for enabled in (False, True):
+        vision.normalizer.enabled = enabled
+        latencies = []
+        for path in paths:
+            for _ in range(runs):
+                # Sin caché: cada ejecución llega al modelo
+                vision.diagram_cache.invalidate()
+                start = time.perf_counter()
+                vision.analyze_architecture_for_template(path)
+                latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        results[enabled] = latencies
+        label = "normalizada" if enabled else "original"
+        print(f"{label:<12} p50 {statistics.median(latencies):>9.1f} ms   "
+              f"p95 {latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]:>9.1f} ms   "
+              f"({len(latencies)} llamadas)")
+
+    speedup = statistics.median(results[False]) / max(statistics.median(results[True]), 0.001)
+    print(f"📊 Mejora de la mediana: x{speedup:.2f}")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de normalización de imágenes")
+    parser.add_argument('images', nargs='*', help="Imágenes a medir (default: examples/diagrams y test-image.png)")
+    parser.add_argument('--runs', type=int, default=3, help="Repeticiones por imagen")
+    parser.add_argument('--e2e', action='store_true', help="Medir también la latencia del análisis con Gemini")
+    args = parser.parse_args()
+
+    paths = [path for path in (args.images or DEFAULT_IMAGES) if os.path.isfile(path)]
+    if not paths:
+        print("❌ No se encontraron imágenes")
+        return 1
+
+    try:
+        benchmark_normalization(paths, args.runs)
+        if args.e2e:
+            benchmark_end_to_end(paths, args.runs)
+    except Exception as e:
+        print(f"❌ Error en el benchmark: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
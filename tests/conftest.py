@@ -0,0 +1,11 @@
+"""
+Configuración común de las pruebas unitarias
+
+Los módulos del agente se importan desde agent/ (igual que en main.py).
+"""
+import os
+import sys
+
+AGENT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'agent')
+if AGENT_DIR not in sys.path:
+    sys.path.insert(0, AGENT_DIR)
@@ -0,0 +1,70 @@
+"""
+Pruebas de las transiciones de estado del circuit breaker
+"""
+import time
+
+from processors.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+def make_breaker(**overrides):
+    options = dict(failure_rate_threshold=0.5, slow_call_ms=1000, window=4, min_calls=4,
+                   open_seconds=0.05, half_open_probes=1)
+    options.update(overrides)
+    return CircuitBreaker('modelo/key', **options)
+
+def open_breaker(breaker):
+    for _ in range(breaker.min_calls):
+        breaker.record_failure()
+
+def wait_half_open(breaker):
+    time.sleep(breaker.open_seconds + 0.01)
+    assert breaker.state == HALF_OPEN
+
+def test_stays_closed_until_min_calls():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+def test_opens_at_failure_rate_and_rejects():
+    breaker = make_breaker()
+    breaker.record_success(10)
+    breaker.record_success(10)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    assert breaker.snapshot()["rejected"] == 1
+
+def test_slow_calls_count_as_failures():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_success(5000)
+    assert breaker.state == OPEN
+
+def test_half_open_allows_limited_probes():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    wait_half_open(breaker)
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+def test_successful_probe_closes():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    wait_half_open(breaker)
+    assert breaker.allow_request()
+    breaker.record_success(10)
+    assert breaker.state == CLOSED
+    # La ventana se vacía: hacen falta min_calls nuevas para volver a abrir
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+def test_failed_probe_reopens():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    wait_half_open(breaker)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.snapshot()["opened"] == 2
@@ -0,0 +1,95 @@
+"""
+Pruebas del ciclo de vida de la caché de contexto en modo local
+"""
+import pytest
+
+from processors import context_cache
+from processors.context_cache import ContextCache
+from processors.llm import estimate_tokens
+
+PREFIX = "Eres un arquitecto AWS. Devuelve solo JSON con los servicios detectados. " * 20
+
+class Clock:
+    """Sustituye time.time() en el módulo para avanzar el reloj a mano"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(context_cache.time, 'time', clock)
+    return clock
+
+def make_cache(**options):
+    settings = dict(mode='local', ttl_seconds=60, refresh_seconds=10, min_tokens=100, retry_seconds=30)
+    settings.update(options)
+    return ContextCache(**settings)
+
+def test_default_mode_is_off(monkeypatch):
+    monkeypatch.delenv('PROMPT_CACHE_MODE', raising=False)
+    cache = ContextCache()
+    assert not cache.enabled
+    assert cache.lookup('modelo', PREFIX) is None
+
+def test_lookup_creates_once_and_then_hits(clock):
+    cache = make_cache()
+    first = cache.lookup('modelo', PREFIX)
+    second = cache.lookup('modelo', PREFIX)
+    assert first is second
+    assert first.name.startswith('local/')
+    assert first.tokens == estimate_tokens(PREFIX)
+    assert first.expires_at == clock.now + 60
+    stats = cache.stats()
+    assert stats["created"] == 1 and stats["hits"] == 1 and stats["entries"] == 1
+    assert stats["cached_prefix_tokens"] == first.tokens
+
+def test_entries_are_per_model_and_prefix(clock):
+    cache = make_cache()
+    entry = cache.lookup('modelo', PREFIX)
+    assert cache.lookup('otro-modelo', PREFIX) is not entry
+    assert cache.lookup('modelo', PREFIX + " Variante.") is not entry
+    assert cache.stats()["created"] == 3
+
+def test_local_entries_have_no_provider_model(clock):
+    entry = make_cache().lookup('modelo', PREFIX)
+    assert entry.content is None
+    assert entry.model_for(object()) is None
+
+def test_short_prefix_is_sent_inline_until_retry(clock):
+    cache = make_cache(min_tokens=10_000)
+    assert cache.lookup('modelo', PREFIX) is None
+    assert cache.lookup('modelo', PREFIX) is None
+    stats = cache.stats()
+    assert stats["inline"] == 2 and stats["created"] == 0 and stats["failures"] == 0
+
+def test_refreshes_ttl_when_close_to_expiry(clock):
+    cache = make_cache()
+    entry = cache.lookup('modelo', PREFIX)
+    clock.now += 55
+    assert cache.lookup('modelo', PREFIX) is entry
+    assert entry.expires_at == clock.now + 60
+    assert cache.stats()["refreshed"] == 1
+
+def test_expired_entry_is_recreated(clock):
+    cache = make_cache()
+    entry = cache.lookup('modelo', PREFIX)
+    clock.now += 61
+    renewed = cache.lookup('modelo', PREFIX)
+    assert renewed is not entry
+    stats = cache.stats()
+    assert stats["expired"] == 1 and stats["created"] == 2 and stats["entries"] == 1
+
+def test_invalidate_drops_only_the_named_entry(clock):
+    cache = make_cache()
+    entry = cache.lookup('modelo', PREFIX)
+    other = cache.lookup('otro-modelo', PREFIX)
+    cache.invalidate('modelo', 'local/desconocida')
+    assert cache.stats()["entries"] == 2
+    cache.invalidate('modelo', entry.name)
+    assert cache.stats()["entries"] == 1 and cache.stats()["expired"] == 1
+    assert cache.lookup('otro-modelo', PREFIX) is other
+    assert cache.lookup('modelo', PREFIX) is not entry
@@ -0,0 +1,25 @@
+"""
+Pruebas del runner de evaluación offline
+"""
+import sys
+from types import SimpleNamespace
+
+from evaluation.runner import EvaluationRunner, score_services
+
+def test_score_services_compares_canonical_names():
+    assert score_services(['Amazon S3', 'AWS Lambda'], ['s3', 'Lambda', 'RDS']) == (2, 1, 0)
+
+def test_runner_never_touches_the_persistent_cache(monkeypatch):
+    monkeypatch.setenv('GEMINI_API_KEY', 'clave-de-prueba')
+    # Cualquier acceso a la tabla analysis_cache quedaría registrado aquí
+    accessed = []
+    fake_database = SimpleNamespace(
+        SessionLocal=lambda: accessed.append('session') or SimpleNamespace(close=lambda: None),
+        delete_cached_analyses=lambda *args, **kwargs: accessed.append('delete') or 0
+    )
+    monkeypatch.setitem(sys.modules, 'database', fake_database)
+
+    runner = EvaluationRunner({"text": [], "images": []})
+    assert runner.text.cache.persistent is False
+    runner.text.cache.invalidate()
+    assert accessed == []
@@ -0,0 +1,102 @@
+"""
+Pruebas de la detección local de servicios por iconos
+
+El set oficial de AWS no se puede redistribuir, así que las pruebas generan
+iconos sintéticos (mosaicos con un patrón propio por servicio) y los pegan en
+un lienzo con el aspecto de un diagrama.
+"""
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from processors.icon_matcher import IconMatcher, icon_service_name
+
+ICON_FILES = {
+    'Arch_Amazon-Simple-Storage-Service_48.png': 1,
+    'Arch_AWS-Lambda_48.png': 2,
+    'dynamodb.png': 3,
+}
+
+def make_icon(seed: int, size: int = 48) -> Image.Image:
+    """Icono de 6x6 bloques de color con marco, distinto para cada semilla"""
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 220, size=(6, 6, 3), dtype=np.uint8)
+    pixels = np.kron(blocks, np.ones((8, 8, 1), dtype=np.uint8))
+    pixels[:2, :], pixels[-2:, :], pixels[:, :2], pixels[:, -2:] = 30, 30, 30, 30
+    icon = Image.fromarray(pixels, 'RGB')
+    return icon if size == 48 else icon.resize((size, size), Image.LANCZOS)
+
+def make_diagram(placements) -> Image.Image:
+    """Lienzo blanco con cajas, flechas y los iconos en las posiciones indicadas"""
+    canvas = Image.new('RGB', (640, 480), 'white')
+    draw = ImageDraw.Draw(canvas)
+    draw.rectangle((20, 20, 620, 460), outline='gray', width=2)
+    draw.line((150, 240, 420, 240), fill='black', width=3)
+    draw.text((60, 400), "Usuarios -> API -> almacenamiento", fill='black')
+    for seed, size, position in placements:
+        canvas.paste(make_icon(seed, size), position)
+    return canvas
+
+@pytest.fixture
+def icon_dir(tmp_path):
+    for filename, seed in ICON_FILES.items():
+        make_icon(seed).save(tmp_path / filename)
+    (tmp_path / 'README.md').write_text("no es un icono")
+    return str(tmp_path)
+
+@pytest.fixture
+def matcher(icon_dir):
+    return IconMatcher(icon_dir=icon_dir, enabled=True, max_edge=640, threshold=0.75,
+                       confident=0.85, min_services=2)
+
+@pytest.mark.parametrize("filename, service", [
+    ('Arch_Amazon-Simple-Storage-Service_48.png', 'S3'),
+    ('Arch_AWS-Lambda_48.png', 'Lambda'),
+    ('Res_Amazon-Route-53_Dark_32.png', 'Route 53'),
+    ('arch_amazon_api_gateway_64.png', 'API Gateway'),
+    ('Arch_Elastic-Load-Balancing_48_Light.png', 'ELB'),
+    ('s3.png', 'S3'),
+    ('lambda.png', 'Lambda'),
+    ('dynamodb.png', 'DynamoDB'),
+    ('icons/cloudfront.webp', 'CloudFront'),
+    ('desconocido.png', 'DESCONOCIDO'),
+])
+def test_icon_service_name(filename, service):
+    assert icon_service_name(filename) == service
+
+def test_loads_library_by_service(matcher):
+    assert matcher.available
+    assert sorted(matcher.icons) == ['DynamoDB', 'Lambda', 'S3']
+    assert matcher.stats()["icons"] == 3
+
+def test_missing_library_disables_matching(tmp_path):
+    matcher = IconMatcher(icon_dir=str(tmp_path / 'no-existe'), enabled=True)
+    assert not matcher.available
+    assert matcher.stats()["available"] is False
+
+def test_detects_pasted_icons_confidently(matcher):
+    diagram = make_diagram([(1, 40, (100, 100)), (2, 40, (420, 220))])
+    result = matcher.detect(diagram)
+    assert sorted(result["services"]) == ['Lambda', 'S3']
+    assert all(score >= 0.85 for score in result["scores"].values())
+    assert result["confidence"] == min(result["scores"].values())
+    assert result["confident"] is True
+    assert matcher.stats()["confident"] == 1
+
+def test_detects_icons_at_other_scales(matcher):
+    diagram = make_diagram([(1, 26, (80, 300)), (3, 46, (500, 80))])
+    result = matcher.detect(diagram)
+    assert sorted(result["services"]) == ['DynamoDB', 'S3']
+    assert 'Lambda' not in result["scores"]
+
+def test_single_icon_is_only_a_hint(matcher):
+    result = matcher.detect(make_diagram([(2, 40, (300, 150))]))
+    assert result["services"] == ['Lambda']
+    assert result["confident"] is False
+
+def test_diagram_without_icons(matcher):
+    result = matcher.detect(make_diagram([]))
+    assert result["services"] == [] and result["scores"] == {}
+    assert result["confidence"] == 0.0 and result["confident"] is False
+    stats = matcher.stats()
+    assert stats["images"] == 1 and stats["confident"] == 0
@@ -0,0 +1,99 @@
+"""
+Pruebas del consumo en streaming de respuestas JSON
+"""
+from types import SimpleNamespace
+
+from processors.json_stream import (
+    IncrementalJSONScanner, consume_json_stream, estimate_usage, needs_usage_estimate
+)
+
+class FakeStream:
+    """Stream de generate_content con cancelación observable"""
+
+    def __init__(self, texts, usage=None):
+        self.chunks = [SimpleNamespace(text=text, usage_metadata=None) for text in texts]
+        if usage is not None:
+            self.chunks[-1].usage_metadata = usage
+        self._done = False
+        self.cancelled = False
+        self.read = 0
+        self._iterator = SimpleNamespace(cancel=self._cancel)
+
+    def _cancel(self):
+        self.cancelled = True
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+        self._done = True
+
+def usage(prompt, output):
+    return SimpleNamespace(prompt_token_count=prompt, candidates_token_count=output,
+                           total_token_count=prompt + output)
+
+def test_scanner_ignores_braces_inside_strings():
+    scanner = IncrementalJSONScanner()
+    assert not scanner.feed('{"title": "usa { y [ en el texto')
+    assert scanner.feed('", "n": 1}')
+    assert scanner.document == '{"title": "usa { y [ en el texto", "n": 1}'
+
+def test_scanner_skips_leading_prose():
+    scanner = IncrementalJSONScanner()
+    assert scanner.feed('Aquí está: {"a": [1, 2]} y algo más')
+    assert scanner.document == '{"a": [1, 2]}'
+
+def test_stops_and_cancels_once_object_closes():
+    stream = FakeStream(['{"services": ["S3"', ', "Lambda"], "a": 1}', ' texto final', ' más texto'])
+    response = consume_json_stream(stream)
+    assert response.text == '{"services": ["S3", "Lambda"], "a": 1}'
+    assert response.truncated
+    assert stream.cancelled
+    assert stream.read == 2
+    assert response.chunks == 2
+
+def test_services_surface_before_object_closes():
+    received = []
+    stream = FakeStream(['{"services": ["S3", "Lambda"],', ' "title": "x"}'])
+    consume_json_stream(stream, on_services=lambda services: received.append((services, stream.read)))
+    assert received == [(["S3", "Lambda"], 1)]
+
+def test_complete_stream_keeps_reported_usage():
+    stream = FakeStream(['{"a": 1}'], usage=usage(100, 20))
+    stream._done = True
+    response = consume_json_stream(stream)
+    assert not response.truncated
+    assert not needs_usage_estimate(response)
+
+def test_cancelled_stream_needs_estimate():
+    stream = FakeStream(['{"a": 1}', ' resto'], usage=usage(100, 20))
+    response = consume_json_stream(stream)
+    assert response.truncated
+    assert response.usage_metadata is None
+    assert needs_usage_estimate(response)
+
+def test_estimate_uses_count_tokens_and_reserved_output():
+    response = consume_json_stream(FakeStream(['{"a": 1}', ' resto']))
+    estimate_usage(response, lambda: 321, reserved_prompt_tokens=50, reserved_output_tokens=512)
+    assert response.usage_estimated
+    assert response.usage_metadata.prompt_token_count == 321
+    assert response.usage_metadata.candidates_token_count == 512
+    assert response.usage_metadata.total_token_count == 833
+    assert not needs_usage_estimate(response)
+
+def test_estimate_keeps_reported_prompt_tokens():
+    stream = FakeStream(['{"a": 1}', ' resto'])
+    stream.chunks[0].usage_metadata = SimpleNamespace(prompt_token_count=150, candidates_token_count=None)
+    response = consume_json_stream(stream)
+    estimate_usage(response, lambda: 999, reserved_prompt_tokens=50, reserved_output_tokens=10)
+    assert response.usage_metadata.prompt_token_count == 150
+
+def test_estimate_falls_back_to_reservation_when_count_tokens_fails():
+    response = consume_json_stream(FakeStream(['{"a": 1}', ' resto']))
+
+    def failing_count():
+        raise RuntimeError("sin red")
+
+    estimate_usage(response, failing_count, reserved_prompt_tokens=50, reserved_output_tokens=10)
+    assert response.usage_metadata.prompt_token_count == 50
+    assert response.usage_metadata.candidates_token_count == 10
@@ -0,0 +1,82 @@
+"""
+Pruebas de la selección de API keys por cuota restante
+"""
+from google.api_core import exceptions as api_exceptions
+
+from processors.key_pool import ApiKeyPool, key_fingerprint
+
+def make_pool(keys=('key-a', 'key-b'), **overrides):
+    options = dict(rpm=10, tpm=1000, backoff_seconds=5, max_backoff_seconds=20)
+    options.update(overrides)
+    return ApiKeyPool(list(keys), **options)
+
+def test_select_reserves_request_and_tokens():
+    pool = make_pool(keys=('key-a',))
+    key = pool.select(100)
+    assert key.key_id == key_fingerprint('key-a')
+    assert key.rpm.tokens == 9
+    assert key.tpm.tokens == 900
+    assert key.usage["requests"] == 1
+
+def test_select_prefers_key_with_most_remaining_quota():
+    pool = make_pool()
+    first = pool.select(600)
+    # La otra key conserva toda su cuota TPM
+    assert pool.select(10) is not first
+
+def test_select_rotates_between_equal_keys():
+    pool = make_pool(rpm=0, tpm=0)
+    chosen = {pool.select().key_id for _ in range(4)}
+    assert chosen == set(pool.key_ids)
+
+def test_select_respects_usable_filter():
+    pool = make_pool()
+    allowed = pool.key_ids[1]
+    for _ in range(3):
+        assert pool.select(10, usable=lambda key_id: key_id == allowed).key_id == allowed
+
+def test_select_ignores_filter_when_no_key_is_usable():
+    pool = make_pool()
+    assert pool.select(10, usable=lambda key_id: False).key_id in pool.key_ids
+
+def test_rate_limited_key_cools_down_with_backoff():
+    pool = make_pool()
+    limited = pool.select(10)
+    pool.record_failure(limited, api_exceptions.ResourceExhausted("cuota"))
+    assert limited.backoff_seconds == 5
+    for _ in range(3):
+        assert pool.select(10) is not limited
+
+    pool.record_failure(limited, api_exceptions.ResourceExhausted("cuota"))
+    assert limited.backoff_seconds == 10
+    assert pool.stats()[limited.key_id]["cooling_down"]
+
+def test_all_keys_cooling_down_returns_first_to_recover():
+    pool = make_pool()
+    first, second = pool.keys
+    pool.record_failure(first, api_exceptions.TooManyRequests("429"))
+    pool.record_failure(second, api_exceptions.TooManyRequests("429"))
+    pool.record_failure(second, api_exceptions.TooManyRequests("429"))
+    assert pool.select(10) is first
+
+def test_other_errors_do_not_cool_down():
+    pool = make_pool(keys=('key-a',))
+    key = pool.select(10)
+    pool.record_failure(key, RuntimeError("timeout"))
+    assert key.cooldown_until == 0.0
+    assert key.usage["failures"] == 1
+
+def test_release_returns_reservation():
+    pool = make_pool(keys=('key-a',))
+    key = pool.select(100)
+    pool.release(key, 100)
+    assert key.rpm.tokens == 10
+    assert key.tpm.tokens == 1000
+    assert key.usage["requests"] == 0
+
+def test_record_success_adjusts_tpm_with_real_usage():
+    pool = make_pool(keys=('key-a',))
+    key = pool.select(100)
+    pool.record_success(key, 100, 40)
+    assert round(key.tpm.tokens) == 960
+    assert key.usage["tokens"] == 40
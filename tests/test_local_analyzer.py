@@ -0,0 +1,35 @@
+"""
+Pruebas de la detección local de servicios
+"""
+import pytest
+
+from generators.backstage_generator import BackstageGenerator
+from processors.local_analyzer import LocalAnalyzer, canonical_service
+
+ANALYZER = LocalAnalyzer(BackstageGenerator().aws_service_mappings.keys())
+
+def test_explicit_description_is_confident():
+    services, confidence = ANALYZER.detect("API Gateway + Lambda + DynamoDB")
+    assert services == ['API Gateway', 'Lambda', 'DynamoDB']
+    assert confidence >= ANALYZER.threshold
+
+@pytest.mark.parametrize("description, expected", [
+    ("S3 + Lambda sin RDS", ['S3', 'Lambda']),
+    ("API Gateway + Lambda, no RDS", ['API Gateway', 'Lambda']),
+    ("Lambda without SQS or SNS", ['Lambda']),
+    ("migrar de RDS a DynamoDB con Lambda", ['DynamoDB', 'Lambda']),
+])
+def test_negated_mentions_are_not_services(description, expected):
+    services, confidence = ANALYZER.detect(description)
+    assert services == expected
+    assert confidence < ANALYZER.threshold
+    assert ANALYZER.analyze(description) is None
+
+def test_negation_window_ends_at_connectors():
+    services, _ = ANALYZER.detect("sin servidores propios, con S3 y Lambda")
+    assert services == ['S3', 'Lambda']
+
+def test_canonical_service_ignores_prefix_and_spelling():
+    assert canonical_service("Amazon Route53") == canonical_service("Route 53") == 'Route 53'
+    assert canonical_service("AWS Lambda") == 'Lambda'
+    assert canonical_service("Simple Queue Service") == 'SQS'
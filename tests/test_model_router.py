@@ -0,0 +1,201 @@
+"""
+Pruebas del enrutado de modelos: hedging y su interacción con los circuit breakers
+"""
+import itertools
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from processors import llm
+from processors.circuit_breaker import breakers, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from processors.model_router import ModelRouter
+
+_names = itertools.count()
+
+class FakeCassette:
+    """Sustituye la llamada al proveedor: latencia y errores por modelo"""
+    replaying = False
+
+    def __init__(self, delays=None, errors=None):
+        self.delays = delays or {}
+        self.errors = errors or {}
+        self.calls = []
+
+    def generate_content(self, model, model_name, contents, key_contents=None, **kwargs):
+        self.calls.append(model_name)
+        time.sleep(self.delays.get(model_name, 0.0))
+        if model_name in self.errors:
+            raise self.errors[model_name]
+        return SimpleNamespace(text='{"services": []}', usage_metadata=SimpleNamespace(
+            prompt_token_count=10, candidates_token_count=5, total_token_count=15
+        ))
+
+@pytest.fixture
+def make_router(monkeypatch):
+    monkeypatch.setenv('GEMINI_API_KEY', 'clave-de-prueba')
+
+    def factory(models=2, **cassette):
+        # Nombres únicos: los breakers son globales por (modelo, key)
+        names = [f"modelo-{next(_names)}" for _ in range(models)]
+        router = ModelRouter('prueba', names)
+        router.streaming = False
+        router.explore_rate = 0.0
+        router.cassette = FakeCassette(**cassette)
+        return router
+    return factory
+
+def breaker_of(router, model_name):
+    return breakers.get(model_name, router.key_pool.key_ids[0])
+
+def force_half_open(breaker):
+    breaker.open_seconds = 0.01
+    for _ in range(breaker.min_calls):
+        breaker.record_failure()
+    assert breaker.state == OPEN
+    time.sleep(0.02)
+    assert breaker.state == HALF_OPEN
+
+def warm_up(router, model_name, latency_ms=100.0):
+    for _ in range(router.policies['dev'].min_samples):
+        router.stats[model_name].record(latency_ms, True)
+
+def enable_hedging(router, min_hedge_ms=50.0):
+    policy = router.policies['dev']
+    policy.hedge = True
+    policy.min_hedge_ms = min_hedge_ms
+
+def test_slow_primary_is_hedged_and_secondary_wins(make_router):
+    router = make_router()
+    primary, secondary = router.model_names
+    router.cassette.delays = {primary: 0.5, secondary: 0.01}
+    warm_up(router, primary, 10.0)
+    warm_up(router, secondary, 20.0)
+    enable_hedging(router)
+
+    _, model_name = router.generate("prompt")
+    assert model_name == secondary
+    assert router.stats[primary].snapshot()["hedges"] == 1
+    assert router.stats[secondary].snapshot()["hedge_wins"] == 1
+
+def test_fast_primary_is_not_hedged(make_router):
+    router = make_router()
+    primary, secondary = router.model_names
+    warm_up(router, primary, 10.0)
+    warm_up(router, secondary, 20.0)
+    enable_hedging(router, min_hedge_ms=500.0)
+
+    assert router.generate("prompt")[1] == primary
+    assert router.cassette.calls == [primary]
+
+def test_no_hedge_while_scheduler_has_backlog(make_router, monkeypatch):
+    router = make_router()
+    primary, secondary = router.model_names
+    router.cassette.delays = {primary: 0.2}
+    warm_up(router, primary, 10.0)
+    warm_up(router, secondary, 20.0)
+    enable_hedging(router)
+    monkeypatch.setattr(llm.scheduler, 'backlog', lambda: 3)
+
+    assert router.generate("prompt")[1] == primary
+    assert router.cassette.calls == [primary]
+    assert router.stats[primary].snapshot()["hedges_skipped"] == 1
+
+def test_open_breaker_sends_traffic_to_next_model(make_router):
+    router = make_router()
+    primary, secondary = router.model_names
+    breaker = breaker_of(router, primary)
+    breaker.open_seconds = 60
+    for _ in range(breaker.min_calls):
+        breaker.record_failure()
+
+    assert router.rank_models('dev')[-1] == primary
+    assert router.generate("prompt")[1] == secondary
+
+def test_rejected_call_returns_key_quota(make_router):
+    router = make_router(models=1)
+    model_name = router.model_names[0]
+    breaker = breaker_of(router, model_name)
+    breaker.open_seconds = 60
+    for _ in range(breaker.min_calls):
+        breaker.record_failure()
+    key = router.key_pool.keys[0]
+    requests_before = key.usage["requests"]
+
+    with pytest.raises(CircuitOpenError):
+        router._call(model_name, "prompt")
+    assert key.usage["requests"] == requests_before
+    assert router.cassette.calls == []
+
+def test_probe_failing_before_the_model_call_reopens_the_circuit(make_router):
+    router = make_router(models=1)
+    model_name = router.model_names[0]
+    breaker = breaker_of(router, model_name)
+    force_half_open(breaker)
+
+    def broken_lookup(*args):
+        raise RuntimeError("caché de contexto no disponible")
+
+    router.context_cache = SimpleNamespace(lookup=broken_lookup)
+    with pytest.raises(RuntimeError):
+        router._call(model_name, "prompt", prefix="preámbulo")
+    # La sonda no queda ocupada: el circuito vuelve a abrirse y admitirá otra sonda
+    assert breaker.state == OPEN
+    time.sleep(0.02)
+    assert breaker.allow_request()
+
+def test_probe_failing_after_the_model_answered_closes_the_circuit(make_router, monkeypatch):
+    router = make_router(models=1)
+    model_name = router.model_names[0]
+    breaker = breaker_of(router, model_name)
+    force_half_open(breaker)
+
+    def broken_record(*args):
+        raise RuntimeError("contabilidad")
+
+    monkeypatch.setattr(router.key_pool, 'record_success', broken_record)
+    with pytest.raises(RuntimeError):
+        router._call(model_name, "prompt")
+    assert breaker.state == CLOSED
+
+def test_model_errors_open_the_circuit(make_router):
+    router = make_router(models=1, errors={})
+    model_name = router.model_names[0]
+    router.cassette.errors = {model_name: RuntimeError("500")}
+    breaker = breaker_of(router, model_name)
+    for _ in range(breaker.min_calls):
+        with pytest.raises(RuntimeError):
+            router._call(model_name, "prompt")
+    assert breaker.state == OPEN
+
+def test_hedged_request_records_only_the_winner_latency(make_router, monkeypatch):
+    from processors import request_trace
+
+    monkeypatch.setenv('REQUEST_LEDGER_ENABLED', 'false')
+    router = make_router()
+    primary, secondary = router.model_names
+    router.cassette.delays = {primary: 0.3, secondary: 0.01}
+    warm_up(router, primary, 10.0)
+    warm_up(router, secondary, 20.0)
+    enable_hedging(router)
+
+    with request_trace.traced('/api/analyze/text') as trace:
+        assert router.generate("prompt")[1] == secondary
+        # La perdedora ya estaba en el proveedor: termina y se factura
+        time.sleep(0.4)
+
+    assert trace.llm_calls == 1
+    assert trace.hedges == 1
+    assert trace.model_name == secondary
+    assert trace.stages['llm'] < 200
+    assert trace.prompt_tokens == 20
+
+def test_cache_scope_covers_every_model_that_can_answer(make_router):
+    router = make_router(models=3)
+    assert router.cache_scope == ','.join(router.model_names)
+    assert router.primary_model_name == router.model_names[0]
+    # Misma preferencia, distinto respaldo: las respuestas cacheadas no se comparten
+    other = make_router(models=1)
+    other.model_names = [router.model_names[0], other.model_names[0]]
+    assert other.primary_model_name == router.primary_model_name
+    assert other.cache_scope != router.cache_scope
@@ -0,0 +1,39 @@
+"""
+Pruebas de la compactación de descripciones antes de enviarlas al modelo
+"""
+from processors.prompt_compactor import PromptCompactor, estimate_tokens
+
+def compact(text, max_tokens=2000):
+    return PromptCompactor(['s3', 'lambda', 'dynamodb'], max_tokens=max_tokens).compact(text)[0]
+
+def test_keeps_underscores_inside_resource_names():
+    result = compact("Los eventos van a la tabla user_events y al bucket `s3_bucket`.")
+    assert result == "Los eventos van a la tabla user_events y al bucket s3_bucket."
+
+def test_strips_only_paired_emphasis():
+    result = compact("Usar **Lambda** con *S3* y __DynamoDB__; el coste es 2 * 3 * 4 USD.")
+    assert result == "Usar Lambda con S3 y DynamoDB; el coste es 2 * 3 * 4 USD."
+
+def test_keeps_numbered_requirements():
+    text = "Requisitos:\n1. Subir fotos a S3.\n2) Procesarlas con Lambda.\n- Guardar metadatos"
+    assert compact(text) == "Requisitos:\n1. Subir fotos a S3.\n2) Procesarlas con Lambda.\nGuardar metadatos"
+
+def test_removes_boilerplate_and_repeated_paragraphs():
+    text = "# Arquitectura\n\nWeb con S3.\n\nPage 1 of 3\n\nWeb con S3.\n\n---\n\nConfidential draft"
+    assert compact(text) == "Arquitectura\n\nWeb con S3."
+
+def test_numbered_sentence_survives_budget_cut():
+    text = "1. Usar Lambda para procesar. 2. Un relleno largo sin servicios que no aporta nada. 3. Guardar en S3."
+    result = compact(text, max_tokens=14)
+    assert result == "1. Usar Lambda para procesar. 3. Guardar en S3."
+
+def test_budget_prioritizes_aws_mentions_and_tracks_stats():
+    compactor = PromptCompactor(['s3', 'lambda'], max_tokens=10)
+    text = "Texto de relleno sin nada útil aquí. Subir fotos a S3 con Lambda. Otro relleno más."
+    result, metrics = compactor.compact(text)
+    assert result == "Subir fotos a S3 con Lambda."
+    assert metrics["truncated"] is True
+    assert metrics["tokens_out"] == estimate_tokens(result) <= 10
+    stats = compactor.stats()
+    assert stats["requests"] == 1 and stats["truncated"] == 1
+    assert stats["tokens_saved"] == metrics["tokens_in"] - metrics["tokens_out"]
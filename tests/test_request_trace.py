@@ -0,0 +1,101 @@
+"""
+Pruebas de la traza por petición y su propagación a los pools de hilos
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from processors import llm, request_trace
+from processors.batcher import TextBatcher
+
+def response(prompt_tokens, output_tokens):
+    return SimpleNamespace(usage_metadata=SimpleNamespace(
+        prompt_token_count=prompt_tokens, candidates_token_count=output_tokens
+    ))
+
+@pytest.fixture
+def trace(monkeypatch):
+    """Traza activa sin persistencia y con precios conocidos"""
+    monkeypatch.setenv('REQUEST_LEDGER_ENABLED', 'false')
+    monkeypatch.setattr(request_trace, '_prices', {'modelo': (1.0, 2.0)})
+    with request_trace.traced('/api/analyze/text') as active:
+        yield active
+
+def test_record_llm_accumulates_tokens_and_cost(trace):
+    request_trace.record_llm('modelo', 120.0, response(1000, 500))
+    request_trace.record_llm('modelo', 30.0)
+    assert trace.llm_calls == 2
+    assert trace.stages['llm'] == 150.0
+    assert (trace.prompt_tokens, trace.output_tokens) == (1000, 500)
+    assert trace.cost_usd == pytest.approx(0.002)
+    assert trace.model_name == 'modelo'
+
+def test_record_llm_counts_estimated_usage(trace):
+    estimated = response(10, 5)
+    estimated.usage_estimated = True
+    request_trace.record_llm('modelo', 1.0, estimated)
+    assert trace.estimated_calls == 1
+
+def test_record_llm_without_trace_is_ignored():
+    assert request_trace.current() is None
+    request_trace.record_llm('modelo', 1.0, response(1, 1))
+
+def test_plain_executor_does_not_carry_the_trace(trace):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(request_trace.current).result() is None
+
+def test_submit_carries_the_trace(trace):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        llm.submit(executor, request_trace.record_llm, 'modelo', 5.0, response(10, 5)).result()
+    assert trace.llm_calls == 1
+    assert trace.prompt_tokens == 10
+
+def test_run_for_channel_carries_the_trace(trace):
+    for channel in ('dev', 'scaffolder'):
+        asyncio.run(llm.run_for_channel(channel, request_trace.record_llm, 'modelo', 1.0))
+    assert trace.llm_calls == 2
+
+def test_batched_calls_reach_the_caller_trace(trace):
+    def batch_fn(items, channel):
+        request_trace.record_llm('modelo', 2.0, response(20, 10))
+        return {item_id: {"services": []} for item_id, _ in items}
+
+    def single_fn(description, channel):
+        request_trace.record_llm('modelo', 1.0, response(5, 5))
+        return {"services": []}
+
+    batcher = TextBatcher(batch_fn, single_fn, max_items=2, window_ms=200, workers=1)
+    futures = [batcher.submit("S3 y Lambda"), batcher.submit("SQS y SNS")]
+    assert all(future.result(timeout=5) for future in futures)
+    assert trace.llm_calls == 1
+    assert trace.prompt_tokens == 20
+
+    assert batcher.analyze("DynamoDB") == {"services": []}
+    assert trace.llm_calls == 2
+
+def test_stage_adds_time_to_active_trace(trace):
+    with request_trace.stage('db'):
+        pass
+    assert 'db' in trace.stages
+
+def test_traces_of_concurrent_requests_stay_separate(monkeypatch):
+    monkeypatch.setenv('REQUEST_LEDGER_ENABLED', 'false')
+    executor = ThreadPoolExecutor(max_workers=4)
+    results = {}
+
+    def handle(name, calls):
+        with request_trace.traced(name) as active:
+            for _ in range(calls):
+                llm.submit(executor, request_trace.record_llm, 'modelo', 1.0).result()
+            results[name] = active.llm_calls
+
+    threads = [threading.Thread(target=handle, args=(f"/r{index}", index + 1)) for index in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    executor.shutdown()
+    assert results == {"/r0": 1, "/r1": 2, "/r2": 3}
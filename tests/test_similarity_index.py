@@ -0,0 +1,82 @@
+"""
+Pruebas de la búsqueda de descripciones equivalentes en el índice de similitud
+"""
+import pytest
+
+from generators.backstage_generator import BackstageGenerator
+from processors.local_analyzer import LocalAnalyzer
+from processors.similarity_index import SimilarityIndex
+
+DETECTOR = LocalAnalyzer(BackstageGenerator().aws_service_mappings.keys())
+
+@pytest.fixture
+def make_index(monkeypatch):
+    """Índice sin base de datos: el análisis guardado se sirve desde memoria"""
+    def factory(**options):
+        index = SimilarityIndex(services_of=lambda text: DETECTOR.detect(text)[0], enabled=True,
+                                path=options.pop('path', ''), **options)
+        monkeypatch.setattr(index, 'sync', lambda force=False: None)
+        monkeypatch.setattr(index, '_load_analysis', lambda analysis_id: {"id": analysis_id})
+        return index
+    return factory
+
+def test_finds_identical_description(make_index):
+    index = make_index()
+    index.add(1, "Aplicación web con S3 y Lambda para subir fotos", "templates/tpl-1")
+    match = index.find("Aplicación web con S3 y Lambda para subir fotos")
+    assert match["analysis_id"] == 1
+    assert match["template_id"] == "tpl-1"
+    assert match["similarity"] == 1.0
+    assert match["analysis"] == {"id": 1}
+
+def test_finds_rewording_above_threshold(make_index):
+    index = make_index()
+    index.add(1, "Aplicación web con S3 y Lambda para subir fotos de usuarios", "tpl-1")
+    index.add(2, "Pipeline de datos con SQS y DynamoDB para pedidos", "tpl-2")
+    match = index.find("Una aplicación web con S3 y Lambda para subir las fotos de los usuarios")
+    assert match is not None and match["analysis_id"] == 1
+
+def test_unrelated_description_is_below_threshold(make_index):
+    index = make_index()
+    index.add(1, "Aplicación web con S3 y Lambda para subir fotos", "tpl-1")
+    assert index.find("Pipeline de datos con SQS y DynamoDB para pedidos") is None
+    assert index.stats()["below_threshold"] == 1
+
+def test_different_services_are_not_reused(make_index):
+    index = make_index(threshold=0.5)
+    index.add(1, "Aplicación web con S3 y Lambda para subir fotos", "tpl-1")
+    assert index.find("Aplicación web con S3 y RDS para subir fotos") is None
+    assert index.stats()["service_mismatch"] == 1
+
+def test_description_without_services_is_not_reused(make_index):
+    index = make_index()
+    index.add(1, "Una aplicación para gestionar facturas de clientes", "tpl-1")
+    assert index.find("Una aplicación para gestionar facturas de clientes") is None
+    assert index.stats()["no_services"] == 1
+
+def test_degraded_analyses_are_not_indexed(make_index):
+    index = make_index()
+    index.add(1, "Aplicación web con S3 y Lambda", "tpl-1", {"degraded": True})
+    assert index.find("Aplicación web con S3 y Lambda") is None
+    assert index.stats()["documents"] == 0
+
+def test_most_recent_wins_between_equal_scores(make_index):
+    index = make_index()
+    index.add(1, "API con API Gateway y Lambda", "tpl-1")
+    index.add(2, "API con API Gateway y Lambda", "tpl-2")
+    assert index.find("API con API Gateway y Lambda")["analysis_id"] == 2
+
+def test_disabled_index_finds_nothing():
+    index = SimilarityIndex(enabled=False)
+    index.add(1, "Aplicación web con S3 y Lambda", "tpl-1")
+    assert index.find("Aplicación web con S3 y Lambda") is None
+
+def test_persisted_index_is_reloaded(make_index, tmp_path):
+    path = str(tmp_path / "index.npz")
+    index = make_index(path=path)
+    index.add(1, "Aplicación web con S3 y Lambda para subir fotos", "tpl-1")
+    index.save()
+
+    reloaded = make_index(path=path)
+    match = reloaded.find("Aplicación web con S3 y Lambda para subir fotos")
+    assert match is not None and match["template_ref"] == "tpl-1"
@@ -0,0 +1,55 @@
+"""
+Pruebas de la coalescencia de llamadas idénticas en vuelo
+"""
+import threading
+
+from processors.singleflight import SingleFlight
+
+def test_concurrent_calls_share_one_execution_and_its_updates():
+    flight = SingleFlight()
+    leader_running, release = threading.Event(), threading.Event()
+    received = {"leader": [], "follower": []}
+    results = {}
+
+    def work(publish):
+        publish(['S3'])
+        leader_running.set()
+        release.wait(5)
+        publish(['S3', 'Lambda'])
+        return {"services": ['S3', 'Lambda']}
+
+    def call(name):
+        results[name] = flight.do('dev:clave', work, lambda update: flight.publish('dev:clave', update),
+                                  listener=received[name].append)
+
+    leader = threading.Thread(target=call, args=("leader",))
+    leader.start()
+    leader_running.wait(5)
+    follower = threading.Thread(target=call, args=("follower",))
+    follower.start()
+    while flight.stats()["coalesced"] == 0:
+        pass
+    release.set()
+    leader.join()
+    follower.join()
+
+    # El que llega tarde recibe también los avisos anteriores a su llegada
+    assert received["leader"] == received["follower"] == [['S3'], ['S3', 'Lambda']]
+    assert results["leader"] == results["follower"]
+    assert results["leader"] is not results["follower"]
+    assert flight.stats() == {"calls": 2, "executions": 1, "coalesced": 1, "in_flight": 0}
+
+def test_failing_listener_does_not_break_the_execution():
+    flight = SingleFlight()
+
+    def work(publish):
+        publish(['S3'])
+        return 42
+
+    def broken(update):
+        raise RuntimeError("fallo del llamador")
+
+    assert flight.do('k', work, lambda update: flight.publish('k', update), listener=broken) == 42
+
+def test_publish_without_flight_is_ignored():
+    SingleFlight().publish('nadie', ['S3'])